@@ -0,0 +1,135 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict
+from utils.config import config
+from utils.metrics import registry
+
+
+class Busy(Exception):
+    """Raised when a turn is rejected because too much work is already queued"""
+
+
+class WaitStats:
+    """Running count, total and maximum of wait times in seconds"""
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds: float):
+        self.count += 1
+        self.total += seconds
+        self.max = max(self.max, seconds)
+
+    @property
+    def mean(self) -> float:
+        return self.total / self.count if self.count else 0.0
+
+
+class ConcurrencyLimiter:
+    """Async semaphore that keeps track of how many callers run and wait, and for how long"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self._semaphore = asyncio.Semaphore(limit)
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.waiting = 0
+        self.wait = WaitStats()
+
+    async def __aenter__(self):
+        start = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._semaphore.acquire()
+        finally:
+            self.waiting -= 1
+        self.wait.record(time.monotonic() - start)
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.in_flight -= 1
+        self._semaphore.release()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "limit": self.limit,
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "waiting": self.waiting,
+            "wait_seconds_total": self.wait.total,
+            "wait_seconds_mean": self.wait.mean,
+            "wait_seconds_max": self.wait.max,
+        }
+
+
+class AdmissionController:
+    """
+    Runs the turns of one conversation one at a time, in arrival order, and
+    rejects new turns outright once a conversation, or the whole process,
+    has too many turns queued.
+    """
+
+    def __init__(self, max_queue_depth: int = 3, max_pending_turns: int = 200):
+        self.max_queue_depth = max_queue_depth
+        self.max_pending_turns = max_pending_turns
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._depths: Dict[str, int] = {}
+        self.pending = 0
+        self.admitted = 0
+        self.rejected = 0
+        self.wait = WaitStats()
+
+    def queue_depth(self, conversation_id: str) -> int:
+        return self._depths.get(conversation_id, 0)
+
+    @asynccontextmanager
+    async def turn(self, conversation_id: str):
+        """Wait for this conversation's earlier turns to finish. Raises Busy instead of queueing too deep."""
+        depth = self._depths.get(conversation_id, 0)
+        if depth >= self.max_queue_depth or self.pending >= self.max_pending_turns:
+            self.rejected += 1
+            raise Busy(f"{depth} turns already queued for this conversation, {self.pending} in total")
+
+        self._depths[conversation_id] = depth + 1
+        self.pending += 1
+        lock = self._locks.setdefault(conversation_id, asyncio.Lock())
+        start = time.monotonic()
+        try:
+            # asyncio.Lock wakes waiters in FIFO order
+            async with lock:
+                self.wait.record(time.monotonic() - start)
+                self.admitted += 1
+                yield
+        finally:
+            self.pending -= 1
+            self._depths[conversation_id] -= 1
+            if not self._depths[conversation_id]:
+                del self._depths[conversation_id]
+                del self._locks[conversation_id]
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "conversations": len(self._depths),
+            "pending": self.pending,
+            "max_queue_depth": max(self._depths.values(), default=0),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "wait_seconds_total": self.wait.total,
+            "wait_seconds_mean": self.wait.mean,
+            "wait_seconds_max": self.wait.max,
+        }
+
+
+admission = AdmissionController(
+    max_queue_depth=config.admission.max_queue_depth,
+    max_pending_turns=config.admission.max_pending_turns
+)
+llm_limiter = ConcurrencyLimiter(config.admission.max_concurrent_llm_calls)
+
+registry.register_collector("admission", admission.stats)
+registry.register_collector("llm_limiter", llm_limiter.stats)
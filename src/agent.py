@@ -1,66 +1,275 @@
-from typing import List
+import asyncio
+import threading
+from dataclasses import dataclass
+from typing import AsyncIterator, Dict, List, Optional
 from langchain_core.output_parsers import StrOutputParser
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnableLambda
-from utils.context_manager import load_procedures, get_procedures_metadata
-from langchain_google_genai import ChatGoogleGenerativeAI
+from langchain_core.runnables import Runnable, RunnableLambda
+from utils.corpus import CorpusManager, CorpusSnapshot
+from utils.retrieval import format_chunks, load_embedding
+from utils.tokens import truncate_tokens
+from utils.config import config as settings
 from pathlib import Path
 from langchain_core.tools import tool
-from langgraph.prebuilt import create_react_agent
 from utils.io_manager import get_env
-from langchain.globals import set_debug
 from utils.logger import logger
+from admission import llm_limiter
+from llm import KNOWLEDGE_BASE_TAG, CircuitBreaker, LimitedChatModel, ResilientChatModel, TokenUsage, TurnMetrics
+from store import DB_DIR, answer_cache
+from utils.metrics import registry, span
+from langchain_core.runnables import RunnableConfig
+# from langchain.globals import set_debug
 # set_debug(True)
 
-main_model = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash-lite-preview-06-17",
-    temperature=0.1,
-    max_retries=2,
-    google_api_key=get_env("MAIN_GOOGLE_API_KEY")
+corpus = CorpusManager(
+    "procedures",
+    chunk_tokens=settings.knowledge_base.chunk_tokens,
+    embedding=load_embedding(settings.knowledge_base.embedding),
+    reload_interval=settings.knowledge_base.reload_interval,
+    snapshot_path=DB_DIR / f"{settings.knowledge_base.snapshot}.snapshot" if settings.knowledge_base.snapshot else None,
+    workers=settings.knowledge_base.ingest_workers
 )
 
-with open(Path("resources/prompts/base_prompt.txt"), "r") as f:
-    template = f.read()
-template = get_env("AGENT_PROMPT", default=template)
 
-base_prompt = ChatPromptTemplate.from_template(
-    template=template
-)
+@dataclass
+class Runtime:
+    """The models, prompts and chains, built once on first use or by warm_up()"""
+    main_model: ResilientChatModel
+    tool_model: ResilientChatModel
+    base_prompt: ChatPromptTemplate
+    tool_chain: Runnable
+    map_chain: Runnable
+    reduce_chain: Runnable
+    summary_chain: Runnable
+    agent_executor: Runnable
+    main_chain: Runnable
 
-tool_model = ChatGoogleGenerativeAI(
-    model="gemini-2.5-flash-lite-preview-06-17",
-    temperature=0.1,
-    max_tokens=None,
-    timeout=None,
-    max_retries=2,
-    google_api_key=get_env("TOOL_GOOGLE_API_KEY")
-)
 
-with open(Path("resources/prompts/knowledge_base_prompt.txt"), "r") as f:
-    template = f.read()
-template = get_env("KNOWLEDGE_BASE_PROMPT", default=template)
+# What a shard answers in sharded mode when it has nothing on the query
+NO_RELEVANT_INFO = "NO_RELEVANT_INFO"
+NO_ANSWER = "I could not find any information about this in the knowledge base."
 
-knowledge_base_prompt = ChatPromptTemplate.from_template(
-    template=template
-)
+_runtime: Optional[Runtime] = None
+_runtime_lock = threading.Lock()
+_warm_up_task: Optional[asyncio.Task] = None
+
+def _read_prompt(file_name: str, env_name: str) -> ChatPromptTemplate:
+    with open(Path("resources/prompts") / file_name, "r") as f:
+        template = f.read()
+    template = get_env(env_name, default=template)
+
+    return ChatPromptTemplate.from_template(
+        template=template
+    )
+
+def build_runtime() -> Runtime:
+    """
+    Import the model and agent libraries and build everything. Blocking and
+    thread-safe; the first caller builds, later callers get the same Runtime.
+    """
+    global _runtime
+    with _runtime_lock:
+        if _runtime is not None:
+            return _runtime
+
+        # Imported here so that importing this module stays cheap
+        from langchain_google_genai import ChatGoogleGenerativeAI
+        from langgraph.prebuilt import create_react_agent
+
+        # One client per API key; each model prefers its own key and hedges or fails over to the other
+        clients = {
+            name: ChatGoogleGenerativeAI(
+                model="gemini-2.5-flash-lite-preview-06-17",
+                temperature=0.1,
+                max_retries=2,
+                google_api_key=get_env(f"{name.upper()}_GOOGLE_API_KEY")
+            )
+            for name in ("main", "tool")
+        }
+        breakers = {
+            name: CircuitBreaker(settings.llm.breaker_failures, settings.llm.breaker_reset)
+            for name in clients
+        }
+
+        # Every backend call holds a slot, hedges and failovers included, so they count against the cap too
+        limited = {name: LimitedChatModel(inner=client, limiter=llm_limiter) for name, client in clients.items()}
+
+        def resilient(label: str, order: List[str]) -> ResilientChatModel:
+            model = ResilientChatModel(
+                backends=[limited[name] for name in order],
+                backend_names=order,
+                breakers=[breakers[name] for name in order],
+                label=label,
+                deadline=settings.llm.deadline,
+                hedge_percentile=settings.llm.hedge_percentile,
+                hedge_min_delay=settings.llm.hedge_min_delay,
+                hedge_initial_delay=settings.llm.hedge_initial_delay,
+            )
+            registry.register_collector(f"{label}_model", model.stats)
+            return model
+
+        main_model = resilient("main", ["main", "tool"])
+        tool_model = resilient("tool", ["tool", "main"])
 
-context = load_procedures("procedures")
-tool_chain = knowledge_base_prompt | tool_model | StrOutputParser()
+        base_prompt = _read_prompt("base_prompt.txt", "AGENT_PROMPT")
+        knowledge_base_prompt = _read_prompt("knowledge_base_prompt.txt", "KNOWLEDGE_BASE_PROMPT")
+        summary_prompt = _read_prompt("summary_prompt.txt", "SUMMARY_PROMPT")
+        map_prompt = _read_prompt("knowledge_base_map_prompt.txt", "KNOWLEDGE_BASE_MAP_PROMPT")
+        reduce_prompt = _read_prompt("knowledge_base_reduce_prompt.txt", "KNOWLEDGE_BASE_REDUCE_PROMPT")
+
+        tool_chain = (knowledge_base_prompt | tool_model | StrOutputParser()).with_config(tags=[KNOWLEDGE_BASE_TAG])
+        agent_executor = create_react_agent(main_model, tools)
+
+        _runtime = Runtime(
+            main_model=main_model,
+            tool_model=tool_model,
+            base_prompt=base_prompt,
+            tool_chain=tool_chain,
+            map_chain=(map_prompt | tool_model | StrOutputParser()).with_config(tags=[KNOWLEDGE_BASE_TAG]),
+            reduce_chain=(reduce_prompt | tool_model | StrOutputParser()).with_config(tags=[KNOWLEDGE_BASE_TAG]),
+            summary_chain=summary_prompt | tool_model | StrOutputParser(),
+            agent_executor=agent_executor,
+            main_chain=base_prompt | agent_executor | RunnableLambda(extract_final_answer) | StrOutputParser() | RunnableLambda(add_links),
+        )
+        logger.info("Models and agent ready")
+        return _runtime
+
+async def get_runtime() -> Runtime:
+    """The Runtime, built in a worker thread if warm_up() has not finished yet"""
+    if _runtime is not None:
+        return _runtime
+    return await asyncio.to_thread(build_runtime)
+
+async def _warm_up():
+    try:
+        await get_runtime()
+    except Exception:
+        logger.exception("Failed to build the models, retrying on the first message")
+
+async def warm_up(_app=None):
+    """Build the runtime in the background so startup does not wait for it"""
+    global _warm_up_task
+    if _warm_up_task is None:
+        _warm_up_task = asyncio.create_task(_warm_up())
+
+def readiness() -> Dict[str, bool]:
+    return {"models": _runtime is not None, "corpus": corpus.is_loaded}
+
+def is_ready() -> bool:
+    return all(readiness().values())
+
+def knowledge_base_context(query: str, snapshot: Optional[CorpusSnapshot] = None) -> str:
+    """Select the corpus chunks for a query and render them for the knowledge base prompt"""
+    with span("retrieval"):
+        snapshot = snapshot or corpus.snapshot
+        top_k, token_budget = settings.knowledge_base.top_k, settings.knowledge_base.token_budget
+        chunks = snapshot.index.search(query, top_k=top_k, token_budget=token_budget)
+        fallback = None
+        if not chunks:
+            chunks, fallback = snapshot.index.fallback(query, top_k=top_k, token_budget=token_budget)
+        context = format_chunks(chunks)
+    logger.info(f"Searching knowledge base for query: {query}")
+    if fallback is not None:
+        logger.info(f"No chunk matched the query's terms, used the {fallback} fallback")
+    elif not chunks:
+        logger.warning(f"No chunk matched the query's terms and the corpus does not fit the token budget: {query}")
+    logger.info(
+        f"Selected {len(chunks)}/{len(snapshot.index.chunks)} chunks, "
+        f"{sum(c.tokens for c in chunks)}/{snapshot.index.total_tokens} tokens "
+        f"from corpus v{snapshot.version}"
+    )
+    return context
 
 @tool
-async def search_knowledge_base(query: str) -> str:
+async def search_knowledge_base(query: str, config: RunnableConfig) -> str:
     """
     Answer user queries using internal company knowledge.
     """
-    logger.info(f"Searching knowledge base for query: {query}")
-    logger.info(f"Context length: {len(context)} characters")
-    return await tool_chain.ainvoke({
-        "query": query,
-        "context": context
-    })
-    
+    return await knowledge_base_answer(query, config)
+
+async def knowledge_base_answer(query: str, config: Optional[RunnableConfig] = None) -> str:
+    """
+    The knowledge base chain's answer to `query`. Identical queries in flight
+    share one model call, and answers are cached per corpus version.
+    """
+    runtime = await get_runtime()
+    snapshot = await corpus.wait_loaded()
+
+    async def compute():
+        usage = TokenUsage()
+        async with span("knowledge_base_llm"):
+            if settings.knowledge_base.mode == "sharded":
+                answer = await sharded_answer(
+                    query,
+                    snapshot,
+                    runtime.map_chain.with_config(callbacks=[usage]),
+                    runtime.reduce_chain.with_config(callbacks=[usage]),
+                    config
+                )
+            else:
+                context = knowledge_base_context(query, snapshot)
+                answer = await runtime.tool_chain.with_config(callbacks=[usage]).ainvoke({
+                    "query": query,
+                    "context": context
+                }, config=config)
+        return answer, usage.tokens
+
+    return await answer_cache.get_or_compute(query, snapshot.digest, compute)
+
+async def sharded_answer(
+    query: str,
+    snapshot: CorpusSnapshot,
+    map_chain: Runnable,
+    reduce_chain: Runnable,
+    config: Optional[RunnableConfig] = None
+) -> str:
+    """
+    Map-reduce over the whole corpus: ask every shard concurrently, at most
+    max_parallel_shards at a time, drop the shards with nothing relevant and
+    merge the remaining partial answers with one more call.
+    """
+    shards = snapshot.shards(settings.knowledge_base.shard_tokens)
+    semaphore = asyncio.Semaphore(settings.knowledge_base.max_parallel_shards)
+
+    async def ask(context: str) -> str:
+        async with semaphore:
+            return await map_chain.ainvoke({"query": query, "context": context}, config=config)
+
+    with span("knowledge_base_map"):
+        results = await asyncio.gather(*(ask(context) for context in shards), return_exceptions=True)
+
+    failed = [r for r in results if isinstance(r, Exception)]
+    if failed and len(failed) == len(results):
+        raise failed[0]
+    partials = [r.strip() for r in results if not isinstance(r, Exception)]
+    relevant = [p for p in partials if p and not p.startswith(NO_RELEVANT_INFO)]
+    logger.info(
+        f"Sharded search for query: {query}: {len(relevant)}/{len(shards)} shards relevant, {len(failed)} failed"
+    )
+
+    if not relevant:
+        return NO_ANSWER
+    if len(relevant) == 1:
+        return relevant[0]
+    with span("knowledge_base_reduce"):
+        return await reduce_chain.ainvoke({
+            "query": query,
+            "answers": "\n".join(f"<answer part={i}>{p}</answer>" for i, p in enumerate(relevant, 1))
+        }, config=config)
+
+async def summarize(summary: Optional[str], messages: List[str], max_tokens: int) -> str:
+    """Fold messages, oldest first, into the rolling summary of a conversation"""
+    runtime = await get_runtime()
+    async with span("summary_llm"):
+        result = await runtime.summary_chain.ainvoke({
+            "summary": summary or "(none)",
+            "messages": "\n".join(messages),
+            # Roughly 1.5 of our tokens per word
+            "max_words": max(20, max_tokens * 2 // 3)
+        })
+    return truncate_tokens(result.strip(), max_tokens)
+
 tools = [search_knowledge_base]
-agent_executor = create_react_agent(main_model, tools)
 
 def extract_final_answer(result: dict) -> str:
     for message in reversed(result["messages"]):
@@ -69,21 +278,109 @@ def extract_final_answer(result: dict) -> str:
     raise ValueError("No AIMessage found in messages.")
 
 def add_links(response: str) -> str:
-    metadata = get_procedures_metadata()
-    for name, url in metadata.items():
-        response = response.replace(name.strip(), f"[{name}]({url})")
-    return response
-
-main_chain = base_prompt | agent_executor | RunnableLambda(extract_final_answer) | StrOutputParser() | RunnableLambda(add_links)
+    with span("add_links"):
+        return corpus.snapshot.link_matcher.apply(response)
 
 async def ainvoke(query: str, user_messages: List[str]):
-    return await main_chain.ainvoke({
+    runtime = await get_runtime()
+    await corpus.wait_loaded()
+    turn_metrics = TurnMetrics()
+    try:
+        return await runtime.main_chain.ainvoke({
+            "query": query,
+            "conversation_history": user_messages,
+        }, config={"callbacks": [turn_metrics]})
+    finally:
+        turn_metrics.record()
+
+async def astream(query: str, user_messages: List[str]) -> AsyncIterator[str]:
+    """
+    Stream the agent's answer. Yields the answer text accumulated so far
+    whenever the main model produces tokens, and finally the complete
+    answer with links added.
+    """
+    runtime = await get_runtime()
+    await corpus.wait_loaded()
+    prompt = await runtime.base_prompt.ainvoke({
         "query": query,
         "conversation_history": user_messages,
     })
 
+    turn_metrics = TurnMetrics()
+    text, message_id, state = "", None, None
+    try:
+        async for mode, payload in runtime.agent_executor.astream(
+            prompt,
+            config={"callbacks": [turn_metrics]},
+            stream_mode=["messages", "values"]
+        ):
+            if mode == "values":
+                state = payload
+                continue
+
+            chunk, metadata = payload
+            # Tokens from the knowledge base tool's own model call are not part of the answer
+            if metadata.get("langgraph_node") != "agent" or not isinstance(chunk.content, str):
+                continue
+            # Every model call in the ReAct loop starts a new message; only the last one is the answer
+            if chunk.id != message_id:
+                text, message_id = "", chunk.id
+            if chunk.content:
+                text += chunk.content
+                yield text
+    finally:
+        turn_metrics.record()
+
+    yield add_links(extract_final_answer(state))
+
+async def ainvoke_knowledge_base(query: str) -> str:
+    """Answer a standalone question with one knowledge base model call, skipping the agent"""
+    turn_metrics = TurnMetrics()
+    try:
+        response = await knowledge_base_answer(query, {"callbacks": [turn_metrics]})
+    finally:
+        turn_metrics.record()
+    return add_links(response)
+
+async def astream_knowledge_base(query: str) -> AsyncIterator[str]:
+    """Like ainvoke_knowledge_base, but yields the answer text so far, then the answer with links"""
+    if settings.knowledge_base.mode == "sharded":
+        # Shard answers are merged before anything can be shown
+        yield await ainvoke_knowledge_base(query)
+        return
+
+    runtime = await get_runtime()
+    snapshot = await corpus.wait_loaded()
+    flight = await answer_cache.lead(query, snapshot.digest)
+    if flight.answer is not None:
+        yield add_links(flight.answer)
+        return
+
+    context = knowledge_base_context(query, snapshot)
+    turn_metrics = TurnMetrics()
+    usage = TokenUsage()
+    text = ""
+    try:
+        async with span("knowledge_base_llm") as llm_span:
+            async for chunk in runtime.tool_chain.astream({
+                "query": query,
+                "context": context
+            }, config={"callbacks": [turn_metrics, usage]}):
+                if chunk:
+                    text += chunk
+                    # The caller's handling of the part is not model time
+                    with llm_span.paused():
+                        yield text
+    except BaseException:
+        flight.fail()
+        raise
+    finally:
+        turn_metrics.record()
+    await flight.finish(text, usage.tokens)
+    yield add_links(text)
+
 if __name__ == "__main__":
-    import asyncio
+    corpus.load()
     query = "What is the procedure for onboarding a new employee?"
     user_messages = ["Hello, I need help with onboarding."]
     response = asyncio.run(ainvoke(query, user_messages))
@@ -1,34 +1,96 @@
-from pathlib import Path
+from typing import AsyncIterator, Optional
 import agent as agent
-from db import AsyncChatStore
+from db import ChatTurn, new_turn_id
+import time
+from history_builder import HistoryBuilder
+from router import KNOWLEDGE_BASE, SMALL_TALK, Router, load_scorer
+from store import DB_DIR, history
 from utils.config import config
+from utils.logger import logger
+from utils.metrics import Stopwatch, registry, span
 
-DB_DIR = Path(config.app.dir) / "db"
-DB_DIR.mkdir(parents=True, exist_ok=True)
-CONNECTION_STRING = str(DB_DIR / f"{config.db.file}.sqlite")
+history_builder = HistoryBuilder(
+    history,
+    summarize=agent.summarize,
+    token_budget=config.conversation_history.token_budget,
+    summary_tokens=config.conversation_history.summary_tokens,
+    refresh=config.conversation_history.summarize
+)
+registry.register_collector("history_builder", history_builder.stats)
 
-async def invoke_agent(user_id: str, question: str):
-    DB_DIR.mkdir(parents=True, exist_ok=True)
+router = Router(
+    agent.corpus,
+    scorer=load_scorer(config.router.scorer),
+    threshold=config.router.threshold,
+    max_small_talk_words=config.router.max_small_talk_words,
+    enabled=config.router.enabled
+)
+registry.register_collector("router", router.stats)
 
-    async with AsyncChatStore(CONNECTION_STRING) as store:
-        user_messages = [x.message for x in await store.get_messages(user_id)]
+async def invoke_agent(user_id: str, question: str, turn_id: str = None):
+    route = router.route(question)
+    start = time.perf_counter()
+    if route.name == SMALL_TALK:
+        result = route.reply
+    elif route.name == KNOWLEDGE_BASE:
+        result = await agent.ainvoke_knowledge_base(question)
+    else:
+        async with span("history_read"):
+            user_messages = await history_builder.build(user_id)
 
-        result = await agent.ainvoke(question, user_messages)
+        async with span("agent"):
+            result = await agent.ainvoke(question, user_messages)
+    elapsed = time.perf_counter() - start
+    router.observe(route, elapsed)
+    logger.info(f"Answered by the {route.name} route in {elapsed:.2f}s")
 
-        async with store.transaction() as transaction:
-            await transaction.add_message(user_id, f"User: {question}")
-            await transaction.add_message(user_id, f"Agent: {result}")
+    async with span("history_write"):
+        await history.add_turn(user_id, turn_id or new_turn_id(), question, result)
+    history_builder.schedule_refresh(user_id)
 
     return result
 
-async def new_session(user_id: str):
-    DB_DIR.mkdir(parents=True, exist_ok=True)
+async def stream_agent(user_id: str, question: str, turn_id: str = None) -> AsyncIterator[str]:
+    """
+    Like invoke_agent, but yields the answer text so far as it is generated.
+    The time the caller takes to handle each part, e.g. to send it, is not
+    counted in the stage and route timings.
+    """
+    route = router.route(question)
+    clock = Stopwatch()
+    result = ""
+    if route.name == SMALL_TALK:
+        result = route.reply
+        with clock.paused():
+            yield result
+    elif route.name == KNOWLEDGE_BASE:
+        async for result in agent.astream_knowledge_base(question):
+            with clock.paused():
+                yield result
+    else:
+        async with span("history_read"):
+            user_messages = await history_builder.build(user_id)
+
+        async with span("agent") as agent_span:
+            async for result in agent.astream(question, user_messages):
+                with clock.paused(), agent_span.paused():
+                    yield result
+    elapsed = clock.elapsed
+    router.observe(route, elapsed)
+    logger.info(f"Answered by the {route.name} route in {elapsed:.2f}s")
+
+    async with span("history_write"):
+        await history.add_turn(user_id, turn_id or new_turn_id(), question, result)
+    history_builder.schedule_refresh(user_id)
 
-    async with AsyncChatStore(CONNECTION_STRING) as store:
-        async with store.transaction() as transaction:
-            res = await transaction.delete_all_messages(user_id)
-            print(f"Deleted {res} messages for user {user_id}")
-            return res
+async def get_turn(user_id: str, turn_id: str) -> Optional[ChatTurn]:
+    """Resolve a turn id from a feedback card; turns of other conversations are not returned"""
+    return await history.get_turn(turn_id, user_id)
+
+async def new_session(user_id: str):
+    res = await history.delete_all_messages(user_id)
+    logger.info(f"Deleted {res} messages for user {user_id}")
+    return res
     
 if __name__ == "__main__":
-    print(DB_DIR)
\ No newline at end of file
+    print(DB_DIR)
@@ -0,0 +1,234 @@
+import asyncio
+import re
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Awaitable, Callable, Dict, Optional, Tuple
+import aiosqlite
+from utils.logger import logger
+
+_WORD_RE = re.compile(r"[\w']+")
+
+
+def normalize_query(query: str) -> str:
+    """Lowercased words of the query, so case, spacing and punctuation do not matter"""
+    return " ".join(_WORD_RE.findall(query.lower()))
+
+
+@dataclass
+class CachedAnswer:
+    answer: str
+    # Prompt and completion tokens the answer cost, i.e. what a hit saves
+    tokens: int
+    created_at: float
+
+
+class Flight:
+    """
+    One computation of an answer, returned by `AnswerCache.lead`. If `answer`
+    is set the cache already had it; otherwise the caller computes it and
+    reports back with `finish()`, or `fail()` if it could not, so that
+    callers waiting on it compute it themselves.
+    """
+
+    def __init__(self, cache: "AnswerCache", key: Optional[str], answer: Optional[str] = None):
+        self.cache = cache
+        self.key = key
+        self.answer = answer
+
+    async def finish(self, answer: str, tokens: int):
+        self.answer = answer
+        if self.key is not None:
+            await self.cache._finish(self.key, CachedAnswer(answer, tokens, time.time()))
+
+    def fail(self):
+        if self.key is not None:
+            self.cache._fail(self.key)
+
+
+class AnswerCache:
+    """
+    Answers of the knowledge base chain, keyed by the normalized query and the
+    corpus digest, so that a change to the procedures invalidates them.
+
+    Identical queries that arrive while one is being answered wait for that
+    answer instead of calling the model again (singleflight). Finished
+    answers are kept in an LRU of `max_entries` for `ttl` seconds and, when
+    `db_path` is set, in a SQLite file so they survive restarts and are
+    shared by worker processes.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl: float = 3600.0,
+        db_path: Optional[str] = None,
+        enabled: bool = True,
+    ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.db_path = db_path
+        self.enabled = enabled
+        self._db = None
+
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+        self.hits = 0
+        self.coalesced = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expired = 0
+        self.tokens_saved = 0
+
+    async def open(self):
+        if self._db is not None or not self.db_path:
+            return
+
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._db = await aiosqlite.connect(self.db_path)
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._db.execute("PRAGMA synchronous=NORMAL")
+        await self._db.execute("""
+            CREATE TABLE IF NOT EXISTS answer_cache (
+                key TEXT PRIMARY KEY,
+                answer TEXT NOT NULL,
+                tokens INTEGER NOT NULL,
+                created_at REAL NOT NULL
+            ) WITHOUT ROWID
+        """)
+        await self._db.execute("DELETE FROM answer_cache WHERE created_at < ?", (time.time() - self.ttl,))
+        await self._db.commit()
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    @staticmethod
+    def key(query: str, digest: str) -> str:
+        return f"{digest}:{normalize_query(query)}"
+
+    def _get(self, key: str) -> Optional[CachedAnswer]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if time.time() - entry.created_at > self.ttl:
+            del self._entries[key]
+            self.expired += 1
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _put(self, key: str, entry: CachedAnswer):
+        self._entries[key] = entry
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+
+    async def _load(self, key: str) -> Optional[CachedAnswer]:
+        async with self._db.execute(
+            "SELECT answer, tokens, created_at FROM answer_cache WHERE key = ? AND created_at >= ?",
+            (key, time.time() - self.ttl)
+        ) as cursor:
+            row = await cursor.fetchone()
+        return CachedAnswer(*row) if row else None
+
+    def _hit(self, entry: CachedAnswer) -> str:
+        self.hits += 1
+        self.tokens_saved += entry.tokens
+        return entry.answer
+
+    async def lead(self, query: str, digest: str) -> Flight:
+        """
+        The cached answer to `query` under corpus `digest`, waiting for an
+        identical query in flight if there is one. On a miss the returned
+        Flight has no answer and the caller is expected to compute it.
+        """
+        if not self.enabled:
+            return Flight(self, None)
+
+        key = self.key(query, digest)
+        checked_db = self._db is None
+        while True:
+            entry = self._get(key)
+            if entry is not None:
+                return Flight(self, key, self._hit(entry))
+
+            future = self._inflight.get(key)
+            if future is not None:
+                try:
+                    await asyncio.shield(future)
+                except BaseException:
+                    if not future.done():
+                        raise
+                if future.cancelled():
+                    # The call we waited for failed; look again, then answer it ourselves
+                    continue
+                entry = future.result()
+                self.coalesced += 1
+                self.tokens_saved += entry.tokens
+                return Flight(self, key, entry.answer)
+
+            if not checked_db:
+                checked_db = True
+                entry = await self._load(key)
+                if entry is not None:
+                    self._put(key, entry)
+                continue
+
+            self.misses += 1
+            self._inflight[key] = asyncio.get_running_loop().create_future()
+            return Flight(self, key)
+
+    async def _finish(self, key: str, entry: CachedAnswer):
+        self._put(key, entry)
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.set_result(entry)
+        if self._db is not None:
+            try:
+                await self._db.execute(
+                    "INSERT OR REPLACE INTO answer_cache VALUES (?, ?, ?, ?)",
+                    (key, entry.answer, entry.tokens, entry.created_at)
+                )
+                await self._db.commit()
+            except Exception:
+                logger.exception("Failed to persist a cached answer")
+
+    def _fail(self, key: str):
+        future = self._inflight.pop(key, None)
+        if future is not None and not future.done():
+            future.cancel()
+
+    async def get_or_compute(
+        self, query: str, digest: str, compute: Callable[[], Awaitable[Tuple[str, int]]]
+    ) -> str:
+        """The cached answer, or the one `compute` returns with the tokens it used"""
+        flight = await self.lead(query, digest)
+        if flight.answer is not None:
+            return flight.answer
+        try:
+            answer, tokens = await compute()
+        except BaseException:
+            flight.fail()
+            raise
+        await flight.finish(answer, tokens)
+        return answer
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.coalesced + self.misses
+        return {
+            "entries": len(self._entries),
+            "in_flight": len(self._inflight),
+            "hits": self.hits,
+            "coalesced": self.coalesced,
+            "misses": self.misses,
+            "hit_rate": (self.hits + self.coalesced) / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expired": self.expired,
+            "tokens_saved": self.tokens_saved,
+        }
@@ -1,8 +1,17 @@
+import multiprocessing
+import socket
 from http import HTTPStatus
+from typing import List
 from aiohttp import web
 from botbuilder.core.integration import aiohttp_error_middleware
 from bot import bot_app
+import agent
+from agent import corpus
+from agent_service import history_builder
+from store import open_store, close_store, maintenance
 from utils.config import config
+from utils.logger import setup_from_config
+from utils.metrics import registry
 
 routes = web.RouteTableDef()
 
@@ -15,8 +24,69 @@ async def on_messages(req: web.Request) -> web.Response:
 
     return web.Response(status=HTTPStatus.OK)
 
+@routes.get("/metrics")
+async def on_metrics(_req: web.Request) -> web.Response:
+    return web.Response(text=registry.render(), content_type="text/plain")
+
+@routes.get("/healthz")
+async def on_healthz(_req: web.Request) -> web.Response:
+    """Liveness: the process is up and serving requests"""
+    return web.json_response({"status": "ok"})
+
+@routes.get("/readyz")
+async def on_readyz(_req: web.Request) -> web.Response:
+    """Readiness: the models are built and the procedures corpus is loaded"""
+    checks = agent.readiness()
+    ready = all(checks.values())
+    body = {"status": "ready" if ready else "starting", **checks, "corpus_version": corpus.snapshot.version}
+    return web.json_response(body, status=HTTPStatus.OK if ready else HTTPStatus.SERVICE_UNAVAILABLE)
+
 app = web.Application(middlewares=[aiohttp_error_middleware])
 app.add_routes(routes)
+app.on_startup.append(open_store)
+app.on_startup.append(maintenance.start)
+app.on_startup.append(corpus.start)
+app.on_startup.append(agent.warm_up)
+app.on_cleanup.append(maintenance.stop)
+app.on_cleanup.append(corpus.stop)
+app.on_cleanup.append(history_builder.stop)
+app.on_cleanup.append(close_store)
+
+def _serve_socket(sock: socket.socket):
+    web.run_app(app, sock=sock)
+
+def start_workers(workers: int, host: str, port: int) -> List[multiprocessing.Process]:
+    """
+    Bind the listening socket once and fork `workers` processes that all
+    accept on it. Forking shares the imported modules; each worker opens
+    its own database connections, builds its own model clients and loads
+    the corpus on startup.
+    """
+    sock = socket.create_server((host, port))
+    context = multiprocessing.get_context("fork")
+    processes = [context.Process(target=_serve_socket, args=(sock,)) for _ in range(workers)]
+    for process in processes:
+        process.start()
+    sock.close()
+    return processes
+
+def serve(host: str = "localhost", port: int = config.app.port, workers: int = config.app.workers):
+    if workers == 1:
+        web.run_app(app, host=host, port=port)
+        return
+
+    # Before forking, so that the workers share one writer for the log file
+    setup_from_config(workers)
+    processes = start_workers(workers, host, port)
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Workers shut down gracefully on SIGTERM, flushing queued writes
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
 
 if __name__ == "__main__":
-    web.run_app(app, host="localhost", port=config.app.port)
\ No newline at end of file
+    serve()
\ No newline at end of file
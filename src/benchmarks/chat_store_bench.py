@@ -0,0 +1,119 @@
+"""
+Chat store write throughput by shard count: several worker processes, as
+with app.workers > 1, each run many conversations at once, and every turn
+writes its question, answer and turn record in its own transaction on the
+conversation's shard, as a store without the history cache's batching does.
+Reports turns per second, transaction latency and "database is locked"
+failures for each shard count.
+
+--hold keeps each transaction open that many more milliseconds, standing in
+for commits that wait on a slow or network disk; on a machine with few
+cores, that is where sharding shows, since the writer lock, not the CPU,
+is then what turns queue for.
+
+Needs no network or credentials. Run from src/:
+
+    python -m benchmarks.chat_store_bench --workers 4 --shards 1 2 4 8
+"""
+import argparse
+import asyncio
+import multiprocessing
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.load_test import percentile
+
+
+async def conversation(store, user_id: str, turns: int, hold: float, latencies: list, errors: list):
+    from db import AGENT, USER, ChatTurn, new_turn_id
+
+    for t in range(turns):
+        start = time.perf_counter()
+        try:
+            async with store.shard_for(user_id).transaction() as transaction:
+                _, reply = await transaction.add_messages(
+                    user_id, [(USER, f"How do I request time off? ({t})"), (AGENT, "Open the Paid Time Off procedure. " * 8)]
+                )
+                await transaction.add_turns([
+                    ChatTurn(new_turn_id(), user_id, reply.message, reply.message, reply.timestamp, reply.seq)
+                ])
+                if hold:
+                    await asyncio.sleep(hold)
+        except Exception as e:
+            errors.append(repr(e))
+            continue
+        latencies.append(time.perf_counter() - start)
+
+
+async def drive(db_path: str, shards: int, worker: int, start_at: float, args):
+    from db import ShardedChatStore
+
+    latencies, errors = [], []
+    async with ShardedChatStore(db_path, shards=shards, readers=1, history_size=20) as store:
+        for shard in store.shards:
+            await shard._db.execute(f"PRAGMA synchronous={args.synchronous}")
+        await asyncio.sleep(max(0.0, start_at - time.time()))
+        await asyncio.gather(*(
+            conversation(store, f"w{worker}conversation{c:04d}", args.turns, args.hold / 1000, latencies, errors)
+            for c in range(args.conversations)
+        ))
+    return latencies, errors
+
+
+def worker_main(db_path: str, shards: int, worker: int, start_at: float, args, results):
+    results.put(asyncio.run(drive(db_path, shards, worker, start_at, args)))
+
+
+def scenario(shards: int, args):
+    from db import ShardedChatStore
+
+    db_path = str(Path(tempfile.mkdtemp(prefix=f"chat_store_bench_{shards}_")) / "chat.sqlite")
+
+    async def create():
+        async with ShardedChatStore(db_path, shards=shards):
+            pass
+    asyncio.run(create())
+
+    results = multiprocessing.Queue()
+    start_at = time.time() + 1.0
+    processes = [
+        multiprocessing.Process(target=worker_main, args=(db_path, shards, w, start_at, args, results))
+        for w in range(args.workers)
+    ]
+    for process in processes:
+        process.start()
+    latencies, errors = [], []
+    for _ in processes:
+        worker_latencies, worker_errors = results.get()
+        latencies += worker_latencies
+        errors += worker_errors
+    elapsed = time.time() - start_at
+    for process in processes:
+        process.join()
+
+    print(f"{shards} shard{'s' if shards > 1 else ' '} : {len(latencies) / elapsed:7.0f} turns/s  "
+          f"transaction p50 {percentile(latencies, 50) * 1000:6.1f}ms  p99 {percentile(latencies, 99) * 1000:7.1f}ms  "
+          f"{len(errors)} failed")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=4, help="writer processes")
+    parser.add_argument("--conversations", type=int, default=32, help="concurrent conversations per process")
+    parser.add_argument("--turns", type=int, default=30, help="turns per conversation")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8])
+    parser.add_argument("--synchronous", default="NORMAL",
+                        help="writer PRAGMA synchronous; FULL syncs every commit to disk, as durable settings do")
+    parser.add_argument("--hold", type=float, default=0.0, help="extra milliseconds each transaction stays open")
+    args = parser.parse_args(argv)
+
+    print(f"{args.workers} processes x {args.conversations} conversations x {args.turns} turns, "
+          f"one transaction per turn, synchronous={args.synchronous}, hold {args.hold}ms")
+    for shards in args.shards:
+        scenario(shards, args)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,311 @@
+"""
+Local stand-ins for the external services the bot talks to, so the agent
+pipeline can run offline: a deterministic chat model that can replace
+ChatGoogleGenerativeAI, and a bot adapter and a connector client that record
+outbound activities instead of calling the Bot Framework connector.
+"""
+import asyncio
+import json
+import re
+import time
+import uuid
+from collections import defaultdict, deque
+from types import SimpleNamespace
+from typing import Any, AsyncIterator, Deque, Dict, Iterator, List, Optional
+from botbuilder.core import BotAdapter, TurnContext
+from botbuilder.schema import Activity, ActivityTypes, ChannelAccount, ConversationAccount, ResourceResponse
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage, ToolMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_core.utils.function_calling import convert_to_openai_tool
+
+_QUERY_RE = re.compile(r"user query:\**\s*(.+)", re.IGNORECASE)
+_KNOWLEDGE_MARKER = "Internal Knowledge:"
+_NO_RELEVANT_INFO = "NO_RELEVANT_INFO"
+
+
+class FakeChatModel(BaseChatModel):
+    """
+    Deterministic chat model with configurable latency and output length.
+
+    When tools are bound and the conversation has no tool result yet, it
+    calls the first tool with the last human message as the query, which
+    drives the ReAct agent through one tool round-trip like Gemini does.
+    Otherwise it answers with `tokens` words derived from the input, or
+    NO_RELEVANT_INFO to a shard prompt that does not mention the question.
+    A `fail_rate` share of calls raises and a `stall_rate` share hangs for
+    `stall` seconds before answering, on a fixed pattern per instance.
+    Accepts and ignores ChatGoogleGenerativeAI constructor arguments so it
+    can be patched in its place.
+    """
+
+    latency: float = 0.05
+    token_delay: float = 0.0
+    tokens: int = 60
+    fail_rate: float = 0.0
+    stall_rate: float = 0.0
+    stall: float = 3600.0
+
+    model: Optional[str] = None
+    temperature: Optional[float] = None
+    max_retries: Optional[int] = None
+    max_tokens: Optional[int] = None
+    timeout: Optional[float] = None
+    google_api_key: Optional[Any] = None
+
+    calls: int = 0
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-chat-model"
+
+    def bind_tools(self, tools, **kwargs):
+        return self.bind(tools=[convert_to_openai_tool(t) for t in tools], **kwargs)
+
+    def _reply(self, messages: List[BaseMessage], tools: Optional[list]) -> AIMessage:
+        self.calls += 1
+        if self.fail_rate and (self.calls * 7919 % 100) < self.fail_rate * 100:
+            raise RuntimeError("Simulated model failure")
+
+        prompt = next((str(m.content) for m in reversed(messages) if isinstance(m, HumanMessage)), "")
+        # Our prompts end with the user query; use it rather than the whole template
+        match = _QUERY_RE.search(prompt)
+        question = match.group(1).strip() if match else prompt
+        has_tool_result = any(isinstance(m, ToolMessage) for m in messages)
+        if tools and not has_tool_result:
+            name = tools[0]["function"]["name"]
+            return AIMessage(
+                content="",
+                tool_calls=[{"name": name, "args": {"query": question}, "id": f"call_{uuid.uuid4().hex[:8]}"}],
+            )
+
+        # Shard prompts: nothing relevant when no longer word of the question appears in the shard
+        if _NO_RELEVANT_INFO in prompt and _KNOWLEDGE_MARKER in prompt:
+            knowledge = prompt.rsplit(_KNOWLEDGE_MARKER, 1)[1].lower()
+            words = [w.lower() for w in re.findall(r"[A-Za-z]{5,}", question)]
+            if not any(w in knowledge for w in words):
+                usage = {"input_tokens": len(prompt.split()), "output_tokens": 1}
+                return AIMessage(content=_NO_RELEVANT_INFO, usage_metadata={**usage, "total_tokens": sum(usage.values())})
+
+        seed = [w for w in question.split() if w.isalpha()] or ["answer"]
+        words = [seed[i % len(seed)] for i in range(self.tokens)]
+        usage = {"input_tokens": sum(len(str(m.content).split()) for m in messages), "output_tokens": self.tokens}
+        return AIMessage(content=" ".join(words), usage_metadata={**usage, "total_tokens": sum(usage.values())})
+
+    def _stalled(self) -> bool:
+        return bool(self.stall_rate) and (self.calls * 104729 % 100) < self.stall_rate * 100
+
+    def _duration(self, message: AIMessage) -> float:
+        """Simulated time to produce a whole message"""
+        stall = self.stall if self._stalled() else 0
+        return stall + self.latency + (0 if message.tool_calls else self.token_delay * self.tokens)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        tools: Optional[list] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = self._reply(messages, tools)
+        time.sleep(self._duration(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        tools: Optional[list] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        message = self._reply(messages, tools)
+        await asyncio.sleep(self._duration(message))
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    @staticmethod
+    def _tool_call_chunk(message: AIMessage) -> ChatGenerationChunk:
+        return ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+            {"name": call["name"], "args": json.dumps(call["args"]), "id": call["id"], "index": i}
+            for i, call in enumerate(message.tool_calls)
+        ]))
+
+    def _stream(self, messages, stop=None, run_manager=None, tools=None, **kwargs) -> Iterator[ChatGenerationChunk]:
+        message = self._generate(messages, stop=stop, tools=tools).generations[0].message
+        if message.tool_calls:
+            yield self._tool_call_chunk(message)
+        else:
+            yield ChatGenerationChunk(message=AIMessageChunk(content=message.content, usage_metadata=message.usage_metadata))
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        tools: Optional[list] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        message = self._reply(messages, tools)
+        await asyncio.sleep(self.latency + (self.stall if self._stalled() else 0))
+        if message.tool_calls:
+            yield self._tool_call_chunk(message)
+            return
+
+        words = message.content.split(" ")
+        for i, word in enumerate(words):
+            if self.token_delay:
+                await asyncio.sleep(self.token_delay)
+            chunk = AIMessageChunk(content=word if i == 0 else f" {word}")
+            if i == len(words) - 1:
+                chunk.usage_metadata = message.usage_metadata
+            yield ChatGenerationChunk(message=chunk)
+
+
+class StubAdapter(BotAdapter):
+    """
+    Bot adapter that records outbound activities in memory instead of
+    calling the connector. `latency` simulates the connector round-trip.
+    """
+
+    def __init__(self, latency: float = 0.0):
+        super().__init__()
+        self.latency = latency
+        self.sent: List[Activity] = []
+        self.updated: List[Activity] = []
+        # Latest text of each posted message by activity id, in posting order
+        self.texts: Dict[str, Optional[str]] = {}
+
+    async def send_activities(self, context: TurnContext, activities: List[Activity]) -> List[ResourceResponse]:
+        await asyncio.sleep(self.latency)
+        responses = []
+        for activity in activities:
+            activity.id = activity.id or uuid.uuid4().hex
+            self.sent.append(activity)
+            responses.append(ResourceResponse(id=activity.id))
+        return responses
+
+    async def update_activity(self, context: TurnContext, activity: Activity):
+        await asyncio.sleep(self.latency)
+        self.updated.append(activity)
+        return ResourceResponse(id=activity.id)
+
+    async def delete_activity(self, context: TurnContext, reference):
+        pass
+
+    def context_for(self, text: str, conversation_id: str = "conversation-1") -> TurnContext:
+        """Build a TurnContext for an incoming message in the given conversation"""
+        activity = Activity(
+            type=ActivityTypes.message,
+            id=uuid.uuid4().hex,
+            text=text,
+            channel_id="msteams",
+            service_url="http://localhost",
+            conversation=ConversationAccount(id=conversation_id),
+            from_property=ChannelAccount(id="user-1"),
+            recipient=ChannelAccount(id="bot"),
+        )
+        return TurnContext(self, activity)
+
+
+class TooManyRequests(Exception):
+    """Raised like the connector client's HTTP errors, with the response on `response`"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Operation returned an invalid status code 'Too Many Requests'")
+        self.response = SimpleNamespace(status_code=429, headers={"Retry-After": f"{retry_after:g}"})
+
+
+class StubConnector:
+    """
+    Connector client that records activities in memory instead of posting
+    them to the Bot Framework connector service. Every call takes `latency`
+    seconds. Like Teams, it rejects with 429 and a Retry-After of
+    `retry_after` seconds a `throttle_rate` share of calls, on a fixed
+    pattern, and every call beyond `conversation_limit` per second in a
+    conversation.
+    """
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        throttle_rate: float = 0.0,
+        retry_after: float = 1.0,
+        conversation_limit: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.conversation_limit = conversation_limit
+        # The adapter calls connector_client.conversations.*
+        self.conversations = self
+
+        self.sent: List[Activity] = []
+        self.updated: List[Activity] = []
+        # Latest text of each posted message by activity id, in posting order
+        self.texts: Dict[str, Optional[str]] = {}
+        self.calls = 0
+        self.throttled = 0
+        self._recent: Dict[str, Deque[float]] = defaultdict(deque)
+
+    def _admit(self, conversation_id: str):
+        self.calls += 1
+        now = time.monotonic()
+        recent = self._recent[conversation_id]
+        while recent and now - recent[0] > 1.0:
+            recent.popleft()
+        throttled = bool(self.throttle_rate) and (self.calls * 104729 % 100) < self.throttle_rate * 100
+        if throttled or (self.conversation_limit is not None and len(recent) >= self.conversation_limit):
+            self.throttled += 1
+            raise TooManyRequests(self.retry_after)
+        recent.append(now)
+
+    async def send_to_conversation(self, conversation_id: str, activity: Activity) -> ResourceResponse:
+        await asyncio.sleep(self.latency)
+        self._admit(conversation_id)
+        self.sent.append(activity)
+        activity_id = uuid.uuid4().hex
+        self.texts[activity_id] = activity.text
+        return ResourceResponse(id=activity_id)
+
+    async def reply_to_activity(self, conversation_id: str, activity_id: str, activity: Activity) -> ResourceResponse:
+        return await self.send_to_conversation(conversation_id, activity)
+
+    async def update_activity(self, conversation_id: str, activity_id: str, activity: Activity) -> ResourceResponse:
+        await asyncio.sleep(self.latency)
+        self._admit(conversation_id)
+        self.updated.append(activity)
+        self.texts[activity_id] = activity.text
+        return ResourceResponse(id=activity_id)
+
+    def install(self, adapter):
+        """Make a CloudAdapter-based adapter (e.g. TeamsAdapter) use this connector for every turn"""
+        create_turn_context = adapter._create_turn_context
+
+        def create_stub_turn_context(*args):
+            context = create_turn_context(*args)
+            context.turn_state[adapter.BOT_CONNECTOR_CLIENT_KEY] = self
+            return context
+
+        adapter._create_turn_context = create_stub_turn_context
+
+    def context_for(self, adapter, text: str, conversation_id: str = "conversation-1") -> TurnContext:
+        """Build a TurnContext for an incoming message whose replies go to this connector"""
+        context = StubAdapter.context_for(adapter, text, conversation_id)
+        context.turn_state[adapter.BOT_CONNECTOR_CLIENT_KEY] = self
+        return context
+
+
+def install_fake_models(**settings) -> None:
+    """
+    Replace ChatGoogleGenerativeAI with FakeChatModel. Must run before the
+    agent's models are built; settings override the FakeChatModel defaults.
+    """
+    import langchain_google_genai
+
+    class ConfiguredFakeChatModel(FakeChatModel):
+        def __init__(self, **kwargs):
+            super().__init__(**{**kwargs, **settings})
+
+    langchain_google_genai.ChatGoogleGenerativeAI = ConfiguredFakeChatModel
@@ -0,0 +1,94 @@
+"""
+Feedback benchmark: stores answers that link fixture procedures as chat
+turns, then clicks thumbs up/down on their feedback cards through
+bot.save_feedback. Reports the time a click takes on the event loop and
+the flush throughput, and checks that every click is stored with the
+procedures its answer links, and that the per-procedure rollup counts them.
+
+Needs no network or credentials. Run from src/:
+
+    python -m benchmarks.feedback_bench --clicks 5000
+"""
+import argparse
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.load_test import FIXTURES, percentile
+
+
+async def run(args) -> bool:
+    import agent
+    import store
+    from bot import save_feedback
+    from feedback import NEGATIVE, POSITIVE
+
+    db_dir = Path(tempfile.mkdtemp(prefix="feedback_bench_"))
+    store.shared_store.db_path = str(db_dir / "chat.sqlite")
+    store.feedback.db_path = str(db_dir / "feedback.sqlite")
+    agent.corpus.dir_path = FIXTURES / "procedures"
+    agent.corpus.snapshot_path = None
+    snapshot = agent.corpus.load()
+    names = sorted(snapshot.metadata)
+
+    rng = random.Random(0)
+    await store.shared_store.open()
+    await store.feedback.open()
+    try:
+        turns = []
+        for t in range(args.turns):
+            conversation_id = f"conversation{t % 50}"
+            linked = rng.sample(names, rng.randint(0, 2))
+            answer = snapshot.link_matcher.apply(
+                "Here is what to do. " + " ".join(f"Follow {name}." for name in linked)
+            )
+            turn = await store.history.add_turn(conversation_id, f"turn{t}", f"question {t}", answer)
+            turns.append((turn, linked))
+        await store.history.flush()
+
+        expected = {}
+        latencies = []
+        for _ in range(args.clicks):
+            turn, linked = rng.choice(turns)
+            rating = rng.choice((POSITIVE, NEGATIVE))
+            start = time.perf_counter()
+            await save_feedback(turn.user_id, {"turnId": turn.turn_id}, rating)
+            latencies.append(time.perf_counter() - start)
+            for name in linked:
+                expected[name] = expected.get(name, 0) + 1
+
+        start = time.perf_counter()
+        written = await store.feedback.flush()
+        flush = time.perf_counter() - start
+
+        stored_total = sum(row[POSITIVE] + row[NEGATIVE] for row in await store.feedback.daily())
+        rollup = {row["procedure"]: row[POSITIVE] + row[NEGATIVE] for row in await store.feedback.by_procedure()}
+        sample_turn, sample_linked = next((t, linked) for t, linked in turns if linked)
+        stored = await store.feedback.for_turn(sample_turn.turn_id)
+    finally:
+        await store.feedback.close()
+        await store.shared_store.close()
+
+    recorded_ok = all(f.procedures == sample_linked for f in stored)
+    rollup_ok = rollup == expected
+    print(f"{args.clicks} clicks on {args.turns} turns linking {len(names)} procedures")
+    print(f"save_feedback  : p50 {percentile(latencies, 50) * 1e6:.0f}us  p99 {percentile(latencies, 99) * 1e6:.0f}us")
+    print(f"flush          : last {written} entries in {flush * 1000:.0f}ms, {stored_total} stored")
+    print(f"procedures     : linked answers recorded their procedures: {recorded_ok}, "
+          f"per-procedure rollup matches the clicks: {rollup_ok} ({sum(rollup.values())} procedure ratings)")
+    return stored_total == args.clicks and recorded_ok and rollup_ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--clicks", type=int, default=5000)
+    parser.add_argument("--turns", type=int, default=500, help="stored turns the clicks are spread over")
+    args = parser.parse_args(argv)
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,84 @@
+"""
+Corpus ingestion benchmark: writes a procedures directory of many generated
+documents, then times how a fresh CorpusManager (as in a restarting worker)
+gets to its first snapshot:
+
+- scan:          no snapshot file, every file read, hashed and chunked, with
+                 one reader thread and with --workers
+- snapshot:      starting from the snapshot file written by the scan
+- touched:       from the snapshot file after one file's mtime changed
+- edited:        from the snapshot file after one file's content changed
+
+and checks that each start produces the same corpus as a full scan. Needs
+no network or credentials. Run from src/:
+
+    python -m benchmarks.ingest_bench --documents 5000 --words 400
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+
+def make_corpus(documents: int, words: int) -> Path:
+    rng = random.Random(0)
+    vocabulary = [f"word{i}" for i in range(2000)]
+    corpus_dir = Path(tempfile.mkdtemp(prefix="ingest_bench_"))
+    for d in range(documents):
+        paragraphs = [
+            " ".join(rng.choice(vocabulary) for _ in range(40)) + "."
+            for _ in range(max(1, words // 40))
+        ]
+        (corpus_dir / f"Procedure {d:05d}.md").write_text("\n\n".join(paragraphs), encoding="utf-8")
+    return corpus_dir
+
+
+def start(corpus_dir: Path, snapshot_path, workers: int):
+    from utils.corpus import CorpusManager
+
+    manager = CorpusManager(corpus_dir, chunk_tokens=300, snapshot_path=snapshot_path, workers=workers)
+    began = time.perf_counter()
+    snapshot = manager.load()
+    return time.perf_counter() - began, snapshot
+
+
+def same(a, b) -> bool:
+    return a.digest == b.digest and a.context == b.context and a.index.chunks == b.index.chunks
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--documents", type=int, default=5000)
+    parser.add_argument("--words", type=int, default=400)
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args(argv)
+
+    corpus_dir = make_corpus(args.documents, args.words)
+    snapshot_path = corpus_dir.parent / f"{corpus_dir.name}.snapshot"
+    print(f"{args.documents} documents of {args.words} words")
+
+    serial, reference = start(corpus_dir, None, 1)
+    print(f"scan, 1 thread       : {serial:6.2f}s  {len(reference.index.chunks)} chunks")
+    scan, snapshot = start(corpus_dir, snapshot_path, args.workers)
+    print(f"scan, {args.workers} threads      : {scan:6.2f}s  same corpus: {same(snapshot, reference)}, "
+          f"snapshot file {snapshot_path.stat().st_size / 2**20:.1f}MB")
+
+    warm, snapshot = start(corpus_dir, snapshot_path, args.workers)
+    print(f"from snapshot        : {warm:6.2f}s  same corpus: {same(snapshot, reference)}")
+
+    path = corpus_dir / "Procedure 00000.md"
+    os.utime(path, ns=(time.time_ns(), time.time_ns()))
+    touched, snapshot = start(corpus_dir, snapshot_path, args.workers)
+    print(f"1 file touched       : {touched:6.2f}s  same corpus: {same(snapshot, reference)}")
+
+    path.write_text(path.read_text(encoding="utf-8") + "\n\nword1 word2 word3.", encoding="utf-8")
+    _, reference = start(corpus_dir, None, args.workers)
+    edited, snapshot = start(corpus_dir, snapshot_path, args.workers)
+    print(f"1 file edited        : {edited:6.2f}s  same corpus: {same(snapshot, reference)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
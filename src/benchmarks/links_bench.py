@@ -0,0 +1,65 @@
+"""
+Benchmark for procedure link injection: the old per-name str.replace loop
+against the compiled single-pass LinkMatcher. Run from src/:
+
+    python -m benchmarks.links_bench [names] [response_kb]
+"""
+import random
+import sys
+import time
+from utils.links import LinkMatcher
+
+WORDS = (
+    "request approval manager employee policy travel expense laptop access "
+    "review project onboarding leave security report portal ticket team "
+    "budget contract vendor training payroll benefits office badge"
+).split()
+
+def replace_loop(response, metadata):
+    # The implementation add_links used before LinkMatcher
+    for name, url in metadata.items():
+        response = response.replace(name.strip(), f"[{name}]({url})")
+    return response
+
+def make_metadata(n, rng):
+    metadata = {}
+    while len(metadata) < n:
+        name = " ".join(w.capitalize() for w in rng.sample(WORDS, rng.randint(2, 4)))
+        metadata[name] = f"https://intranet.pgi.example/procedures/{len(metadata)}"
+    return metadata
+
+def make_response(metadata, size, rng):
+    names = list(metadata)
+    parts, length = [], 0
+    while length < size:
+        part = rng.choice(names) if rng.random() < 0.1 else rng.choice(WORDS)
+        parts.append(part)
+        length += len(part) + 1
+    return " ".join(parts)
+
+def timed(fn, *args, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        best = min(best, time.perf_counter() - start)
+    return result, best
+
+def main(names=1000, response_kb=20):
+    rng = random.Random(42)
+    metadata = make_metadata(int(names), rng)
+    response = make_response(metadata, int(response_kb) * 1024, rng)
+
+    matcher, compile_time = timed(LinkMatcher, metadata, repeat=1)
+    linked, match_time = timed(matcher.apply, response)
+    _, loop_time = timed(replace_loop, response, metadata, repeat=1)
+
+    print(f"{len(metadata)} names, {len(response) // 1024}KB response")
+    print(f"compile matcher : {compile_time * 1000:8.2f}ms (once per corpus version)")
+    print(f"replace loop    : {loop_time * 1000:8.2f}ms")
+    print(f"LinkMatcher     : {match_time * 1000:8.2f}ms ({loop_time / match_time:.0f}x faster)")
+    print(f"links inserted  : {linked.count('](https://')}")
+    assert matcher.apply(linked) == linked, "already linked text must be left alone"
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,225 @@
+"""
+Local load test: starts the aiohttp app with FakeChatModel in place of
+Gemini and an in-memory stub in place of the Bot Framework connector, then
+replays synthetic Teams conversations against /api/messages.
+
+Needs no network or credentials. Run from src/:
+
+    python -m benchmarks.load_test --conversations 50 --turns 4 --latency 0.2
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+QUESTIONS = [
+    "How do I request PTO?",
+    "Do I need a doctor's note when I'm sick for four days?",
+    "What happens in the first week for a new hire?",
+    "How do I get reimbursed for a business lunch?",
+    "How many days can I work from home?",
+    "I lost my laptop on the train, what do I do?",
+]
+
+
+def percentile(values, p):
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, round(p / 100 * (len(ordered) - 1))))
+    return ordered[k]
+
+
+class LoopLagMonitor:
+    """Samples how late the event loop wakes up from a short sleep"""
+
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.samples = []
+        self._task = None
+
+    async def _run(self):
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(time.perf_counter() - start - self.interval)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+
+class DbTimer:
+    """Accumulates wall time spent in the chat store's reads and write-behind flushes"""
+
+    def __init__(self):
+        self.seconds = 0.0
+        self.calls = 0
+
+    def wrap(self, obj, name):
+        original = getattr(obj, name)
+
+        async def timed(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await original(*args, **kwargs)
+            finally:
+                self.seconds += time.perf_counter() - start
+                self.calls += 1
+
+        setattr(obj, name, timed)
+
+
+def install_stub_connector(adapter, latency: float, **faults):
+    """Route the adapter's connector calls to memory instead of the connector service"""
+    from benchmarks.fakes import StubConnector
+
+    connector = StubConnector(latency=latency, **faults)
+    connector.install(adapter)
+    return connector.sent
+
+
+def lift_rate_limits():
+    """Turn off the outbound rate limits, which otherwise pace each conversation to Teams' limits"""
+    from outbound import RateLimiter, outbound
+
+    outbound.limiter = RateLimiter(1e9, 10**9, 1e9, 10**9)
+
+
+def make_activity(conversation_id: str, text: str) -> dict:
+    return {
+        "type": "message",
+        "id": uuid.uuid4().hex,
+        "text": text,
+        "channelId": "msteams",
+        "serviceUrl": "http://localhost:1/",
+        "conversation": {"id": conversation_id},
+        "from": {"id": f"user-{conversation_id}"},
+        "recipient": {"id": "bot"},
+    }
+
+
+async def run(args):
+    from benchmarks.fakes import install_fake_models
+    install_fake_models(latency=args.latency, token_delay=args.token_delay, tokens=args.tokens)
+
+    from aiohttp import ClientSession
+    from aiohttp.test_utils import TestServer
+    import agent
+    import store
+    from admission import admission
+    from bot import bot_app
+    from utils.config import config
+    from utils.metrics import llm_calls_per_turn, route_decisions_total, route_saved_seconds_total, stage_seconds
+
+    config.streaming.enabled = args.streaming
+    db_dir = Path(tempfile.mkdtemp(prefix="load_test_"))
+    store.shared_store.db_path = str(db_dir / "chat.sqlite")
+    store.feedback.db_path = str(db_dir / "feedback.sqlite")
+    store.state_storage.backend.db_path = str(db_dir / "state.sqlite")
+    agent.corpus.dir_path = FIXTURES / "procedures"
+    agent.corpus.snapshot_path = None
+    agent.corpus.load()
+
+    sent = install_stub_connector(bot_app.adapter, args.connector_latency)
+    if not args.rate_limits:
+        lift_rate_limits()
+    db_timer = DbTimer()
+    db_timer.wrap(store.shared_store, "get_messages")
+    db_timer.wrap(store.history, "flush")
+
+    from app import app
+    server = TestServer(app)
+    await server.start_server()
+    url = str(server.make_url("/api/messages"))
+
+    latencies, errors = [], 0
+    lag = LoopLagMonitor()
+    lag.start()
+
+    async def conversation(session, i):
+        nonlocal errors
+        conversation_id = f"loadtest-{i}"
+        for turn in range(args.turns):
+            body = make_activity(conversation_id, QUESTIONS[(i + turn) % len(QUESTIONS)])
+            start = time.perf_counter()
+            async with session.post(url, json=body) as response:
+                await response.read()
+                if response.status >= 400:
+                    errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    async with ClientSession() as session:
+        await asyncio.gather(*(conversation(session, i) for i in range(args.conversations)))
+    elapsed = time.perf_counter() - start
+
+    await lag.stop()
+    await server.close()
+
+    turns = len(latencies)
+    print(f"{args.conversations} conversations x {args.turns} turns, model latency {args.latency}s, "
+          f"streaming {'on' if args.streaming else 'off'}")
+    print(f"turns          : {turns} in {elapsed:.2f}s ({turns / elapsed:.1f} turns/s), "
+          f"{errors} errors, {admission.rejected} rejected as busy")
+    print(f"latency        : p50 {percentile(latencies, 50) * 1000:.0f}ms  "
+          f"p95 {percentile(latencies, 95) * 1000:.0f}ms  p99 {percentile(latencies, 99) * 1000:.0f}ms  "
+          f"mean {statistics.mean(latencies) * 1000:.0f}ms")
+    print(f"db time        : {db_timer.seconds * 1000:.0f}ms in {db_timer.calls} calls "
+          f"({db_timer.seconds / turns * 1000:.2f}ms/turn)")
+    print(f"event loop lag : p50 {percentile(lag.samples, 50) * 1000:.1f}ms  "
+          f"p99 {percentile(lag.samples, 99) * 1000:.1f}ms  max {max(lag.samples, default=0) * 1000:.1f}ms")
+    print(f"activities out : {len(sent)}")
+    print("stages (mean)  : " + "  ".join(
+        f"{stage} {stage_seconds.sum(stage=stage) / count * 1000:.1f}ms"
+        for stage in ("history_read", "retrieval", "knowledge_base_llm", "agent", "add_links", "history_write", "send_activity", "turn")
+        if (count := stage_seconds.count(stage=stage))
+    ))
+    print(f"llm calls/turn : {llm_calls_per_turn.sum(caller='agent') / turns:.2f} agent, "
+          f"{llm_calls_per_turn.sum(caller='knowledge_base') / turns:.2f} knowledge base")
+    cache = store.answer_cache.stats()
+    print(f"answer cache   : hit rate {cache['hit_rate']:.0%} ({cache['hits']} hits, {cache['coalesced']} coalesced, "
+          f"{cache['misses']} misses), {cache['tokens_saved']} tokens saved")
+    print("routes         : " + "  ".join(
+        f"{route} {route_decisions_total.value(route=route):.0f} (saved {route_saved_seconds_total.value(route=route):.1f}s)"
+        for route in ("agent", "knowledge_base", "small_talk")
+    ))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=50)
+    parser.add_argument("--turns", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2, help="fake model latency per call, seconds")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="fake model delay per output token")
+    parser.add_argument("--tokens", type=int, default=60, help="fake model answer length in words")
+    parser.add_argument("--connector-latency", type=float, default=0.01, help="stub connector round-trip")
+    parser.add_argument("--streaming", action=argparse.BooleanOptionalAction, default=False)
+    parser.add_argument("--rate-limits", action=argparse.BooleanOptionalAction, default=False,
+                        help="pace outbound activities with the configured rate limits")
+    args = parser.parse_args(argv)
+
+    # Anonymous requests are accepted when no bot credentials are configured
+    for name in ("BOT_ID", "BOT_PASSWORD", "BOT_TENANT_ID"):
+        os.environ[name] = ""
+    os.environ.setdefault("MAIN_GOOGLE_API_KEY", "fake")
+    os.environ.setdefault("TOOL_GOOGLE_API_KEY", "fake")
+
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,101 @@
+"""
+Logging benchmark: the lines a turn logs (message received, user message at
+debug, knowledge base search, answer) emitted for many turns, each inside
+its own logger.contextualize(), under several sink setups:
+
+- none:        no sinks, the cost of the logger calls alone
+- legacy:      the previous setup: text with diagnose on, enqueued to a
+               writer thread, and the console going through a print lambda
+- text:        text lines, diagnose off, written directly
+- json:        one JSON object per line, diagnose off, written directly
+- json-sample: json with INFO lines of only --sample of the turns
+- json-queued: json enqueued to a writer thread, as with several workers
+
+Every --error-every th turn also logs an exception. Files and the console go
+to a temporary directory and /dev/null. "caller" is the time the turns
+spend in logging calls, "total" also waits for the background writer.
+Run from src/:
+
+    python -m benchmarks.logging_bench --turns 20000
+"""
+import argparse
+import contextlib
+import os
+import sys
+import tempfile
+import time
+import uuid
+
+
+def legacy_setup(logger):
+    logger.remove()
+    logger.add(
+        "logs/legacy.log",
+        format="{time:YYYY-MM-DD HH:mm:ss} - {level} - {file.path}:{line} - {message}",
+        rotation="10 MB", compression="zip", enqueue=True, backtrace=True, diagnose=True
+    )
+    logger.add(
+        sink=lambda msg: print(msg, end=""),
+        format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> - <level>{level}</level> - {file.path}:{line} - <level>{message}</level>",
+        enqueue=True, backtrace=True, diagnose=True
+    )
+
+
+def run_turns(logger, turns: int, error_every: int) -> float:
+    question = "How do I request time off for a family emergency?"
+    start = time.perf_counter()
+    for i in range(turns):
+        with logger.contextualize(conversation_id=f"conversation{i % 50}", turn_id=uuid.uuid4().hex):
+            logger.info("Received message")
+            logger.debug("User message: {}", question)
+            logger.info(f"Searching knowledge base for query: {question}")
+            logger.info(f"Selected 8/120 chunks, 2400/36000 tokens from corpus v1")
+            if error_every and i % error_every == 0:
+                try:
+                    {}["missing"]
+                except KeyError:
+                    logger.exception("Failed to refresh the history summary")
+            logger.info(f"Answered by the knowledge_base route in 0.84s")
+    return time.perf_counter() - start
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--turns", type=int, default=20000)
+    parser.add_argument("--error-every", type=int, default=50, help="log an exception every n turns, 0 for never")
+    parser.add_argument("--sample", type=float, default=0.1, help="share of turns whose INFO lines json-sample keeps")
+    args = parser.parse_args(argv)
+
+    from utils.logger import logger, setup_logging
+
+    os.chdir(tempfile.mkdtemp(prefix="logging_bench_"))
+    setups = {
+        "none": lambda: logger.remove(),
+        "legacy": lambda: legacy_setup(logger),
+        "text": lambda: setup_logging("text", format="text"),
+        "json": lambda: setup_logging("json", format="json"),
+        "json-sample": lambda: setup_logging("sampled", format="json", sample={"INFO": args.sample}),
+        "json-queued": lambda: setup_logging("queued", format="json", enqueue=True),
+    }
+
+    results = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for name, setup in setups.items():
+            setup()
+            run_turns(logger, 200, args.error_every)  # Warm up
+            logger.complete()
+
+            start = time.perf_counter()
+            caller = run_turns(logger, args.turns, args.error_every)
+            logger.complete()
+            total = time.perf_counter() - start
+            logger.remove()
+            results.append((name, caller, total))
+
+    print(f"{args.turns} turns, 5 lines each, an exception every {args.error_every} turns")
+    for name, caller, total in results:
+        print(f"{name:<12}: caller {caller / args.turns * 1e6:7.1f}us/turn  total {total / args.turns * 1e6:7.1f}us/turn")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
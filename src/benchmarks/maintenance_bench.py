@@ -0,0 +1,115 @@
+"""
+Chat history maintenance benchmark: fills a fresh chat database with
+conversations, most of them idle for longer than the TTL, then runs one
+HistoryMaintenance pass while a writer keeps adding messages to the active
+ones, as the history flusher does. Reports what the pass deleted, the
+database size before and after, and the writer's transaction latency
+during the pass, once in small batches and once in a single batch.
+
+Needs no network or credentials. Run from src/:
+
+    python -m benchmarks.maintenance_bench --conversations 5000 --idle 0.7
+"""
+import argparse
+import asyncio
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.load_test import percentile
+
+DAY = 24 * 3600
+
+
+async def populate(store, conversations: int, idle: float, turns: int, chars: int) -> list:
+    """Fill the store; returns the ids of the active conversations"""
+    rng = random.Random(0)
+    now = int(time.time())
+    active = []
+    text = "x" * chars
+    async with store.transaction():
+        for c in range(conversations):
+            user_id = f"conversation{c:06d}"
+            is_idle = rng.random() < idle
+            timestamp = now - (60 if is_idle else 1) * DAY
+            if not is_idle:
+                active.append(user_id)
+            await store._db.executemany(
+                "INSERT INTO chat_history (user_id, slot, seq, role, message, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                [(user_id, seq % store.history_size, seq, "User", text, timestamp)
+                 for seq in range(1, store.history_size + 1)]
+            )
+            await store._db.executemany(
+                "INSERT INTO chat_turns (turn_id, user_id, seq, question, answer, timestamp) VALUES (?, ?, ?, ?, ?, ?)",
+                [(f"{user_id}-{t}", user_id, t * 2, text, text, timestamp) for t in range(turns)]
+            )
+    await store.checkpoint()
+    return active
+
+
+async def write_while(store, active: list, task: asyncio.Task) -> list:
+    """Add a message to a random active conversation every few ms until `task` is done"""
+    rng = random.Random(1)
+    latencies = []
+    while not task.done():
+        start = time.perf_counter()
+        async with store.transaction() as transaction:
+            await transaction.add_messages(rng.choice(active), [("User", "How do I request time off?")])
+        latencies.append(time.perf_counter() - start)
+        await asyncio.sleep(0.002)
+    return latencies
+
+
+async def scenario(name: str, batch_size: int, args):
+    from db import AsyncChatStore
+    from history_cache import HistoryCache
+    from maintenance import HistoryMaintenance
+
+    db_path = Path(tempfile.mkdtemp(prefix="maintenance_bench_")) / "chat.sqlite"
+    async with AsyncChatStore(str(db_path), history_size=args.history_size) as store:
+        active = await populate(store, args.conversations, args.idle, args.turns, args.chars)
+        before = await store.size_stats()
+
+        maintenance = HistoryMaintenance(
+            HistoryCache(store), conversation_ttl=30 * DAY, batch_size=batch_size,
+            batch_pause=args.batch_pause, vacuum_pages=args.vacuum_pages
+        )
+        run = asyncio.create_task(maintenance.run())
+        latencies = await write_while(store, active, run)
+        result = run.result()
+
+    print(f"{name}:")
+    print(f"  deleted      : {result['evicted_conversations']} conversations, {result['deleted_turns']} turns "
+          f"in {maintenance.last_run_seconds:.2f}s")
+    print(f"  database     : {before['db_bytes'] / 2**20:.1f}MB -> {result['db_bytes'] / 2**20:.1f}MB "
+          f"({result['freed_pages']} pages freed, {result['free_bytes'] / 2**20:.1f}MB still free), "
+          f"WAL {result['wal_bytes'] / 2**20:.1f}MB, {result['conversations']} conversations left")
+    print(f"  writer       : {len(latencies)} transactions, p50 {percentile(latencies, 50) * 1000:.1f}ms  "
+          f"p99 {percentile(latencies, 99) * 1000:.1f}ms  max {max(latencies) * 1000:.1f}ms")
+
+
+async def run(args):
+    print(f"{args.conversations} conversations, {args.idle:.0%} idle, {args.history_size} messages "
+          f"and {args.turns} turns each of {args.chars} chars")
+    await scenario(f"batches of {args.batch_size}", args.batch_size, args)
+    await scenario("one batch", args.conversations, args)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=5000)
+    parser.add_argument("--idle", type=float, default=0.7, help="share of conversations idle past the TTL")
+    parser.add_argument("--history-size", type=int, default=20)
+    parser.add_argument("--turns", type=int, default=10, help="stored turns per conversation")
+    parser.add_argument("--chars", type=int, default=200, help="length of each message")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--batch-pause", type=float, default=0.05)
+    parser.add_argument("--vacuum-pages", type=int, default=100000)
+    args = parser.parse_args(argv)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
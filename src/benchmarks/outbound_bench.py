@@ -0,0 +1,190 @@
+"""
+Outbound benchmark: conversations that each send a few long markdown
+answers with their feedback card, against a StubConnector that adds
+latency and throttles like Teams (429 with Retry-After beyond a per
+conversation rate, plus a share of random 429s). Runs once through the
+plain TeamsAdapter and once through OutboundTeamsAdapter, and checks that
+every message arrives exactly once, within the size limit, with balanced
+code blocks.
+
+A second check streams answers longer than --stream-max-chars through
+StreamingReply, which edits the message as text arrives, and checks that
+each part is posted once and ends up with the right text.
+
+Needs no network or credentials. Run from src/:
+
+    python -m benchmarks.outbound_bench --conversations 20 --replies 3 --throttle-rate 0.1
+"""
+import argparse
+import asyncio
+import random
+import sys
+import time
+from collections import Counter
+from types import SimpleNamespace
+
+from benchmarks.fakes import StubConnector
+
+_WORDS = (
+    "request approval manager leave policy form submit portal days balance notice team "
+    "calendar holiday payroll review deadline document access account security incident"
+).split()
+
+
+def make_answer(rng: random.Random, key: str, chars: int) -> str:
+    """Markdown of about `chars` characters: paragraphs, lists, links and a code block"""
+    blocks = [f"**{key}**"]
+    size = len(blocks[0])
+    while size < chars:
+        kind = rng.random()
+        if kind < 0.6:
+            block = " ".join(rng.choice(_WORDS) for _ in range(rng.randint(30, 120))).capitalize() + "."
+            block += f" See [Procedure {rng.randint(1, 99)}](https://intranet.example.com/p/{rng.randint(1, 999)})."
+        elif kind < 0.85:
+            block = "\n".join(f"- {' '.join(rng.choice(_WORDS) for _ in range(8))}" for _ in range(rng.randint(3, 8)))
+        else:
+            block = "```python\n" + "\n".join(
+                f"    {rng.choice(_WORDS)} = {i}" for i in range(rng.randint(10, 80))
+            ) + "\n```"
+        blocks.append(block)
+        size += len(block) + 2
+    return "\n\n".join(blocks)
+
+
+def card(key: str):
+    from botbuilder.schema import Activity, ActivityTypes, Attachment
+    return Activity(
+        type=ActivityTypes.message,
+        attachments=[Attachment(content_type="application/vnd.microsoft.card.adaptive", content={"key": key})],
+    )
+
+
+async def run_scenario(name: str, adapter, connector: StubConnector, args) -> bool:
+    from botbuilder.core import MessageFactory
+
+    rng = random.Random(0)
+    failures = 0
+
+    async def conversation(c: int):
+        nonlocal failures
+        for r in range(args.replies):
+            key = f"answer {c}-{r}"
+            context = connector.context_for(adapter, "question", conversation_id=f"conversation-{c}")
+            try:
+                await context.send_activities([MessageFactory.text(make_answer(rng, key, args.chars)), card(key)])
+            except Exception:
+                failures += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(conversation(c) for c in range(args.conversations)))
+    elapsed = time.perf_counter() - start
+
+    texts = [a.text for a in connector.sent if a.text]
+    cards = Counter(a.attachments[0].content["key"] for a in connector.sent if a.attachments)
+    answers = Counter(text.split("**")[1] for text in texts if text.startswith("**answer"))
+    expected = args.conversations * args.replies
+    duplicates = len(texts) - len(set(texts)) + sum(n - 1 for n in cards.values())
+    oversized = sum(len(text) > args.max_chars for text in texts)
+    unbalanced = sum(text.count("```") % 2 for text in texts)
+    complete = len(answers) == expected and len(cards) == expected
+
+    print(f"{name}:")
+    print(f"  replies      : {len(answers)}/{expected} answers, {len(cards)}/{expected} cards, "
+          f"{failures} failed sends, {duplicates} duplicates")
+    print(f"  messages     : {len(connector.sent)} posted, {len(texts) - len(answers)} continuation parts, "
+          f"{oversized} over {args.max_chars} chars, {unbalanced} with an unclosed code block")
+    print(f"  connector    : {connector.calls} calls, {connector.throttled} throttled (429), {elapsed:.2f}s")
+    if hasattr(adapter, "outbound"):
+        stats = adapter.outbound.stats()
+        print(f"  outbound     : {stats['split']} split, rate wait {stats['rate_wait_seconds_total']:.2f}s total, "
+              f"retry wait {stats['retry_wait_seconds_total']:.2f}s total, {stats['given_up']} given up")
+    return complete and not (failures or duplicates or oversized or unbalanced)
+
+
+async def run_streaming(adapter, connector: StubConnector, args) -> bool:
+    from outbound import split_markdown
+    from streaming import StreamingReply
+
+    rng = random.Random(1)
+    expected_parts, wrong = 0, 0
+
+    async def conversation(c: int):
+        nonlocal expected_parts, wrong
+        context = connector.context_for(adapter, "question", conversation_id=f"stream-{c}")
+        answer = make_answer(rng, f"streamed {c}", args.stream_chars)
+        before = len(connector.texts)
+        reply = StreamingReply(context, interval=0)
+        await reply.begin()
+        for end in range(args.stream_step, len(answer), args.stream_step):
+            await reply.update(answer[:end])
+        await reply.end(answer)
+
+        parts = split_markdown(answer, args.stream_max_chars)
+        posted = [text for text in list(connector.texts.values())[before:] if text]
+        expected_parts += len(parts)
+        wrong += posted != parts
+
+    # One at a time, so each answer's messages follow each other in connector.texts
+    for c in range(args.conversations):
+        await conversation(c)
+    messages = sum(1 for a in connector.sent if a.text)
+    print(f"streaming (split at {args.stream_max_chars} chars):")
+    print(f"  messages     : {messages} posted for {expected_parts} parts, {len(connector.updated)} updates, "
+          f"{wrong} answers with wrong final parts")
+    return messages == expected_parts and not wrong
+
+
+async def run(args):
+    from outbound import Outbound, OutboundTeamsAdapter, RateLimiter
+    from teams import TeamsAdapter
+    from utils.config import config
+
+    settings = SimpleNamespace(APP_ID="", APP_PASSWORD="", APP_TYPE="", APP_TENANTID="")
+
+    def connector():
+        return StubConnector(
+            latency=args.latency, throttle_rate=args.throttle_rate,
+            retry_after=args.retry_after, conversation_limit=args.conversation_limit,
+        )
+
+    await run_scenario("direct", TeamsAdapter(settings), connector(), args)
+
+    outbound = Outbound(
+        RateLimiter(
+            conversation_rate=config.outbound.conversation_rate,
+            conversation_burst=config.outbound.conversation_burst,
+            global_rate=config.outbound.global_rate,
+            global_burst=config.outbound.global_burst,
+        ),
+        max_message_chars=args.max_chars,
+        max_retries=config.outbound.max_retries,
+        max_retry_after=config.outbound.max_retry_after,
+    )
+    ok = await run_scenario("outbound", OutboundTeamsAdapter(settings, outbound), connector(), args)
+
+    streaming = Outbound(
+        RateLimiter(conversation_rate=1000, conversation_burst=1000, global_rate=1000, global_burst=1000),
+        max_message_chars=args.stream_max_chars,
+    )
+    return await run_streaming(OutboundTeamsAdapter(settings, streaming), StubConnector(), args) and ok
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--conversations", type=int, default=20)
+    parser.add_argument("--replies", type=int, default=3, help="answers sent per conversation, back to back")
+    parser.add_argument("--chars", type=int, default=20000, help="answer length")
+    parser.add_argument("--max-chars", type=int, default=8000, help="max_message_chars of the outbound run")
+    parser.add_argument("--latency", type=float, default=0.02, help="stub connector round-trip, seconds")
+    parser.add_argument("--throttle-rate", type=float, default=0.1, help="share of connector calls rejected with 429")
+    parser.add_argument("--retry-after", type=float, default=0.5, help="Retry-After of a 429, seconds")
+    parser.add_argument("--conversation-limit", type=int, default=7, help="connector calls per second per conversation")
+    parser.add_argument("--stream-chars", type=int, default=640, help="length of a streamed answer")
+    parser.add_argument("--stream-max-chars", type=int, default=100, help="max_message_chars of the streaming run")
+    parser.add_argument("--stream-step", type=int, default=40, help="characters added per streamed update")
+    args = parser.parse_args(argv)
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
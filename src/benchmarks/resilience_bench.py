@@ -0,0 +1,116 @@
+"""
+Resilience benchmark: model calls against fake backends that stall or fail,
+once through a single backend with only a deadline and once through
+ResilientChatModel with a second backend to hedge and fail over to.
+
+Scenarios:
+
+- healthy: both backends answer after --latency seconds
+- stalls:  a share of the primary's calls hang until the deadline
+- errors:  a share of the primary's calls fail
+- outage:  every call to the primary fails, so its circuit breaker opens
+
+With --limit both backends share a ConcurrencyLimiter of that many slots,
+as the agent's models share llm_limiter, and the most backend calls ever
+in flight is reported; hedges and failovers must stay within it.
+
+Needs no network or credentials. Run from src/:
+
+    python -m benchmarks.resilience_bench --calls 400 --latency 0.05
+"""
+import argparse
+import asyncio
+import sys
+import time
+
+from benchmarks.fakes import FakeChatModel
+from benchmarks.load_test import percentile
+from langchain_core.messages import HumanMessage
+
+SCENARIOS = {
+    "healthy": {},
+    "stalls": {"stall_rate": 0.05},
+    "errors": {"fail_rate": 0.2},
+    "outage": {"fail_rate": 1.0},
+}
+
+
+async def run_calls(model, calls: int, concurrency: int, deadline: float):
+    latencies, failures = [], 0
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def call(i):
+        nonlocal failures
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await asyncio.wait_for(model.ainvoke([HumanMessage(content=f"Question {i}")]), deadline)
+            except Exception:
+                failures += 1
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(call(i) for i in range(calls)))
+    return latencies, failures
+
+
+def report(name: str, latencies, failures: int, backend_calls: int, calls: int, extra: str = ""):
+    print(f"  {name:<10}: p50 {percentile(latencies, 50) * 1000:5.0f}ms  p95 {percentile(latencies, 95) * 1000:5.0f}ms  "
+          f"p99 {percentile(latencies, 99) * 1000:5.0f}ms  failed {failures:3d}/{calls}  "
+          f"backend calls {backend_calls / calls:.2f}/call{extra}")
+
+
+async def run(args):
+    from admission import ConcurrencyLimiter
+    from llm import CircuitBreaker, LimitedChatModel, ResilientChatModel
+
+    within_limit = True
+
+    for scenario, faults in SCENARIOS.items():
+        print(f"{scenario}:")
+
+        single = FakeChatModel(latency=args.latency, tokens=20, stall=args.deadline * 10, **faults)
+        latencies, failures = await run_calls(single, args.calls, args.concurrency, args.deadline)
+        report("single", latencies, failures, single.calls, args.calls)
+
+        primary = FakeChatModel(latency=args.latency, tokens=20, stall=args.deadline * 10, **faults)
+        secondary = FakeChatModel(latency=args.latency, tokens=20)
+        backends = [primary, secondary]
+        limiter = ConcurrencyLimiter(args.limit) if args.limit else None
+        if limiter is not None:
+            backends = [LimitedChatModel(inner=backend, limiter=limiter) for backend in backends]
+        model = ResilientChatModel(
+            backends=backends,
+            backend_names=["primary", "secondary"],
+            breakers=[CircuitBreaker(5, args.breaker_reset), CircuitBreaker(5, args.breaker_reset)],
+            deadline=args.deadline,
+            hedge_min_delay=args.latency * 1.5,
+            hedge_initial_delay=args.latency * 4,
+        )
+        latencies, failures = await run_calls(model, args.calls, args.concurrency, args.deadline * 2)
+        stats = model.stats()
+        limited = ""
+        if limiter is not None:
+            limited = f"  peak in flight {limiter.max_in_flight}/{args.limit}"
+            within_limit = within_limit and limiter.max_in_flight <= args.limit
+        report(
+            "resilient", latencies, failures, primary.calls + secondary.calls, args.calls,
+            f"\n{'':14}hedges {stats['hedges']} ({stats['hedge_wins']} won)  failovers {stats['failovers']}  "
+            f"timeouts {stats['timeouts']}  primary breaker opened {stats['primary_breaker_opens']}x{limited}"
+        )
+    return within_limit
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency", type=float, default=0.05, help="fake model latency per call, seconds")
+    parser.add_argument("--deadline", type=float, default=1.0, help="per-call deadline, seconds")
+    parser.add_argument("--breaker-reset", type=float, default=0.5, help="seconds an open breaker skips a backend")
+    parser.add_argument("--limit", type=int, default=None, help="backend calls in flight at once, unlimited if omitted")
+    args = parser.parse_args(argv)
+    sys.exit(0 if asyncio.run(run(args)) else 1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
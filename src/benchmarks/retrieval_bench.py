@@ -0,0 +1,67 @@
+"""
+Offline retrieval benchmark for the knowledge base index.
+
+Reports recall@k (share of expected documents that appear in the retrieved
+chunks) and the size of the prompt context compared with sending the whole
+corpus, then the recall on paraphrased questions that share no term with the
+corpus, with search() alone and with its fallback. Run from src/:
+
+    python -m benchmarks.retrieval_bench [corpus_dir] [questions.jsonl]
+"""
+import json
+import sys
+import time
+from pathlib import Path
+from utils.context_manager import build_index, load_procedures
+from utils.retrieval import HashingEmbedding, format_chunks
+from utils.tokens import count_tokens
+
+FIXTURES = Path(__file__).parent / "fixtures"
+
+# Questions worded so that no term appears in the fixture procedures as such
+PARAPHRASES = [
+    {"query": "Who handles reimbursing my expenditures?", "documents": ["Expense Reimbursement"]},
+    {"query": "onboard a newcomer", "documents": ["Employee Onboarding"]},
+]
+
+def load_questions(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+def evaluate(index, questions, top_k, token_budget, fallback=False):
+    recall, prompt_tokens, elapsed = 0.0, 0, 0.0
+    for question in questions:
+        start = time.perf_counter()
+        chunks = index.search(question["query"], top_k=top_k, token_budget=token_budget)
+        if fallback and not chunks:
+            chunks, _ = index.fallback(question["query"], top_k=top_k, token_budget=token_budget)
+        elapsed += time.perf_counter() - start
+
+        found = {c.document for c in chunks}
+        expected = set(question["documents"])
+        recall += len(found & expected) / len(expected)
+        prompt_tokens += count_tokens(format_chunks(chunks))
+
+    n = len(questions)
+    return recall / n, prompt_tokens / n, elapsed / n * 1000
+
+def main(corpus_dir=FIXTURES / "procedures", questions_path=FIXTURES / "questions.jsonl"):
+    questions = load_questions(questions_path)
+    full_tokens = count_tokens(load_procedures(corpus_dir))
+    print(f"{len(questions)} questions, full corpus context: {full_tokens} tokens")
+    print(f"{'backend':<10} {'k':>3} {'recall@k':>9} {'tokens/query':>13} {'vs full':>8} {'ms/query':>9}")
+
+    for label, embedding in [("bm25", None), ("bm25+hash", HashingEmbedding())]:
+        index = build_index(corpus_dir, chunk_tokens=80, embedding=embedding)
+        for top_k in (1, 3, 5):
+            recall, tokens, ms = evaluate(index, questions, top_k, token_budget=None)
+            print(f"{label:<10} {top_k:>3} {recall:>9.2f} {tokens:>13.0f} {tokens / full_tokens:>8.0%} {ms:>9.3f}")
+
+    print(f"\n{len(PARAPHRASES)} paraphrased questions, bm25, k=3")
+    index = build_index(corpus_dir, chunk_tokens=80)
+    for label, fallback in [("search", False), ("+fallback", True)]:
+        recall, tokens, ms = evaluate(index, PARAPHRASES, 3, token_budget=None, fallback=fallback)
+        print(f"{label:<10} {3:>3} {recall:>9.2f} {tokens:>13.0f} {tokens / full_tokens:>8.0%} {ms:>9.3f}")
+
+if __name__ == "__main__":
+    main(*sys.argv[1:])
@@ -0,0 +1,215 @@
+"""
+Multi-process scaling check: runs worker processes against one shared
+local store and verifies that nothing is lost or overwritten.
+
+1. Turn state: every worker does concurrent read-increment-write cycles on
+   the same few keys through BatchingStorage, retrying on ETagConflict; the
+   final counters must equal the total number of increments.
+2. Serving: the app is started with 1 and then N forked workers (fake
+   models, stub connector) and driven with synthetic conversations; every
+   turn must be answered and stored once, and throughput is compared.
+
+Needs no network or credentials. Linux/macOS only (uses fork). Run from src/:
+
+    python -m benchmarks.scaling_bench --workers 2 --conversations 40 --turns 3
+"""
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import socket
+import sqlite3
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.load_test import FIXTURES, QUESTIONS, install_stub_connector, lift_rate_limits, make_activity
+
+
+def _increment_worker(db_path: str, keys: int, increments: int, concurrency: int, results):
+    from state_storage import BatchingStorage, ETagConflict, SqliteStateBackend
+
+    async def run():
+        storage = BatchingStorage(SqliteStateBackend(db_path))
+        await storage.open()
+        retries = 0
+
+        async def increment(i):
+            nonlocal retries
+            key = f"counter/{i % keys}"
+            while True:
+                item = (await storage.read([key]))[key]
+                item["n"] += 1
+                try:
+                    await storage.write({key: item})
+                    return
+                except ETagConflict:
+                    retries += 1
+
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded(i):
+            async with semaphore:
+                await increment(i)
+
+        await asyncio.gather(*(bounded(i) for i in range(increments)))
+        results.put((retries, storage.stats()))
+        await storage.close()
+
+    asyncio.run(run())
+
+
+def check_state_storage(workers: int, keys: int, increments: int, concurrency: int) -> bool:
+    db_path = str(Path(tempfile.mkdtemp(prefix="scaling_state_")) / "state.sqlite")
+
+    # Items written without an etag are last-writer-wins (the botbuilder Storage
+    # contract), so create the contended keys before the workers race on them
+    async def seed():
+        from state_storage import BatchingStorage, SqliteStateBackend
+        storage = BatchingStorage(SqliteStateBackend(db_path))
+        await storage.open()
+        await storage.write({f"counter/{i}": {"n": 0} for i in range(keys)})
+        await storage.close()
+
+    asyncio.run(seed())
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+
+    start = time.perf_counter()
+    processes = [
+        context.Process(target=_increment_worker, args=(db_path, keys, increments, concurrency, results))
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+    stats = [results.get() for _ in processes]
+    for process in processes:
+        process.join()
+    elapsed = time.perf_counter() - start
+
+    with sqlite3.connect(db_path) as db:
+        total = sum(json.loads(value)["n"] for (value,) in db.execute("SELECT value FROM bot_state"))
+    expected = workers * increments
+    retries = sum(r for r, _ in stats)
+    write_batches = sum(s["write_batches"] for _, s in stats)
+    writes = sum(s["writes"] for _, s in stats)
+    ok = total == expected
+    print(f"turn state     : {workers} workers x {increments} increments on {keys} keys in {elapsed:.2f}s, "
+          f"counted {total}/{expected} {'OK' if ok else 'LOST UPDATES'}; "
+          f"{retries} etag retries, {writes} writes in {write_batches} batches")
+    return ok
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+async def drive(url: str, conversations: int, turns: int, tag: str):
+    from aiohttp import ClientSession
+
+    errors = 0
+
+    async def conversation(session, i):
+        nonlocal errors
+        for turn in range(turns):
+            body = make_activity(f"{tag}-{i}", QUESTIONS[(i + turn) % len(QUESTIONS)])
+            async with session.post(url, json=body) as response:
+                await response.read()
+                if response.status >= 400:
+                    errors += 1
+
+    # Wait for the workers to start accepting
+    async with ClientSession() as session:
+        for _ in range(100):
+            try:
+                async with session.get(url.replace("/api/messages", "/metrics")):
+                    break
+            except OSError:
+                await asyncio.sleep(0.1)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(conversation(session, i) for i in range(conversations)))
+        return time.perf_counter() - start, errors
+
+
+def check_serving(workers: int, conversations: int, turns: int) -> tuple:
+    import app
+    import store
+    from utils.config import config
+
+    db_dir = Path(tempfile.mkdtemp(prefix=f"scaling_{workers}w_"))
+    store.shared_store.db_path = str(db_dir / "chat.sqlite")
+    store.feedback.db_path = str(db_dir / "feedback.sqlite")
+    store.state_storage.backend.db_path = str(db_dir / "state.sqlite")
+    store.history.max_entries = config.history_cache.max_entries if workers == 1 else 0
+
+    port = free_port()
+    processes = app.start_workers(workers, "localhost", port)
+    try:
+        elapsed, errors = asyncio.run(
+            drive(f"http://localhost:{port}/api/messages", conversations, turns, f"w{workers}")
+        )
+    finally:
+        for process in processes:
+            process.terminate()
+        for process in processes:
+            process.join()
+
+    stored_turns, seqs = 0, []
+    for shard in store.shared_store.shards:
+        with sqlite3.connect(shard.db_path) as db:
+            stored_turns += db.execute("SELECT COUNT(*) FROM chat_turns").fetchone()[0]
+            seqs += [row[0] for row in db.execute("SELECT MAX(seq) FROM chat_history GROUP BY user_id")]
+    max_seq = (min(seqs, default=None), max(seqs, default=None))
+    with sqlite3.connect(store.state_storage.backend.db_path) as db:
+        states = db.execute("SELECT COUNT(*) FROM bot_state WHERE key LIKE '%/conversations/%'").fetchone()[0]
+
+    expected = conversations * turns
+    ok = errors == 0 and stored_turns == expected and max_seq == (2 * turns, 2 * turns) and states == conversations
+    rate = expected / elapsed
+    print(f"serving        : {workers} worker(s), {expected} turns in {elapsed:.2f}s ({rate:.1f} turns/s), "
+          f"{errors} errors, {stored_turns}/{expected} turns stored, "
+          f"history seq range {max_seq}, {states} conversation states {'OK' if ok else 'MISMATCH'}")
+    return ok, rate
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--conversations", type=int, default=40)
+    parser.add_argument("--turns", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.02, help="fake model latency per call, seconds")
+    parser.add_argument("--keys", type=int, default=4, help="turn state keys contended by the workers")
+    parser.add_argument("--increments", type=int, default=500, help="turn state increments per worker")
+    args = parser.parse_args(argv)
+
+    for name in ("BOT_ID", "BOT_PASSWORD", "BOT_TENANT_ID"):
+        os.environ[name] = ""
+    os.environ.setdefault("MAIN_GOOGLE_API_KEY", "fake")
+    os.environ.setdefault("TOOL_GOOGLE_API_KEY", "fake")
+
+    state_ok = check_state_storage(args.workers, args.keys, args.increments, concurrency=16)
+
+    from benchmarks.fakes import install_fake_models
+    install_fake_models(latency=args.latency)
+    import agent
+    from bot import bot_app
+    agent.corpus.dir_path = FIXTURES / "procedures"
+    agent.corpus.snapshot_path = None
+    agent.corpus.load()
+    install_stub_connector(bot_app.adapter, 0.005)
+    lift_rate_limits()
+
+    single_ok, single_rate = check_serving(1, args.conversations, args.turns)
+    multi_ok, multi_rate = check_serving(args.workers, args.conversations, args.turns)
+    print(f"scaling        : {multi_rate / single_rate:.2f}x with {args.workers} workers")
+
+    sys.exit(0 if state_ok and single_ok and multi_ok else 1)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,96 @@
+"""
+Sharded knowledge base benchmark: grows the fixture procedures with filler
+documents until the corpus spans many shards, then answers the fixture
+questions in sharded mode with FakeChatModel, sequentially and with bounded
+parallelism, next to a single shard call.
+
+Needs no network or credentials. Run from src/:
+
+    python -m benchmarks.shard_bench --filler 30 --shard-tokens 4000 --latency 0.1
+"""
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+from benchmarks.load_test import FIXTURES, QUESTIONS
+
+# Words that do not occur in the fixture questions, so filler shards are irrelevant to them
+_FILLER_WORDS = (
+    "facilities parking cafeteria badge printer stationery mailroom furniture plants "
+    "lighting heating recycling lockers shuttle canteen reception visitors lounge "
+    "catering maintenance cleaning elevators signage storage kitchen"
+).split()
+
+
+def make_corpus(filler: int, words_per_document: int) -> Path:
+    corpus_dir = Path(tempfile.mkdtemp(prefix="shard_bench_"))
+    for path in (FIXTURES / "procedures").iterdir():
+        shutil.copy(path, corpus_dir / path.name)
+
+    rng = random.Random(0)
+    for i in range(filler):
+        paragraphs = [
+            " ".join(rng.choice(_FILLER_WORDS) for _ in range(60)).capitalize() + "."
+            for _ in range(words_per_document // 60)
+        ]
+        (corpus_dir / f"Facilities Note {i}.md").write_text("\n\n".join(paragraphs))
+    return corpus_dir
+
+
+async def run(args):
+    import agent
+    import store
+    from utils.config import config
+
+    store.answer_cache.enabled = False
+    config.knowledge_base.mode = "sharded"
+    config.knowledge_base.shard_tokens = args.shard_tokens
+    agent.corpus.dir_path = make_corpus(args.filler, args.words)
+    agent.corpus.snapshot_path = None
+    snapshot = await agent.corpus.wait_loaded()
+    runtime = await agent.get_runtime()
+    shards = snapshot.shards(args.shard_tokens)
+    print(f"corpus         : {len(snapshot.documents)} documents, {snapshot.index.total_tokens} tokens, "
+          f"{len(shards)} shards of at most {args.shard_tokens} tokens")
+
+    async def timed(call):
+        latencies = []
+        for question in QUESTIONS:
+            start = time.perf_counter()
+            await call(question)
+            latencies.append(time.perf_counter() - start)
+        return statistics.mean(latencies)
+
+    single = await timed(lambda q: runtime.map_chain.ainvoke({"query": q, "context": shards[0]}))
+    print(f"single shard   : {single * 1000:7.0f}ms per question")
+    for parallel in (1, args.parallel):
+        config.knowledge_base.max_parallel_shards = parallel
+        sharded = await timed(agent.knowledge_base_answer)
+        print(f"sharded x{parallel:<4} : {sharded * 1000:7.0f}ms per question ({sharded / single:.1f}x a single shard call)")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--filler", type=int, default=30, help="filler documents added to the fixtures")
+    parser.add_argument("--words", type=int, default=1200, help="words per filler document")
+    parser.add_argument("--shard-tokens", type=int, default=4000)
+    parser.add_argument("--parallel", type=int, default=16, help="max_parallel_shards for the parallel run")
+    parser.add_argument("--latency", type=float, default=0.1, help="fake model latency per call, seconds")
+    args = parser.parse_args(argv)
+
+    os.environ.setdefault("MAIN_GOOGLE_API_KEY", "fake")
+    os.environ.setdefault("TOOL_GOOGLE_API_KEY", "fake")
+    from benchmarks.fakes import install_fake_models
+    install_fake_models(latency=args.latency, tokens=40)
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,133 @@
+"""
+Startup benchmark: how long a fresh process takes to import the app, to
+accept connections (/healthz) and to be ready to answer (/readyz, models
+built and corpus loaded).
+
+Every run starts a new interpreter, so nothing is cached between runs
+except by the OS. Model clients are the real ChatGoogleGenerativeAI with a
+dummy key (building them makes no network call); pass --fake-models to use
+FakeChatModel instead. Run from src/:
+
+    python -m benchmarks.startup_bench --runs 5
+"""
+import argparse
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.request
+from pathlib import Path
+
+from benchmarks.load_test import FIXTURES
+
+_IMPORT_SCRIPT = "import time; start = time.perf_counter(); import app; print(time.perf_counter() - start)"
+
+
+def _environment() -> dict:
+    env = dict(os.environ)
+    for name in ("BOT_ID", "BOT_PASSWORD", "BOT_TENANT_ID"):
+        env[name] = ""
+    env.setdefault("MAIN_GOOGLE_API_KEY", "fake")
+    env.setdefault("TOOL_GOOGLE_API_KEY", "fake")
+    return env
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("localhost", 0))
+        return sock.getsockname()[1]
+
+
+def measure_import() -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", _IMPORT_SCRIPT], env=_environment(), capture_output=True, text=True, check=True
+    )
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def _status(url: str) -> int:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status
+    except urllib.error.HTTPError as e:
+        return e.code
+    except OSError:
+        return 0
+
+
+def measure_ready(fake_models: bool, timeout: float = 60.0) -> tuple:
+    """Seconds from process start until /healthz, then /readyz, answer 200"""
+    port = free_port()
+    command = [sys.executable, "-m", "benchmarks.startup_bench", "--serve", str(port)]
+    if fake_models:
+        command.append("--fake-models")
+
+    start = time.perf_counter()
+    process = subprocess.Popen(command, env=_environment(), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    healthy = ready = None
+    try:
+        while ready is None and time.perf_counter() - start < timeout:
+            if healthy is None and _status(f"http://localhost:{port}/healthz") == 200:
+                healthy = time.perf_counter() - start
+            if healthy is not None and _status(f"http://localhost:{port}/readyz") == 200:
+                ready = time.perf_counter() - start
+            time.sleep(0.01)
+    finally:
+        process.terminate()
+        process.wait()
+    if ready is None:
+        raise RuntimeError(f"Not ready after {timeout}s")
+    return healthy, ready
+
+
+def serve(port: int, fake_models: bool):
+    if fake_models:
+        from benchmarks.fakes import install_fake_models
+        install_fake_models(latency=0.0)
+
+    import app
+    import store
+    from agent import corpus
+
+    db_dir = Path(tempfile.mkdtemp(prefix="startup_bench_"))
+    store.shared_store.db_path = str(db_dir / "chat.sqlite")
+    store.feedback.db_path = str(db_dir / "feedback.sqlite")
+    store.state_storage.backend.db_path = str(db_dir / "state.sqlite")
+    corpus.dir_path = FIXTURES / "procedures"
+    corpus.snapshot_path = db_dir / "corpus.snapshot"
+    app.serve(port=port, workers=1)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--fake-models", action="store_true")
+    parser.add_argument("--serve", type=int, metavar="PORT", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.serve:
+        serve(args.serve, args.fake_models)
+        return
+
+    imports, healthy, ready = [], [], []
+    for _ in range(args.runs):
+        imports.append(measure_import())
+        h, r = measure_ready(args.fake_models)
+        healthy.append(h)
+        ready.append(r)
+
+    def summary(values):
+        return f"median {statistics.median(values) * 1000:.0f}ms  min {min(values) * 1000:.0f}ms  max {max(values) * 1000:.0f}ms"
+
+    print(f"{args.runs} runs, {'fake' if args.fake_models else 'Gemini'} model clients")
+    print(f"import app     : {summary(imports)}")
+    print(f"healthz (live) : {summary(healthy)}")
+    print(f"readyz (ready) : {summary(ready)}")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
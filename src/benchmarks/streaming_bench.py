@@ -0,0 +1,47 @@
+"""
+Perceived-latency benchmark: time until the user sees something, for the
+blocking reply path and the streaming path, using a fake chat model and a
+stub Teams adapter. Run from src/:
+
+    python -m benchmarks.streaming_bench [latency] [token_delay] [tokens]
+"""
+import asyncio
+import sys
+import time
+from benchmarks.fakes import StubAdapter, install_fake_models
+
+async def run(latency, token_delay, tokens):
+    install_fake_models(latency=latency, token_delay=token_delay, tokens=tokens)
+    import agent
+    from streaming import StreamingReply
+
+    question = "How do I request PTO?"
+
+    adapter = StubAdapter()
+    context = adapter.context_for(question)
+    start = time.monotonic()
+    response = await agent.ainvoke(question, [])
+    await context.send_activity(response)
+    blocking = time.monotonic() - start
+
+    adapter = StubAdapter()
+    context = adapter.context_for(question)
+    reply = StreamingReply(context, interval=0.25, render=agent.add_links)
+    await reply.begin()
+    typing_at = time.monotonic() - reply.started_at
+    text = ""
+    async for text in agent.astream(question, []):
+        await reply.update(text)
+    await reply.end(text)
+    streaming_total = time.monotonic() - reply.started_at
+
+    print(f"model latency {latency}s, {tokens} tokens at {token_delay}s/token")
+    print(f"blocking : first text {blocking:.2f}s, complete {blocking:.2f}s")
+    print(f"streaming: typing {typing_at:.3f}s, first text {reply.time_to_first_text:.2f}s, "
+          f"complete {streaming_total:.2f}s, {reply.updates} in-place updates")
+    assert adapter.sent[-1].text == text or adapter.updated[-1].text == text
+
+if __name__ == "__main__":
+    args = [float(a) for a in sys.argv[1:]]
+    latency, token_delay, tokens = (args + [0.5, 0.02, 150][len(args):])[:3]
+    asyncio.run(run(latency, token_delay, int(tokens)))
@@ -1,58 +1,61 @@
 import re
-import sys
 import json
-import traceback
-from dataclasses import asdict
-from botbuilder.core import MemoryStorage, TurnContext
-from teams import Application, ApplicationOptions, TeamsAdapter
+from botbuilder.core import MessageFactory, TurnContext
+from teams import Application, ApplicationOptions
 from teams.state import TurnState
 from teams.feedback_loop_data import FeedbackLoopData
-from agent_service import invoke_agent, new_session
+from agent import add_links, corpus
+from agent_service import invoke_agent, stream_agent, new_session, get_turn
+from streaming import stream_reply
+from admission import Busy, admission
+from outbound import OutboundTeamsAdapter, outbound
+from db import new_turn_id
+from feedback import Feedback, NEGATIVE, POSITIVE
+from store import feedback, state_storage
+from utils.metrics import span, turns_total
 from utils.logger import logger
 from botbuilder.schema import Activity, Attachment, ActivityTypes
-from datetime import datetime
-from utils.config import config
-
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
+from utils.config import config as settings
+from utils.io_manager import get_env
 
 class Config:
-    APP_ID = os.environ.get("BOT_ID", "")
-    APP_PASSWORD = os.environ.get("BOT_PASSWORD", "")
-    APP_TYPE = os.environ.get("BOT_TYPE", "")
-    APP_TENANTID = os.environ.get("BOT_TENANT_ID", "")
+    APP_ID = get_env("BOT_ID", "")
+    APP_PASSWORD = get_env("BOT_PASSWORD", "")
+    APP_TYPE = get_env("BOT_TYPE", "")
+    APP_TENANTID = get_env("BOT_TENANT_ID", "")
 
 config = Config()
 
 # Define storage and application
-storage = MemoryStorage()
+storage = state_storage
 bot_app = Application[TurnState](
     ApplicationOptions(
         bot_app_id=config.APP_ID,
         storage=storage,
-        adapter=TeamsAdapter(config),
+        adapter=OutboundTeamsAdapter(config, outbound),
     )
 )
 
 @bot_app.error
 async def on_error(context: TurnContext, error: Exception):
-    # This check writes out errors to console log .vs. app insights.
-    # NOTE: In production environment, you should consider logging this to Azure
-    #       application insights.
-    print(f"\n [on_turn_error] unhandled error: {error}", file=sys.stderr)
-    traceback.print_exc()
+    logger.opt(exception=error).error(f"Unhandled error in turn: {error}")
 
     # Send a message to the user
     await context.send_activity("The agent encountered an error or bug.")
 
 @bot_app.feedback_loop()
-async def feedback_loop(_context: TurnContext, _state: TurnState, feedback_loop_data: FeedbackLoopData):
-    # Add custom feedback process logic here.
-    print(f"Your feedback is:\n{json.dumps(asdict(feedback_loop_data), indent=4)}")
-
-async def create_feedback_card(user_message: str, response: str) -> Activity:
+async def feedback_loop(context: TurnContext, _state: TurnState, feedback_loop_data: FeedbackLoopData):
+    comment = feedback_loop_data.action_value.feedback
+    feedback_id = feedback.record(Feedback(
+        conversation_id=re.sub(r'[^a-zA-Z0-9]', '', context.activity.conversation.id),
+        rating=POSITIVE if feedback_loop_data.action_value.reaction == "like" else NEGATIVE,
+        source="feedback_loop",
+        comment=comment if isinstance(comment, str) else json.dumps(comment),
+        activity_id=feedback_loop_data.reply_to_id
+    ))
+    logger.info(f"Feedback {feedback_id} queued for activity {feedback_loop_data.reply_to_id}")
+
+async def create_feedback_card(turn_id: str) -> Activity:
     return Activity(
                 type=ActivityTypes.message,
                 attachments=[
@@ -75,8 +78,7 @@ async def create_feedback_card(user_message: str, response: str) -> Activity:
                                     "title": "👍 Yes",
                                     "data": {
                                         "feedback": "thumbs_up",
-                                        "originalQuestion": user_message,
-                                        "agentResponse": response
+                                        "turnId": turn_id
                                     }
                                 },
                                 {
@@ -84,8 +86,7 @@ async def create_feedback_card(user_message: str, response: str) -> Activity:
                                     "title": "👎 No",
                                     "data": {
                                         "feedback": "thumbs_down",
-                                        "originalQuestion": user_message,
-                                        "agentResponse": response
+                                        "turnId": turn_id
                                     }
                                 }
                             ]
@@ -94,24 +95,28 @@ async def create_feedback_card(user_message: str, response: str) -> Activity:
                 ]
             )   
 
-async def save_feedback(feedback_data: dict, feedback_type: str):
-    """Save feedback data to a file with a timestamp, organized by feedback type."""
-    # Directory based on feedback type
-    directory = os.path.join(config.app.path, "feedback", feedback_type)
-    os.makedirs(directory, exist_ok=True)
-
-    # Create timestamp-based filename
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{timestamp}.json"
-
-    # Full path to the file
-    filepath = os.path.join(directory, filename)
-
-    # Write feedback data to the file
-    with open(filepath, "w") as file:
-        json.dump(feedback_data, file, indent=4)
-
-    logger.info(f"Feedback saved to {filepath}")
+async def save_feedback(conversation_id: str, feedback_data: dict, rating: str) -> str:
+    """Resolve the card's turn and queue the feedback on the feedback store; returns the feedback id."""
+    turn_id = feedback_data.get("turnId")
+    turn = await get_turn(conversation_id, turn_id) if turn_id else None
+    if turn is not None:
+        question, answer = turn.question, turn.answer
+    else:
+        # Cards sent before turn ids existed carry the text itself
+        question, answer = feedback_data.get("originalQuestion"), feedback_data.get("agentResponse")
+
+    feedback_id = feedback.record(Feedback(
+        conversation_id=conversation_id,
+        rating=rating,
+        source="card",
+        question=question,
+        answer=answer,
+        turn_id=turn.turn_id if turn is not None else None,
+        procedures=corpus.snapshot.link_matcher.linked(answer) if answer else []
+    ))
+
+    logger.info(f"Feedback {feedback_id} queued for conversation {conversation_id}")
+    return feedback_id
 
 @bot_app.activity("message")
 async def on_message_activity(context: TurnContext, state: TurnState):
@@ -119,33 +124,61 @@ async def on_message_activity(context: TurnContext, state: TurnState):
     activity_value = context.activity.value
     is_feedback_message = activity_value and isinstance(activity_value, dict) and "feedback" in activity_value
     if is_feedback_message:
-        print(f"Received feedback: {activity_value['feedback']}")
+        conversation_id = re.sub(r'[^a-zA-Z0-9]', '', context.activity.conversation.id)
+        logger.info(f"Received feedback {activity_value['feedback']} in conversation {conversation_id}")
         match activity_value["feedback"]:
             case "thumbs_up":
-                await save_feedback(activity_value, "positive")
+                await save_feedback(conversation_id, activity_value, POSITIVE)
             case "thumbs_down":
-                await save_feedback(activity_value, "negative")
+                await save_feedback(conversation_id, activity_value, NEGATIVE)
         return
     user_message = context.activity.text
 
-    print("User Message:", user_message)
     user_id = context.activity.conversation.id if context.activity.conversation else None
     if not user_id:
-        print("No user ID found in the conversation.")
+        logger.warning("No user ID found in the conversation")
         await context.send_activity("No user ID found in the conversation.")
         return
     
     clean_uuid = re.sub(r'[^a-zA-Z0-9]', '', user_id)
 
-    logger.info(f"Received message from user ID: {clean_uuid}")
-
+    turn_id = new_turn_id()
+
+    # Every line logged while the turn runs, in the agent and its tools too, carries these ids
+    with logger.contextualize(conversation_id=clean_uuid, turn_id=turn_id):
+        logger.info("Received message")
+        logger.debug("User message: {}", user_message)
+
+        outcome = "error"
+        try:
+            with span("turn"):
+                async with admission.turn(clean_uuid):
+                    await handle_message(context, clean_uuid, turn_id, user_message)
+            outcome = "ok"
+        except Busy as e:
+            outcome = "busy"
+            logger.warning(f"Rejected message: {e}")
+            await context.send_activity("I'm busy answering other questions right now, please retry in a moment.")
+        finally:
+            turns_total.inc(outcome=outcome)
+
+async def handle_message(context: TurnContext, clean_uuid: str, turn_id: str, user_message: str):
+    """Answer a user message; runs with the conversation's turn slot held"""
     match user_message:
         case "/new_session":
             await new_session(clean_uuid)
             await context.send_activity("New Session started. Chat history cleared.")
-        case _:
-            response = await invoke_agent(clean_uuid, user_message)
-            await context.send_activity(response)
+        case _ if settings.streaming.enabled:
+            await stream_reply(context, stream_agent(clean_uuid, user_message, turn_id), render=add_links)
 
-            feedback_card = await create_feedback_card(user_message, response)
-            await context.send_activity(feedback_card)
\ No newline at end of file
+            feedback_card = await create_feedback_card(turn_id)
+            async with span("send_activity"):
+                await context.send_activity(feedback_card)
+        case _:
+            response = await invoke_agent(clean_uuid, user_message, turn_id)
+            feedback_card = await create_feedback_card(turn_id)
+            async with span("send_activity"):
+                await context.send_activities([
+                    MessageFactory.text(response),
+                    feedback_card
+                ])
\ No newline at end of file
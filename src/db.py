@@ -1,149 +1,588 @@
 import asyncio
+import secrets
+import time
+import zlib
 import aiosqlite
 from datetime import datetime
-from typing import List, Dict, Optional
+from pathlib import Path
+from typing import List, Dict, Optional, Tuple
 from dataclasses import dataclass
 from contextlib import asynccontextmanager
 
+USER = "User"
+AGENT = "Agent"
+
 @dataclass
 class ChatMessage:
     user_id: str
+    role: str
     message: str
-    timestamp: datetime
-    message_id: Optional[int] = None
+    timestamp: int
+    seq: Optional[int] = None
     
     def to_dict(self) -> Dict:
         return {
-            'message_id': self.message_id,
+            'seq': self.seq,
             'user_id': self.user_id,
+            'role': self.role,
             'message': self.message,
-            'timestamp': self.timestamp.isoformat()
+            'timestamp': self.timestamp
         }
 
+    def to_prompt(self) -> str:
+        return f"{self.role}: {self.message}"
+
+
+def new_turn_id() -> str:
+    """Short random id for a question/answer turn, compact enough to embed in a card"""
+    return secrets.token_urlsafe(9)
+
+
+@dataclass
+class ChatTurn:
+    turn_id: str
+    user_id: str
+    question: str
+    answer: str
+    timestamp: int
+    # seq of the agent message in the conversation history
+    seq: Optional[int] = None
+
+
+@dataclass
+class ChatSummary:
+    user_id: str
+    summary: str
+    # Messages up to and including this seq are folded into the summary
+    through_seq: int
+    timestamp: int
+
+
+# Tables and indexes of a chat database (or of each shard of one)
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS chat_history (
+        user_id TEXT NOT NULL,
+        slot INTEGER NOT NULL,
+        seq INTEGER NOT NULL,
+        role TEXT NOT NULL,
+        message TEXT NOT NULL,
+        timestamp INTEGER NOT NULL,
+        PRIMARY KEY (user_id, slot)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS chat_turns (
+        turn_id TEXT PRIMARY KEY,
+        user_id TEXT NOT NULL,
+        seq INTEGER,
+        question TEXT NOT NULL,
+        answer TEXT NOT NULL,
+        timestamp INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_turns_timestamp ON chat_turns (timestamp)",
+    """
+    CREATE TABLE IF NOT EXISTS chat_summaries (
+        user_id TEXT PRIMARY KEY,
+        summary TEXT NOT NULL,
+        through_seq INTEGER NOT NULL,
+        timestamp INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """,
+]
+
 
 class AsyncChatStore:
-    def __init__(self, db_path: str = "chat_messages.db"):
+    """
+    Chat history store backed by SQLite in WAL mode.
+
+    The store is meant to be opened once and shared for the lifetime of the
+    process. Reads go through a small pool of reader connections so concurrent
+    conversations never wait on each other, while all writes are serialized
+    through a single writer connection.
+
+    History is kept as a ring buffer: each conversation owns `history_size`
+    slots and a message with sequence number `seq` always lands in slot
+    `seq % history_size`, so trimming is an in-place overwrite.
+
+    Each answered question is also stored as a turn under a compact turn id,
+    outside the ring, so it can still be looked up after it has rolled out
+    of the history window. Next to the ring, each conversation can have a
+    rolling summary of its older messages.
+    """
+
+    def __init__(self, db_path: str = "chat_messages.db", readers: int = 4, history_size: int = 5):
         self.db_path = db_path
+        self.readers = readers
+        self.history_size = history_size
         self._db = None
-    
+        self._readers: Optional[asyncio.Queue] = None
+        self._write_lock = asyncio.Lock()
+
     async def __aenter__(self):
-        await self.__connect()
+        await self.open()
         return self
-    
+
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        await self.__close()
-    
-    async def __connect(self):
-        """Initialize database connection and create table if needed"""
+        await self.close()
+
+    @property
+    def is_open(self) -> bool:
+        return self._db is not None
+
+    @property
+    def shards(self) -> List["AsyncChatStore"]:
+        """The stores that own conversations; ShardedChatStore has several"""
+        return [self]
+
+    def shard_for(self, user_id: str) -> "AsyncChatStore":
+        """The store that owns a conversation, whose transaction() writes to it"""
+        return self
+
+    async def open(self):
+        """Open the writer and reader connections and create tables if needed"""
+        if self.is_open:
+            return
+
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+
         self._db = await aiosqlite.connect(self.db_path)
-        await self._db.execute("""
-            CREATE TABLE IF NOT EXISTS chat_messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                user_id TEXT NOT NULL,
-                message TEXT NOT NULL,
-                timestamp TEXT NOT NULL
+        # Only takes effect on a new database; see incremental_vacuum()
+        await self._db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._db.execute("PRAGMA synchronous=NORMAL")
+        for statement in SCHEMA:
+            await self._db.execute(statement)
+        await self._db.commit()
+        await self._migrate_legacy_messages()
+
+        self._readers = asyncio.Queue()
+        for _ in range(max(1, self.readers)):
+            reader = await aiosqlite.connect(self.db_path)
+            await reader.execute("PRAGMA query_only=ON")
+            self._readers.put_nowait(reader)
+
+    async def _migrate_legacy_messages(self):
+        """
+        Copy the newest `history_size` messages of each conversation from the
+        chat_messages table of the first releases, which stored "Role: text"
+        lines with ISO timestamps, into chat_history. Runs once: the old table
+        is renamed to chat_messages_legacy afterwards, and is left alone if
+        chat_history already has rows.
+        """
+        cursor = await self._db.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'chat_messages'"
+        )
+        if await cursor.fetchone() is None:
+            return
+        cursor = await self._db.execute("SELECT 1 FROM chat_history LIMIT 1")
+        if await cursor.fetchone() is not None:
+            return
+
+        cursor = await self._db.execute("""
+            SELECT user_id, message, timestamp FROM (
+                SELECT user_id, message, timestamp, id,
+                       ROW_NUMBER() OVER (PARTITION BY user_id ORDER BY timestamp DESC, id DESC) AS age
+                FROM chat_messages
             )
-        """)
-        await self._db.execute("""
-            CREATE INDEX IF NOT EXISTS idx_user_timestamp 
-            ON chat_messages(user_id, timestamp DESC)
-        """)
+            WHERE age <= ?
+            ORDER BY user_id, timestamp, id
+        """, (self.history_size,))
+        rows = []
+        seqs: Dict[str, int] = {}
+        for user_id, line, timestamp in await cursor.fetchall():
+            role, separator, message = line.partition(": ")
+            if not separator or role not in (USER, AGENT):
+                role, message = USER, line
+            seq = seqs[user_id] = seqs.get(user_id, 0) + 1
+            rows.append((
+                user_id, seq % self.history_size, seq, role, message,
+                int(datetime.fromisoformat(timestamp).timestamp())
+            ))
 
-        await self._db.commit()
-    
-    async def __close(self):
-        """Close database connection"""
+        async with self.transaction():
+            await self._db.executemany("""
+                INSERT INTO chat_history (user_id, slot, seq, role, message, timestamp)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, rows)
+            await self._db.execute("ALTER TABLE chat_messages RENAME TO chat_messages_legacy")
+
+    async def close(self):
+        """Close all database connections"""
+        if self._readers:
+            while not self._readers.empty():
+                await self._readers.get_nowait().close()
+            self._readers = None
         if self._db:
             await self._db.close()
-    
+            self._db = None
+
+    @asynccontextmanager
+    async def _reader(self):
+        """Borrow a reader connection from the pool"""
+        reader = await self._readers.get()
+        try:
+            yield reader
+        finally:
+            self._readers.put_nowait(reader)
+
     @asynccontextmanager
     async def transaction(self):
         """
         Async context manager for database transactions.
         Yields control back to caller before committing.
         Only commits if no exceptions are raised.
+        Transactions are serialized on the single writer connection.
         """
-        await self._db.execute("BEGIN TRANSACTION")
-        try:
-            yield self
-            await self._db.commit()
-        except Exception as e:
-            await self._db.rollback()
-            raise e
+        async with self._write_lock:
+            await self._db.execute("BEGIN IMMEDIATE TRANSACTION")
+            try:
+                yield self
+                await self._db.commit()
+            except Exception as e:
+                await self._db.rollback()
+                raise e
     
-    async def add_message(self, user_id: str, message: str) -> ChatMessage:
+    async def add_message(self, user_id: str, role: str, message: str) -> ChatMessage:
         """
-        Add a new message and maintain only the last 5 messages per user.
+        Add a single message to the conversation history.
         Should be called within a transaction context.
         """
-        timestamp = datetime.now()
-        
-        # Insert new message
+        messages = await self.add_messages(user_id, [(role, message)])
+        return messages[0]
+
+    async def add_messages(self, user_id: str, messages: List[Tuple[str, str]]) -> List[ChatMessage]:
+        """
+        Add a batch of (role, message) pairs, e.g. a whole turn, in one statement.
+        Older messages are overwritten in place once the history window is full.
+        Should be called within a transaction context.
+        """
+        if not messages:
+            return []
+
+        timestamp = int(time.time())
+
+        # The ring holds at most `history_size` rows per user, so this is a bounded lookup
         cursor = await self._db.execute("""
-            INSERT INTO chat_messages (user_id, message, timestamp)
-            VALUES (?, ?, ?)
-        """, (user_id, message, timestamp.isoformat()))
-        
-        message_id = cursor.lastrowid
-        
-        # Keep only the last 5 messages for this user
-        await self._db.execute("""
-            DELETE FROM chat_messages 
-            WHERE user_id = ? AND id NOT IN (
-                SELECT id FROM chat_messages 
-                WHERE user_id = ? 
-                ORDER BY timestamp DESC 
-                LIMIT 5
+            SELECT COALESCE(MAX(seq), 0) FROM chat_history WHERE user_id = ?
+        """, (user_id,))
+        last_seq = (await cursor.fetchone())[0]
+
+        stored = [
+            ChatMessage(
+                seq=last_seq + i,
+                user_id=user_id,
+                role=role,
+                message=message,
+                timestamp=timestamp
             )
-        """, (user_id, user_id))
-        
-        return ChatMessage(
-            message_id=message_id,
-            user_id=user_id,
-            message=message,
-            timestamp=timestamp
-        )
+            for i, (role, message) in enumerate(messages, start=1)
+        ]
+
+        placeholders = ", ".join(["(?, ?, ?, ?, ?, ?)"] * len(stored))
+        params = []
+        for m in stored:
+            params.extend((m.user_id, m.seq % self.history_size, m.seq, m.role, m.message, m.timestamp))
+
+        await self._db.execute(f"""
+            INSERT OR REPLACE INTO chat_history (user_id, slot, seq, role, message, timestamp)
+            VALUES {placeholders}
+        """, params)
+
+        return stored
     
+    async def add_turns(self, turns: List[ChatTurn]):
+        """
+        Store question/answer turns under their turn ids.
+        Should be called within a transaction context.
+        """
+        await self._db.executemany("""
+            INSERT OR REPLACE INTO chat_turns (turn_id, user_id, seq, question, answer, timestamp)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, [(t.turn_id, t.user_id, t.seq, t.question, t.answer, t.timestamp) for t in turns])
+
+    async def get_turn(self, turn_id: str, user_id: Optional[str] = None) -> Optional[ChatTurn]:
+        """Look up a stored turn by id, only among the user's turns when `user_id` is given"""
+        async with self._reader() as reader:
+            cursor = await reader.execute("""
+                SELECT turn_id, user_id, question, answer, timestamp, seq
+                FROM chat_turns
+                WHERE turn_id = ? AND (? IS NULL OR user_id = ?)
+            """, (turn_id, user_id, user_id))
+            row = await cursor.fetchone()
+
+        return ChatTurn(*row) if row else None
+
+    async def set_summary(self, user_id: str, summary: str, through_seq: int) -> ChatSummary:
+        """
+        Replace the rolling summary of a user's older messages.
+        Should be called within a transaction context.
+        """
+        stored = ChatSummary(user_id=user_id, summary=summary, through_seq=through_seq, timestamp=int(time.time()))
+        await self._db.execute("""
+            INSERT OR REPLACE INTO chat_summaries (user_id, summary, through_seq, timestamp)
+            VALUES (?, ?, ?, ?)
+        """, (stored.user_id, stored.summary, stored.through_seq, stored.timestamp))
+        return stored
+
+    async def get_summary(self, user_id: str) -> Optional[ChatSummary]:
+        """Get the rolling summary of a user's older messages, if there is one"""
+        async with self._reader() as reader:
+            cursor = await reader.execute("""
+                SELECT user_id, summary, through_seq, timestamp
+                FROM chat_summaries
+                WHERE user_id = ?
+            """, (user_id,))
+            row = await cursor.fetchone()
+
+        return ChatSummary(*row) if row else None
+
     async def get_messages(self, user_id: str) -> List[ChatMessage]:
-        """Get all messages for a user in descending order of timestamp"""
-        cursor = await self._db.execute("""
-            SELECT id, user_id, message, timestamp
-            FROM chat_messages
-            WHERE user_id = ?
-            ORDER BY timestamp DESC
-        """, (user_id,))
-        
-        rows = await cursor.fetchall()
-        messages = []
-        
-        for row in rows:
-            messages.append(ChatMessage(
-                message_id=row[0],
-                user_id=row[1],
-                message=row[2],
-                timestamp=datetime.fromisoformat(row[3])
-            ))
-        
-        return messages
+        """Get the history window for a user, newest message first"""
+        async with self._reader() as reader:
+            cursor = await reader.execute("""
+                SELECT seq, user_id, role, message, timestamp
+                FROM chat_history
+                WHERE user_id = ?
+                ORDER BY seq DESC
+                LIMIT ?
+            """, (user_id, self.history_size))
+            rows = await cursor.fetchall()
+
+        return [
+            ChatMessage(seq=row[0], user_id=row[1], role=row[2], message=row[3], timestamp=row[4])
+            for row in rows
+        ]
     
     async def delete_all_messages(self, user_id: str) -> int:
         """
-        Delete all messages for a user. Returns number of deleted messages.
+        Delete all messages and the summary for a user. Returns number of deleted messages.
         Should be called within a transaction context.
         """
         cursor = await self._db.execute("""
-            DELETE FROM chat_messages WHERE user_id = ?
+            DELETE FROM chat_history WHERE user_id = ?
+        """, (user_id,))
+        await self._db.execute("""
+            DELETE FROM chat_summaries WHERE user_id = ?
         """, (user_id,))
         return cursor.rowcount
     
     async def get_message_count(self, user_id: str) -> int:
         """Get total message count for a user"""
-        cursor = await self._db.execute("""
-            SELECT COUNT(*) FROM chat_messages WHERE user_id = ?
-        """, (user_id,))
-        result = await cursor.fetchone()
+        async with self._reader() as reader:
+            cursor = await reader.execute("""
+                SELECT COUNT(*) FROM chat_history WHERE user_id = ?
+            """, (user_id,))
+            result = await cursor.fetchone()
         return result[0] if result else 0
 
+    async def idle_conversations(self, before: int, after: str = "", limit: int = 500) -> Tuple[List[str], Optional[str]]:
+        """
+        Page through conversations in user_id order, starting after `after`.
+        Returns those of the page without a message since `before`, and the
+        user_id to continue from, None once all have been seen.
+        """
+        async with self._reader() as reader:
+            cursor = await reader.execute("""
+                SELECT user_id, MAX(timestamp)
+                FROM chat_history
+                WHERE user_id > ?
+                GROUP BY user_id
+                ORDER BY user_id
+                LIMIT ?
+            """, (after, limit))
+            rows = await cursor.fetchall()
+
+        idle = [user_id for user_id, last in rows if last < before]
+        return idle, rows[-1][0] if len(rows) == limit else None
+
+    async def delete_idle_conversations(self, user_ids: List[str], before: int) -> List[str]:
+        """
+        Delete the history and summary of those of `user_ids` that still have
+        no message since `before`. Returns the deleted ones.
+        Should be called within a transaction context.
+        """
+        if not user_ids:
+            return []
+
+        placeholders = ", ".join("?" * len(user_ids))
+        cursor = await self._db.execute(f"""
+            SELECT user_id FROM chat_history
+            WHERE user_id IN ({placeholders})
+            GROUP BY user_id
+            HAVING MAX(timestamp) < ?
+        """, (*user_ids, before))
+        idle = [row[0] for row in await cursor.fetchall()]
+        if idle:
+            placeholders = ", ".join("?" * len(idle))
+            await self._db.execute(f"DELETE FROM chat_history WHERE user_id IN ({placeholders})", idle)
+            await self._db.execute(f"DELETE FROM chat_summaries WHERE user_id IN ({placeholders})", idle)
+        return idle
+
+    async def delete_turns_before(self, before: int, limit: int = 500) -> int:
+        """
+        Delete at most `limit` of the turns stored before `before`. Returns how many were deleted.
+        Should be called within a transaction context.
+        """
+        cursor = await self._db.execute("""
+            DELETE FROM chat_turns WHERE turn_id IN (
+                SELECT turn_id FROM chat_turns WHERE timestamp < ? LIMIT ?
+            )
+        """, (before, limit))
+        return cursor.rowcount
+
+    async def incremental_vacuum(self, pages: int) -> int:
+        """
+        Return up to `pages` free pages to the file system. Returns how many
+        were freed: none unless auto_vacuum is INCREMENTAL, which only a new
+        database or a full VACUUM sets.
+        """
+        async with self._write_lock:
+            freelist = await self._pragma("freelist_count")
+            # The pragma frees one page per row stepped
+            cursor = await self._db.execute(f"PRAGMA incremental_vacuum({int(pages)})")
+            await cursor.fetchall()
+            return freelist - await self._pragma("freelist_count")
+
+    async def optimize(self):
+        """Let SQLite refresh the statistics its query planner uses, where they are stale"""
+        async with self._write_lock:
+            await self._db.execute("PRAGMA optimize")
+
+    async def checkpoint(self) -> bool:
+        """Copy the WAL into the database and truncate it. Returns False if readers kept it from completing."""
+        async with self._write_lock:
+            cursor = await self._db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            busy, _, _ = await cursor.fetchone()
+        return not busy
+
+    async def _pragma(self, name: str) -> int:
+        cursor = await self._db.execute(f"PRAGMA {name}")
+        return (await cursor.fetchone())[0]
+
+    async def size_stats(self) -> Dict[str, int]:
+        """Database, free space and WAL sizes in bytes, and row counts"""
+        async with self._reader() as reader:
+            sizes = {}
+            for name in ("page_size", "page_count", "freelist_count"):
+                cursor = await reader.execute(f"PRAGMA {name}")
+                sizes[name] = (await cursor.fetchone())[0]
+            cursor = await reader.execute("""
+                SELECT
+                    (SELECT COUNT(*) FROM chat_history),
+                    (SELECT COUNT(DISTINCT user_id) FROM chat_history),
+                    (SELECT COUNT(*) FROM chat_turns),
+                    (SELECT COUNT(*) FROM chat_summaries)
+            """)
+            messages, conversations, turns, summaries = await cursor.fetchone()
+
+        wal = Path(f"{self.db_path}-wal")
+        return {
+            "db_bytes": sizes["page_count"] * sizes["page_size"],
+            "free_bytes": sizes["freelist_count"] * sizes["page_size"],
+            "wal_bytes": wal.stat().st_size if wal.exists() else 0,
+            "messages": messages,
+            "conversations": conversations,
+            "turns": turns,
+            "summaries": summaries,
+        }
+
+
+def shard_index(user_id: str, shards: int) -> int:
+    """The shard of a conversation, the same in every process and across restarts"""
+    return zlib.crc32(user_id.encode("utf-8")) % shards
+
+
+def shard_paths(db_path: str, shards: int) -> List[str]:
+    """Database files of a store split in `shards`; a single shard is `db_path` itself"""
+    if shards <= 1:
+        return [db_path]
+    path = Path(db_path)
+    return [str(path.with_name(f"{path.stem}.shard{i}of{shards}{path.suffix}")) for i in range(shards)]
+
+
+class ShardedChatStore:
+    """
+    Chat history split over `shards` SQLite databases by a stable hash of
+    the conversation id. Each shard is an AsyncChatStore with its own writer
+    connection and readers, so transactions on different shards, and the
+    processes running them, do not wait for each other.
+
+    A conversation's history, summary and turns all live in its shard:
+    writes go through `shard_for(user_id).transaction()`, reads are routed
+    the same way, and turn lookups by id ask every shard. Maintenance goes
+    over `shards` one at a time. The files of N shards are named after N
+    (see shard_paths), so changing the shard count needs reshard.py rather
+    than silently starting from empty shards.
+    """
+
+    def __init__(self, db_path: str = "chat_messages.db", shards: int = 1, readers: int = 4, history_size: int = 5):
+        self.readers = readers
+        self.history_size = history_size
+        self._shard_count = max(1, shards)
+        self.db_path = db_path
+
+    @property
+    def db_path(self) -> str:
+        return self._db_path
+
+    @db_path.setter
+    def db_path(self, db_path: str):
+        """Point the store at other files; only before it is opened"""
+        self._db_path = db_path
+        self.shards: List[AsyncChatStore] = [
+            AsyncChatStore(path, readers=self.readers, history_size=self.history_size)
+            for path in shard_paths(db_path, self._shard_count)
+        ]
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        await self.close()
+
+    @property
+    def is_open(self) -> bool:
+        return all(shard.is_open for shard in self.shards)
+
+    async def open(self):
+        await asyncio.gather(*(shard.open() for shard in self.shards))
+
+    async def close(self):
+        await asyncio.gather(*(shard.close() for shard in self.shards))
+
+    def shard_for(self, user_id: str) -> AsyncChatStore:
+        return self.shards[shard_index(user_id, len(self.shards))]
+
+    async def get_messages(self, user_id: str) -> List[ChatMessage]:
+        return await self.shard_for(user_id).get_messages(user_id)
+
+    async def get_summary(self, user_id: str) -> Optional[ChatSummary]:
+        return await self.shard_for(user_id).get_summary(user_id)
+
+    async def get_message_count(self, user_id: str) -> int:
+        return await self.shard_for(user_id).get_message_count(user_id)
+
+    async def get_turn(self, turn_id: str, user_id: Optional[str] = None) -> Optional[ChatTurn]:
+        """
+        Look up a stored turn by id in the user's shard. Without a `user_id`
+        every shard is searched.
+        """
+        if user_id is not None:
+            return await self.shard_for(user_id).get_turn(turn_id, user_id)
+        turns = await asyncio.gather(*(shard.get_turn(turn_id) for shard in self.shards))
+        return next((turn for turn in turns if turn is not None), None)
+
+    async def size_stats(self) -> Dict[str, int]:
+        """size_stats() summed over the shards"""
+        totals: Dict[str, int] = {}
+        for stats in await asyncio.gather(*(shard.size_stats() for shard in self.shards)):
+            for name, value in stats.items():
+                totals[name] = totals.get(name, 0) + value
+        totals["shards"] = len(self.shards)
+        return totals
 
 # Example usage and testing
 async def main():
@@ -155,36 +594,146 @@ async def main():
         
         # Method 1: Manual transaction control
         async with store.transaction() as transaction:
-            message1 = await transaction.add_message(user_id, "Hello, world!")
-            message2 = await transaction.add_message(user_id, "How are you today?")
+            message1 = await transaction.add_message(user_id, USER, "Hello, world!")
+            message2 = await transaction.add_message(user_id, USER, "How are you today?")
             print(f"Added 2 messages in single transaction: {message1.message}, {message2.message}")
 
+        # Method 2: A whole turn in one statement
+        async with store.transaction() as transaction:
+            await transaction.add_messages(user_id, [(USER, "What is PTO?"), (AGENT, "Paid time off.")])
+
         for i in await store.get_messages(user_id):
-            print(f"  {i.message} (ID: {i.message_id}, Timestamp: {i.timestamp})")
+            print(f"  {i.to_prompt()} (Seq: {i.seq}, Timestamp: {i.timestamp})")
+
+# Legacy schema, kept only as a baseline for performance_test
+async def _legacy_performance_run(db_path: str, user_ids: List[str], turns: int):
+    async with aiosqlite.connect(db_path) as db:
+        await db.execute("PRAGMA journal_mode=WAL")
+        await db.execute("""
+            CREATE TABLE IF NOT EXISTS chat_messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id TEXT NOT NULL,
+                message TEXT NOT NULL,
+                timestamp TEXT NOT NULL
+            )
+        """)
+        await db.execute("""
+            CREATE INDEX IF NOT EXISTS idx_user_timestamp 
+            ON chat_messages(user_id, timestamp DESC)
+        """)
+        await db.commit()
+
+        async def add_message(user_id: str, message: str):
+            await db.execute("""
+                INSERT INTO chat_messages (user_id, message, timestamp)
+                VALUES (?, ?, ?)
+            """, (user_id, message, datetime.now().isoformat()))
+            await db.execute("""
+                DELETE FROM chat_messages 
+                WHERE user_id = ? AND id NOT IN (
+                    SELECT id FROM chat_messages 
+                    WHERE user_id = ? 
+                    ORDER BY timestamp DESC 
+                    LIMIT 5
+                )
+            """, (user_id, user_id))
 
-# Performance testing with batch transactions
-async def performance_test():
-    """Test performance with batch transactions"""
-    async with AsyncChatStore("perf_test.db") as store:
-        user_id = "perf_user"
-        
-        print("Performance test: Adding 1000 messages in batches of 100...")
         start_time = asyncio.get_event_loop().time()
-        
-        # Process in batches of 100 messages per transaction
-        for batch in range(10):
+        for turn in range(turns):
+            await db.execute("BEGIN TRANSACTION")
+            for user_id in user_ids:
+                await add_message(user_id, f"User: question {turn}")
+                await add_message(user_id, f"Agent: answer {turn}")
+            await db.commit()
+        write_elapsed = asyncio.get_event_loop().time() - start_time
+
+        start_time = asyncio.get_event_loop().time()
+        for user_id in user_ids:
+            cursor = await db.execute("""
+                SELECT id, user_id, message, timestamp
+                FROM chat_messages
+                WHERE user_id = ?
+                ORDER BY timestamp DESC
+            """, (user_id,))
+            [datetime.fromisoformat(row[3]) for row in await cursor.fetchall()]
+        read_elapsed = asyncio.get_event_loop().time() - start_time
+
+    return write_elapsed, read_elapsed
+
+async def _ring_performance_run(db_path: str, user_ids: List[str], turns: int):
+    async with AsyncChatStore(db_path, readers=1) as store:
+        start_time = asyncio.get_event_loop().time()
+        for turn in range(turns):
             async with store.transaction() as transaction:
-                for i in range(100):
-                    msg_num = batch * 100 + i
-                    await transaction.add_message(user_id, f"Batch message {msg_num}")
-        
-        end_time = asyncio.get_event_loop().time()
-        elapsed = end_time - start_time
-        
-        count = await store.get_message_count(user_id)
-        print(f"Added 1000 messages in {elapsed:.2f} seconds (batched)")
-        print(f"Final message count: {count} (should be 5)")
-        print(f"Average time per message: {elapsed/1000*1000:.2f}ms")
+                for user_id in user_ids:
+                    await transaction.add_messages(user_id, [
+                        (USER, f"question {turn}"),
+                        (AGENT, f"answer {turn}"),
+                    ])
+        write_elapsed = asyncio.get_event_loop().time() - start_time
+
+        start_time = asyncio.get_event_loop().time()
+        for user_id in user_ids:
+            await store.get_messages(user_id)
+        read_elapsed = asyncio.get_event_loop().time() - start_time
+
+        assert await store.get_message_count(user_ids[0]) == store.history_size
+
+    return write_elapsed, read_elapsed
+
+# Performance testing: legacy trim-on-insert schema vs ring buffer
+async def performance_test(conversations: int = 10_000, turns: int = 5):
+    """Compare write/read cost of the legacy schema and the ring buffer schema"""
+    user_ids = [f"perf_user_{i}" for i in range(conversations)]
+    messages = conversations * turns * 2
+
+    print(f"Performance test: {conversations} conversations x {turns} turns ({messages} messages)...")
+    for label, run, db_path in [
+        ("legacy", _legacy_performance_run, "perf_test_legacy.db"),
+        ("ring buffer", _ring_performance_run, "perf_test.db"),
+    ]:
+        for suffix in ("", "-wal", "-shm"):
+            Path(db_path + suffix).unlink(missing_ok=True)
+
+        write_elapsed, read_elapsed = await run(db_path, user_ids, turns)
+        size_kb = Path(db_path).stat().st_size / 1024
+        print(f"{label:<12} write {write_elapsed:.2f}s ({write_elapsed / messages * 1000:.3f}ms/message), "
+              f"read {read_elapsed:.2f}s ({read_elapsed / conversations * 1000:.3f}ms/conversation), "
+              f"file {size_kb:.0f}KB")
+
+
+# Per-turn cost: connection per message vs a shared, pooled store
+async def turn_benchmark(turns: int = 500, concurrency: int = 20):
+    """Compare the DB cost of a chat turn with connect-per-turn and a shared store"""
+    db_path = "turn_bench.db"
+
+    async def turn(store: AsyncChatStore, user_id: str):
+        await store.get_messages(user_id)
+        async with store.transaction() as transaction:
+            await transaction.add_messages(user_id, [(USER, "question"), (AGENT, "answer")])
+
+    async def connect_per_turn(user_id: str):
+        async with AsyncChatStore(db_path) as store:
+            await turn(store, user_id)
+
+    async def run(label, make_turn):
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded(i):
+            async with semaphore:
+                await make_turn(f"bench_user_{i % 50}")
+
+        start_time = asyncio.get_event_loop().time()
+        await asyncio.gather(*(bounded(i) for i in range(turns)))
+        elapsed = asyncio.get_event_loop().time() - start_time
+        print(f"{label:<20} {turns} turns in {elapsed:.2f}s "
+              f"({elapsed / turns * 1000:.2f}ms/turn, {turns / elapsed:.0f} turns/s)")
+
+    print(f"Turn benchmark: {turns} turns, concurrency {concurrency}")
+    await run("connect-per-turn", connect_per_turn)
+
+    async with AsyncChatStore(db_path) as shared:
+        await run("shared store", lambda user_id: turn(shared, user_id))
 
 
 # Example of error handling with transactions
@@ -197,7 +746,7 @@ async def transaction_error_example():
         
         # First, add a message successfully
         async with store.transaction() as transaction:
-            await transaction.add_message(user_id, "Initial message")
+            await transaction.add_message(user_id, USER, "Initial message")
         
         initial_count = await store.get_message_count(user_id)
         print(f"Initial message count: {initial_count}")
@@ -205,8 +754,8 @@ async def transaction_error_example():
         # Now try a transaction that will fail
         try:
             async with store.transaction() as transaction:
-                await transaction.add_message(user_id, "Message 1 in failed transaction")
-                await transaction.add_message(user_id, "Message 2 in failed transaction")
+                await transaction.add_message(user_id, USER, "Message 1 in failed transaction")
+                await transaction.add_message(user_id, AGENT, "Message 2 in failed transaction")
 
                 # Simulate an error
                 raise Exception("Simulated error!")
@@ -230,6 +779,7 @@ if __name__ == "__main__":
     
     # print("\n=== Performance Test ===")
     # asyncio.run(performance_test())
+    # asyncio.run(turn_benchmark())
     
     # print("\n=== Transaction Error Handling ===")
     # asyncio.run(transaction_error_example())
\ No newline at end of file
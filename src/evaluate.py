@@ -0,0 +1,246 @@
+"""
+Batch evaluation of the agent pipeline: answers every question of a JSONL
+question set with agent.ainvoke (or the knowledge base chain alone) and
+writes one JSON line per question to a results file, with the answer as
+sent to users (links added), the procedures it links, the time spent in
+each stage and the model calls and tokens it took.
+
+Each input line is {"query": ...} with optional "id", "history" (earlier
+messages, oldest first, as "Role: text" strings or {"role", "message"}
+objects) and "documents" (procedures the answer should link). Results are
+appended as questions finish, so an interrupted run can be continued with
+--resume, which skips the ids already answered without an error.
+
+With --fake the models are replaced by FakeChatModel, so a run needs no
+network or credentials and measures the throughput of our own code. Run
+from src/:
+
+    python -m evaluate questions.jsonl results.jsonl --concurrency 8 --rate 2
+    python -m evaluate benchmarks/fixtures/questions.jsonl /tmp/results.jsonl \\
+        --fake --latency 0 --repeat 20 --corpus benchmarks/fixtures/procedures
+"""
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import sys
+import time
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Dict, List, Optional, Set
+
+AGENT = "agent"
+KNOWLEDGE_BASE = "knowledge_base"
+
+
+@dataclass
+class Question:
+    id: str
+    query: str
+    history: List[str] = field(default_factory=list)
+    documents: List[str] = field(default_factory=list)
+
+
+def _history_line(entry) -> str:
+    if isinstance(entry, dict):
+        return f"{entry['role']}: {entry['message']}"
+    return str(entry)
+
+
+def load_questions(path: Path, repeat: int = 1) -> List[Question]:
+    questions = []
+    with open(path, "r", encoding="utf-8") as f:
+        for number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            item = json.loads(line)
+            questions.append(Question(
+                id=str(item.get("id", number)),
+                query=item["query"],
+                history=[_history_line(entry) for entry in item.get("history", [])],
+                documents=item.get("documents", []),
+            ))
+    if repeat > 1:
+        questions = [
+            Question(f"{q.id}#{i}", q.query, q.history, q.documents)
+            for i in range(1, repeat + 1) for q in questions
+        ]
+    return questions
+
+
+def answered_ids(path: Path) -> Set[str]:
+    """Ids of the questions a results file already has an answer for"""
+    if not path.exists():
+        return set()
+    answered = set()
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                # The last line of a run that was killed mid-write
+                continue
+            if result.get("error") is None:
+                answered.add(result["id"])
+    return answered
+
+
+async def answer(question: Question, mode: str) -> Dict:
+    import agent
+    from utils.metrics import trace_turn
+
+    start = time.perf_counter()
+    text, error = None, None
+    with trace_turn() as trace:
+        try:
+            if mode == KNOWLEDGE_BASE:
+                text = await agent.ainvoke_knowledge_base(question.query)
+            else:
+                text = await agent.ainvoke(question.query, question.history)
+        except Exception as e:
+            error = repr(e)
+    latency = time.perf_counter() - start
+
+    links = agent.corpus.snapshot.link_matcher.linked(text) if text else []
+    return {
+        "id": question.id,
+        "query": question.query,
+        "answer": text,
+        "links": links,
+        "documents": question.documents,
+        "documents_linked": [d for d in question.documents if d in links],
+        "latency": latency,
+        "stages": trace.stages,
+        "llm_calls": trace.llm_calls,
+        "tool_calls": trace.tool_calls,
+        "prompt_tokens": trace.prompt_tokens,
+        "completion_tokens": trace.completion_tokens,
+        "error": error,
+    }
+
+
+async def run(
+    questions: List[Question],
+    results_path: Path,
+    mode: str = AGENT,
+    concurrency: int = 4,
+    rate: Optional[float] = None,
+) -> List[Dict]:
+    """
+    Answer the questions, at most `concurrency` at a time and starting at
+    most `rate` per second, appending each result to `results_path`.
+    """
+    from utils.rate_limit import TokenBucket
+
+    queue: asyncio.Queue = asyncio.Queue()
+    for question in questions:
+        queue.put_nowait(question)
+    bucket = TokenBucket(rate, 1) if rate else None
+    results = []
+
+    with open(results_path, "a", encoding="utf-8") as out:
+        async def worker():
+            while not queue.empty():
+                question = queue.get_nowait()
+                if bucket is not None:
+                    await bucket.acquire()
+                result = await answer(question, mode)
+                out.write(json.dumps(result, ensure_ascii=False) + "\n")
+                out.flush()
+                results.append(result)
+
+        await asyncio.gather(*(worker() for _ in range(max(1, concurrency))))
+    return results
+
+
+def summarize(results: List[Dict], elapsed: float):
+    from benchmarks.load_test import percentile
+
+    answered = [r for r in results if r["error"] is None]
+    n = len(answered) or 1
+    latencies = [r["latency"] for r in answered]
+    stages: Dict[str, float] = {}
+    for r in answered:
+        for stage, seconds in r["stages"].items():
+            stages[stage] = stages.get(stage, 0.0) + seconds
+    llm_calls: Dict[str, int] = {}
+    for r in answered:
+        for caller, calls in r["llm_calls"].items():
+            llm_calls[caller] = llm_calls.get(caller, 0) + calls
+    with_documents = [r for r in answered if r["documents"]]
+
+    print(f"answered       : {len(answered)}/{len(results)} in {elapsed:.2f}s "
+          f"({len(results) / elapsed:.1f} questions/s), {len(results) - len(answered)} errors")
+    if not answered:
+        return
+    print(f"latency        : p50 {percentile(latencies, 50) * 1000:.0f}ms  p95 {percentile(latencies, 95) * 1000:.0f}ms  "
+          f"max {max(latencies) * 1000:.0f}ms  mean {statistics.mean(latencies) * 1000:.0f}ms")
+    print("stages (mean)  : " + "  ".join(f"{s} {t / n * 1000:.1f}ms" for s, t in stages.items()))
+    print("llm calls      : " + "  ".join(f"{c} {calls / n:.2f}" for c, calls in llm_calls.items())
+          + f"  tools {sum(r['tool_calls'] for r in answered) / n:.2f} per question")
+    print(f"tokens         : prompt {sum(r['prompt_tokens'] for r in answered) / n:.0f}  "
+          f"completion {sum(r['completion_tokens'] for r in answered) / n:.0f} per question")
+    if with_documents:
+        linked = sum(len(r["documents_linked"]) for r in with_documents)
+        expected = sum(len(r["documents"]) for r in with_documents)
+        print(f"links          : {linked}/{expected} expected procedures linked")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("questions", type=Path, help="JSONL question set")
+    parser.add_argument("results", type=Path, help="JSONL results file")
+    parser.add_argument("--mode", choices=(AGENT, KNOWLEDGE_BASE), default=AGENT)
+    parser.add_argument("--concurrency", type=int, default=4, help="questions answered at once")
+    parser.add_argument("--rate", type=float, default=None, help="questions started per second, unlimited if omitted")
+    parser.add_argument("--resume", action="store_true", help="skip questions the results file already answers")
+    parser.add_argument("--repeat", type=int, default=1, help="answer the set this many times")
+    parser.add_argument("--corpus", type=Path, help="procedures directory instead of the configured one")
+    parser.add_argument("--cache", action=argparse.BooleanOptionalAction, default=False,
+                        help="reuse answers to repeated questions from the answer cache")
+    parser.add_argument("--fake", action="store_true", help="use FakeChatModel instead of Gemini")
+    parser.add_argument("--latency", type=float, default=0.2, help="FakeChatModel latency per call, seconds")
+    parser.add_argument("--tokens", type=int, default=60, help="FakeChatModel answer length in words")
+    parser.add_argument("--log-level", default="WARNING")
+    args = parser.parse_args(argv)
+
+    if args.fake:
+        os.environ.setdefault("MAIN_GOOGLE_API_KEY", "fake")
+        os.environ.setdefault("TOOL_GOOGLE_API_KEY", "fake")
+        from benchmarks.fakes import install_fake_models
+        install_fake_models(latency=args.latency, tokens=args.tokens)
+
+    from utils.logger import setup_logging
+    setup_logging(None, level=args.log_level)
+
+    import agent
+    import store
+    store.answer_cache.enabled = args.cache
+    if args.corpus:
+        agent.corpus.dir_path = args.corpus
+        agent.corpus.snapshot_path = None
+    agent.corpus.load()
+
+    questions = load_questions(args.questions, args.repeat)
+    done = answered_ids(args.results) if args.resume else set()
+    if not args.resume:
+        args.results.write_text("")
+    elif done and not args.results.read_bytes().endswith(b"\n"):
+        # Start after the partial line rather than on it
+        with open(args.results, "a", encoding="utf-8") as out:
+            out.write("\n")
+    pending = [q for q in questions if q.id not in done]
+    print(f"{len(questions)} questions, {len(questions) - len(pending)} already answered, "
+          f"mode {args.mode}, concurrency {args.concurrency}, rate {args.rate or 'unlimited'}"
+          f"{', fake models' if args.fake else ''}")
+
+    start = time.perf_counter()
+    results = asyncio.run(run(pending, args.results, args.mode, args.concurrency, args.rate))
+    if results:
+        summarize(results, time.perf_counter() - start)
+    sys.exit(1 if any(r["error"] for r in results) else 0)
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,259 @@
+import asyncio
+import json
+import time
+import uuid
+from dataclasses import dataclass, field
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, Optional
+import aiosqlite
+from utils.logger import logger
+
+POSITIVE = "positive"
+NEGATIVE = "negative"
+
+# Rollup rows with this procedure count every answer, whatever it referenced
+ALL_PROCEDURES = "*"
+
+
+@dataclass
+class Feedback:
+    conversation_id: str
+    rating: str
+    source: str
+    question: Optional[str] = None
+    answer: Optional[str] = None
+    comment: Optional[str] = None
+    # Link to the stored question/answer turn in the chat store
+    turn_id: Optional[str] = None
+    # Teams activity the feedback was given on, when the client reports it
+    activity_id: Optional[str] = None
+    procedures: List[str] = field(default_factory=list)
+    id: str = field(default_factory=lambda: uuid.uuid4().hex)
+    created_at: int = field(default_factory=lambda: int(time.time()))
+
+    @property
+    def day(self) -> str:
+        return datetime.fromtimestamp(self.created_at, timezone.utc).strftime("%Y-%m-%d")
+
+    def to_dict(self) -> Dict:
+        return {
+            'id': self.id,
+            'created_at': self.created_at,
+            'conversation_id': self.conversation_id,
+            'turn_id': self.turn_id,
+            'activity_id': self.activity_id,
+            'rating': self.rating,
+            'source': self.source,
+            'question': self.question,
+            'answer': self.answer,
+            'comment': self.comment,
+            'procedures': self.procedures
+        }
+
+
+class FeedbackStore:
+    """
+    Feedback sink backed by its own SQLite database in WAL mode.
+
+    `record()` only appends to an in-memory queue, so handlers never wait on
+    disk. A background task writes the queue in batches, one transaction per
+    batch, every `flush_interval` seconds or as soon as `batch_size` entries
+    are queued.
+
+    Every batch also updates a rollup table of thumbs up/down counts per day
+    and per referenced procedure, so the aggregate queries read a handful of
+    rows instead of scanning the feedback log.
+    """
+
+    def __init__(self, db_path: str = "feedback.sqlite", batch_size: int = 256, flush_interval: float = 1.0):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._db = None
+
+        self._pending: List[Feedback] = []
+        self._wakeup = asyncio.Event()
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+
+        self.recorded = 0
+        self.flushes = 0
+        self.written = 0
+
+    @property
+    def is_open(self) -> bool:
+        return self._db is not None
+
+    async def open(self):
+        """Open the connection, create tables if needed and start the background writer"""
+        if self.is_open:
+            return
+
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._db = await aiosqlite.connect(self.db_path)
+        self._db.row_factory = aiosqlite.Row
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._db.execute("PRAGMA synchronous=NORMAL")
+        await self._db.execute("""
+            CREATE TABLE IF NOT EXISTS feedback (
+                id TEXT PRIMARY KEY,
+                created_at INTEGER NOT NULL,
+                conversation_id TEXT NOT NULL,
+                turn_id TEXT,
+                activity_id TEXT,
+                rating TEXT NOT NULL,
+                source TEXT NOT NULL,
+                question TEXT,
+                answer TEXT,
+                comment TEXT,
+                procedures TEXT NOT NULL
+            ) WITHOUT ROWID
+        """)
+        await self._db.execute("""
+            CREATE INDEX IF NOT EXISTS feedback_turn ON feedback (turn_id)
+        """)
+        await self._db.execute("""
+            CREATE TABLE IF NOT EXISTS feedback_rollup (
+                day TEXT NOT NULL,
+                procedure TEXT NOT NULL,
+                positive INTEGER NOT NULL DEFAULT 0,
+                negative INTEGER NOT NULL DEFAULT 0,
+                PRIMARY KEY (day, procedure)
+            ) WITHOUT ROWID
+        """)
+        await self._db.commit()
+
+        self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def close(self):
+        """Stop the background writer, write out everything still queued and close the connection"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        if self._db:
+            await self.flush()
+            await self._db.close()
+            self._db = None
+
+    def record(self, feedback: Feedback) -> str:
+        """Queue feedback for writing and return its id. Never blocks."""
+        self._pending.append(feedback)
+        self.recorded += 1
+        if len(self._pending) >= self.batch_size:
+            self._wakeup.set()
+        return feedback.id
+
+    async def _flush_loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to write feedback")
+
+    async def flush(self) -> int:
+        """Write all queued feedback in one transaction. Returns the number of entries written."""
+        async with self._flush_lock:
+            if not self._pending:
+                return 0
+
+            batch, self._pending = self._pending, []
+            rollup: Dict[tuple, List[int]] = {}
+            for item in batch:
+                counts = [1, 0] if item.rating == POSITIVE else [0, 1]
+                for procedure in [ALL_PROCEDURES, *item.procedures]:
+                    total = rollup.setdefault((item.day, procedure), [0, 0])
+                    total[0] += counts[0]
+                    total[1] += counts[1]
+
+            try:
+                await self._db.execute("BEGIN IMMEDIATE TRANSACTION")
+                await self._db.executemany(
+                    "INSERT OR IGNORE INTO feedback VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                    [(
+                        item.id, item.created_at, item.conversation_id, item.turn_id, item.activity_id,
+                        item.rating, item.source, item.question, item.answer, item.comment,
+                        json.dumps(item.procedures)
+                    ) for item in batch]
+                )
+                await self._db.executemany("""
+                    INSERT INTO feedback_rollup (day, procedure, positive, negative) VALUES (?, ?, ?, ?)
+                    ON CONFLICT (day, procedure) DO UPDATE SET
+                        positive = positive + excluded.positive,
+                        negative = negative + excluded.negative
+                """, [(day, procedure, up, down) for (day, procedure), (up, down) in rollup.items()])
+                await self._db.commit()
+            except Exception:
+                await self._db.rollback()
+                # Put the batch back in front of anything queued meanwhile
+                self._pending = batch + self._pending
+                raise
+
+            self.flushes += 1
+            self.written += len(batch)
+            return len(batch)
+
+    async def get(self, feedback_id: str) -> Optional[Feedback]:
+        async with self._db.execute("SELECT * FROM feedback WHERE id = ?", (feedback_id,)) as cursor:
+            row = await cursor.fetchone()
+        return self._from_row(row) if row else None
+
+    async def for_turn(self, turn_id: str) -> List[Feedback]:
+        """All feedback given on one stored turn, oldest first"""
+        async with self._db.execute(
+            "SELECT * FROM feedback WHERE turn_id = ? ORDER BY created_at", (turn_id,)
+        ) as cursor:
+            return [self._from_row(row) for row in await cursor.fetchall()]
+
+    async def daily(self, since: Optional[str] = None, until: Optional[str] = None) -> List[Dict]:
+        """Thumbs up/down counts and rate per UTC day (YYYY-MM-DD), oldest first"""
+        async with self._db.execute("""
+            SELECT day, positive, negative FROM feedback_rollup
+            WHERE procedure = ? AND day >= ? AND day <= ?
+            ORDER BY day
+        """, (ALL_PROCEDURES, since or "", until or "9999")) as cursor:
+            return [self._aggregate(row, "day") for row in await cursor.fetchall()]
+
+    async def by_procedure(self, since: Optional[str] = None, until: Optional[str] = None) -> List[Dict]:
+        """Thumbs up/down counts and rate per procedure referenced in the answer, most rated first"""
+        async with self._db.execute("""
+            SELECT procedure, SUM(positive) AS positive, SUM(negative) AS negative FROM feedback_rollup
+            WHERE procedure != ? AND day >= ? AND day <= ?
+            GROUP BY procedure
+            ORDER BY positive + negative DESC
+        """, (ALL_PROCEDURES, since or "", until or "9999")) as cursor:
+            return [self._aggregate(row, "procedure") for row in await cursor.fetchall()]
+
+    @staticmethod
+    def _aggregate(row, key: str) -> Dict:
+        total = row["positive"] + row["negative"]
+        return {
+            key: row[key],
+            POSITIVE: row["positive"],
+            NEGATIVE: row["negative"],
+            "positive_rate": row["positive"] / total if total else 0.0
+        }
+
+    @staticmethod
+    def _from_row(row) -> Feedback:
+        values = dict(row)
+        values["procedures"] = json.loads(values["procedures"])
+        return Feedback(**values)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "recorded": self.recorded,
+            "pending": len(self._pending),
+            "flushes": self.flushes,
+            "written": self.written,
+        }
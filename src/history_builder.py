@@ -0,0 +1,159 @@
+import asyncio
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+from db import ChatMessage, ChatSummary
+from history_cache import HistoryCache
+from utils.logger import logger
+from utils.tokens import count_tokens, truncate_tokens
+
+# (summary so far or None, messages oldest first, max tokens) -> new summary
+Summarize = Callable[[Optional[str], List[str], int], Awaitable[str]]
+
+
+class HistoryBuilder:
+    """
+    Builds the conversation history passed to the agent within a token budget.
+
+    The most recent messages are included verbatim, newest first, for as long
+    as they fit in `token_budget`. Messages that no longer fit are folded into
+    a rolling summary of the conversation, which is included after them. The
+    summary is refreshed in the background after a turn, never while a reply
+    is being prepared, and stored next to the messages in the chat store.
+
+    The summary covers messages up to its `through_seq`; those are never
+    repeated verbatim. The history window of the store has to be larger
+    than what the budget holds, otherwise messages roll out of the window
+    before they have been summarized.
+    """
+
+    def __init__(
+        self,
+        history: HistoryCache,
+        summarize: Summarize,
+        token_budget: int = 1500,
+        summary_tokens: int = 300,
+        refresh: bool = True,
+    ):
+        self.history = history
+        self.summarize = summarize
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.refresh_enabled = refresh
+
+        self._tasks: Dict[str, asyncio.Task] = {}
+        # Conversations that got another turn while their summary was being refreshed
+        self._again: Set[str] = set()
+
+        self.builds = 0
+        self.truncated = 0
+        self.refreshes = 0
+        self.refresh_failures = 0
+
+    async def build(self, user_id: str) -> List[str]:
+        """Prompt lines for a conversation's history, newest first, within the token budget"""
+        messages = await self.history.get_messages(user_id)
+        summary = await self.history.get_summary(user_id)
+        lines, _ = self.fit(messages, summary)
+        self.builds += 1
+        return lines
+
+    def fit(
+        self, messages: List[ChatMessage], summary: Optional[ChatSummary]
+    ) -> Tuple[List[str], List[ChatMessage]]:
+        """
+        Split messages (newest first) into the prompt lines that fit the budget
+        and the messages left out that the summary does not cover yet.
+        """
+        summary = self._current(messages, summary)
+        covered = summary.through_seq if summary is not None else 0
+        summary_line = f"Summary of earlier conversation: {summary.summary}" if summary is not None else None
+
+        budget = self.token_budget - (count_tokens(summary_line) if summary_line else 0)
+        lines, used = [], 0
+        for message in messages:
+            if message.seq <= covered:
+                break
+            text = message.to_prompt()
+            tokens = count_tokens(text)
+            if used + tokens > budget:
+                if not lines:
+                    # Always keep the latest message, cut to what fits
+                    lines.append(truncate_tokens(text, max(budget, 0)))
+                    self.truncated += 1
+                break
+            lines.append(text)
+            used += tokens
+
+        left_out = [m for m in messages[len(lines):] if m.seq > covered]
+        if summary_line:
+            lines.append(summary_line)
+        return lines, left_out
+
+    @staticmethod
+    def _current(messages: List[ChatMessage], summary: Optional[ChatSummary]) -> Optional[ChatSummary]:
+        """
+        The summary, unless no stored message backs it: a summary from before
+        the conversation was reset would cover seqs that are being reused.
+        """
+        if summary is not None and (not messages or summary.through_seq >= messages[0].seq):
+            return None
+        return summary
+
+    def schedule_refresh(self, user_id: str):
+        """Fold messages that fell out of the budget into the summary, in the background"""
+        if not self.refresh_enabled:
+            return
+        if user_id in self._tasks:
+            self._again.add(user_id)
+            return
+        self._tasks[user_id] = asyncio.create_task(self._refresh_loop(user_id))
+
+    async def _refresh_loop(self, user_id: str):
+        try:
+            while True:
+                try:
+                    await self.refresh(user_id)
+                except Exception:
+                    self.refresh_failures += 1
+                    logger.exception(f"Failed to refresh the history summary for {user_id}")
+                if user_id not in self._again:
+                    break
+                self._again.discard(user_id)
+        finally:
+            del self._tasks[user_id]
+
+    async def refresh(self, user_id: str) -> bool:
+        """Update the summary if messages fell out of the budget. Returns whether it changed."""
+        generation = self.history.generation(user_id)
+        messages = await self.history.get_messages(user_id)
+        summary = self._current(messages, await self.history.get_summary(user_id))
+
+        _, left_out = self.fit(messages, summary)
+        if not left_out:
+            return False
+
+        folded = list(reversed(left_out))
+        text = await self.summarize(
+            summary.summary if summary is not None else None,
+            [m.to_prompt() for m in folded],
+            self.summary_tokens
+        )
+        # Not stored if the conversation was reset while the summary was being written
+        if await self.history.set_summary(user_id, text, folded[-1].seq, generation) is None:
+            return False
+        self.refreshes += 1
+        return True
+
+    async def stop(self, _app=None):
+        """Wait for summary refreshes that are still running"""
+        self._again.clear()
+        if self._tasks:
+            await asyncio.gather(*self._tasks.values(), return_exceptions=True)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "builds": self.builds,
+            "truncated": self.truncated,
+            "refreshes": self.refreshes,
+            "refresh_failures": self.refresh_failures,
+            "refreshing": len(self._tasks),
+        }
@@ -0,0 +1,312 @@
+import asyncio
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple, Union
+from db import AGENT, USER, AsyncChatStore, ChatMessage, ChatSummary, ChatTurn, ShardedChatStore
+from utils.logger import logger
+
+
+class HistoryCache:
+    """
+    Bounded in-process LRU cache of conversation histories in front of
+    AsyncChatStore or ShardedChatStore.
+
+    Histories are keyed by the cleaned conversation id. Reads are served from
+    memory once a conversation is warm, and new messages are written behind:
+    they are queued and a background task flushes the queued messages of all
+    conversations to SQLite in a single transaction per shard, the shards'
+    transactions running concurrently.
+
+    Sequence numbers are assigned here with the same rule the store uses
+    (last seq + 1), so the cached view and the stored ring buffer agree.
+    Turns added with `add_turn` are written behind the same way, in the
+    same transaction as their messages. Rolling summaries are cached next to
+    the histories but written through, since they change rarely.
+    Messages queued less than `flush_interval` seconds ago are lost if the
+    process dies without calling `stop()`.
+
+    The cache is only correct when one process serves each conversation:
+    app.workers > 1 hands requests to whichever worker accepts them, so a
+    worker could answer from a history that is missing another worker's
+    turn or that was reset there. Several workers therefore need
+    `max_entries=0`, so that nothing is kept between turns and every read
+    goes to the store, and `write_through=True`, so that a turn is written
+    before add_turn returns and the next message, on any worker, reads it.
+    Concurrent turns are still written together in one flush.
+    """
+
+    def __init__(
+        self,
+        store: Union[AsyncChatStore, ShardedChatStore],
+        max_entries: int = 10_000,
+        max_bytes: int = 64 * 1024 * 1024,
+        flush_interval: float = 0.5,
+        write_through: bool = False,
+    ):
+        self.store = store
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self.write_through = write_through
+
+        self._entries: "OrderedDict[str, List[ChatMessage]]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+        self._bytes = 0
+        self._summaries: "OrderedDict[str, Optional[ChatSummary]]" = OrderedDict()
+
+        # Messages waiting for the next flush, and the batch currently being written
+        self._pending: Dict[str, List[ChatMessage]] = {}
+        self._inflight: Dict[str, List[ChatMessage]] = {}
+        self._pending_turns: Dict[str, ChatTurn] = {}
+        self._inflight_turns: Dict[str, ChatTurn] = {}
+        self._flush_lock = asyncio.Lock()
+        self._flush_task: Optional[asyncio.Task] = None
+        # Bumped when a conversation is reset, so work started before the reset cannot write into it
+        self._generations: Dict[str, int] = {}
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.flushes = 0
+        self.flushed_messages = 0
+
+    async def start(self):
+        if self._flush_task is None:
+            self._flush_task = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        """Stop the background flusher and write out everything still queued"""
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Failed to flush chat history")
+
+    async def flush(self) -> int:
+        """Write all queued messages, one transaction per shard. Returns the number of messages written."""
+        async with self._flush_lock:
+            if not self._pending and not self._pending_turns:
+                return 0
+
+            self._inflight, self._pending = self._pending, {}
+            self._inflight_turns, self._pending_turns = self._pending_turns, {}
+            batches: Dict[AsyncChatStore, Tuple[Dict[str, List[ChatMessage]], List[ChatTurn]]] = {}
+            for user_id, messages in self._inflight.items():
+                batches.setdefault(self.store.shard_for(user_id), ({}, []))[0][user_id] = messages
+            for turn in self._inflight_turns.values():
+                batches.setdefault(self.store.shard_for(turn.user_id), ({}, []))[1].append(turn)
+            try:
+                results = await asyncio.gather(
+                    *(self._write(shard, messages, turns) for shard, (messages, turns) in batches.items()),
+                    return_exceptions=True
+                )
+            finally:
+                self._inflight, self._inflight_turns = {}, {}
+
+            written = 0
+            errors = []
+            for (messages, turns), result in zip(batches.values(), results):
+                if isinstance(result, BaseException):
+                    # Put the shard's batch back in front of anything queued meanwhile
+                    for user_id, queued in messages.items():
+                        self._pending[user_id] = queued + self._pending.get(user_id, [])
+                    self._pending_turns = {**{t.turn_id: t for t in turns}, **self._pending_turns}
+                    errors.append(result)
+                else:
+                    written += sum(len(queued) for queued in messages.values())
+
+            self.flushes += 1
+            self.flushed_messages += written
+            if errors:
+                raise errors[0]
+            return written
+
+    async def _write(self, shard: AsyncChatStore, messages: Dict[str, List[ChatMessage]], turns: List[ChatTurn]):
+        async with shard.transaction() as transaction:
+            for user_id, queued in messages.items():
+                await transaction.add_messages(user_id, [(m.role, m.message) for m in queued])
+            if turns:
+                await transaction.add_turns(turns)
+
+    async def get_messages(self, user_id: str) -> List[ChatMessage]:
+        """Get the history window for a user, newest message first"""
+        entry = self._entries.get(user_id)
+        if entry is not None:
+            self.hits += 1
+            self._entries.move_to_end(user_id)
+            return list(entry)
+
+        self.misses += 1
+        messages = await self.store.get_messages(user_id)
+
+        # The entry may have been evicted while it still had unwritten messages
+        last_seq = messages[0].seq if messages else 0
+        unflushed = [
+            m for m in self._inflight.get(user_id, []) + self._pending.get(user_id, [])
+            if m.seq > last_seq
+        ]
+        messages = (list(reversed(unflushed)) + messages)[:self.store.history_size]
+
+        # Another task may have populated the entry while we were reading
+        if user_id not in self._entries:
+            self._put(user_id, messages)
+        return list(self._entries.get(user_id, messages))
+
+    async def add_messages(self, user_id: str, messages: List[Tuple[str, str]]) -> List[ChatMessage]:
+        """Add a batch of (role, message) pairs to the cache and queue them for writing"""
+        added = await self._queue_messages(user_id, messages)
+        if self.write_through:
+            await self.flush()
+        return added
+
+    async def _queue_messages(self, user_id: str, messages: List[Tuple[str, str]]) -> List[ChatMessage]:
+        history = await self.get_messages(user_id)
+        last_seq = history[0].seq if history else 0
+        timestamp = int(time.time())
+
+        added = [
+            ChatMessage(seq=last_seq + i, user_id=user_id, role=role, message=message, timestamp=timestamp)
+            for i, (role, message) in enumerate(messages, start=1)
+        ]
+
+        self._pending.setdefault(user_id, []).extend(added)
+        self._put(user_id, (list(reversed(added)) + history)[:self.store.history_size])
+        return added
+
+    async def add_turn(self, user_id: str, turn_id: str, question: str, answer: str) -> ChatTurn:
+        """Add a question and its answer to the history and queue them as a turn stored under `turn_id`"""
+        _, reply = await self._queue_messages(user_id, [(USER, question), (AGENT, answer)])
+        turn = ChatTurn(
+            turn_id=turn_id, user_id=user_id, question=question, answer=answer,
+            timestamp=reply.timestamp, seq=reply.seq
+        )
+        self._pending_turns[turn_id] = turn
+        if self.write_through:
+            await self.flush()
+        return turn
+
+    async def get_turn(self, turn_id: str, user_id: Optional[str] = None) -> Optional[ChatTurn]:
+        """Look up a turn by id, including turns not written yet, only among the user's turns when `user_id` is given"""
+        turn = self._pending_turns.get(turn_id) or self._inflight_turns.get(turn_id)
+        if turn is not None:
+            return turn if user_id is None or turn.user_id == user_id else None
+        return await self.store.get_turn(turn_id, user_id)
+
+    async def get_summary(self, user_id: str) -> Optional[ChatSummary]:
+        """Get the rolling summary for a user, from memory when possible"""
+        if user_id in self._summaries:
+            self._summaries.move_to_end(user_id)
+            return self._summaries[user_id]
+
+        summary = await self.store.get_summary(user_id)
+        self._put_summary(user_id, summary)
+        return summary
+
+    def generation(self, user_id: str) -> int:
+        """How many times the conversation has been reset; pass it to set_summary"""
+        return self._generations.get(user_id, 0)
+
+    async def set_summary(
+        self, user_id: str, summary: str, through_seq: int, generation: Optional[int] = None
+    ) -> Optional[ChatSummary]:
+        """
+        Store a new rolling summary for a user. With a `generation`, nothing
+        is stored and None is returned if the conversation has been reset
+        since that generation was read.
+        """
+        # Under the flush lock, so a reset cannot slip in between the check and the write
+        async with self._flush_lock:
+            if generation is not None and generation != self.generation(user_id):
+                return None
+            async with self.store.shard_for(user_id).transaction() as transaction:
+                stored = await transaction.set_summary(user_id, summary, through_seq)
+        self._put_summary(user_id, stored)
+        return stored
+
+    def _put_summary(self, user_id: str, summary: Optional[ChatSummary]):
+        if self.max_entries <= 0:
+            return
+        self._summaries[user_id] = summary
+        self._summaries.move_to_end(user_id)
+        while len(self._summaries) > self.max_entries:
+            self._summaries.popitem(last=False)
+
+    async def delete_all_messages(self, user_id: str) -> int:
+        """
+        Drop the cached and queued history and summary for a user and delete
+        them from the store. Summaries computed from the old history are not
+        stored afterwards.
+        """
+        async with self._flush_lock:
+            self._generations[user_id] = self.generation(user_id) + 1
+            self._pending.pop(user_id, None)
+            self._summaries.pop(user_id, None)
+            self._drop(user_id)
+            async with self.store.shard_for(user_id).transaction() as transaction:
+                return await transaction.delete_all_messages(user_id)
+
+    async def evict_idle(self, user_ids: List[str], before: int) -> List[str]:
+        """
+        Delete the conversations among `user_ids` that have had no message
+        since `before` from the store and the cache, in one transaction per shard.
+        Conversations with queued messages are skipped. Returns the deleted ones.
+        """
+        async with self._flush_lock:
+            by_shard: Dict[AsyncChatStore, List[str]] = {}
+            for user_id in user_ids:
+                if user_id not in self._pending:
+                    by_shard.setdefault(self.store.shard_for(user_id), []).append(user_id)
+            evicted = []
+            for shard, candidates in by_shard.items():
+                async with shard.transaction() as transaction:
+                    evicted += await transaction.delete_idle_conversations(candidates, before)
+            for user_id in evicted:
+                self._summaries.pop(user_id, None)
+                self._drop(user_id)
+            return evicted
+
+    def _put(self, user_id: str, messages: List[ChatMessage]):
+        self._drop(user_id)
+        if self.max_entries <= 0:
+            return
+        size = sum(len(m.message) + len(m.role) for m in messages)
+        self._entries[user_id] = messages
+        self._sizes[user_id] = size
+        self._bytes += size
+
+        while len(self._entries) > 1 and (
+            len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+        ):
+            evicted, _ = self._entries.popitem(last=False)
+            self._bytes -= self._sizes.pop(evicted)
+            self.evictions += 1
+
+    def _drop(self, user_id: str):
+        if self._entries.pop(user_id, None) is not None:
+            self._bytes -= self._sizes.pop(user_id)
+
+    def stats(self) -> Dict[str, float]:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self._bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "pending": sum(len(messages) for messages in self._pending.values()),
+            "pending_turns": len(self._pending_turns),
+            "flushes": self.flushes,
+            "flushed_messages": self.flushed_messages,
+        }
@@ -0,0 +1,32 @@
+"""
+Ingestion step for deploys: scans the procedures directory with the bot's
+corpus settings and writes the corpus snapshot file, so that the bot's
+first scan after a restart only reads procedures that changed. Running it
+again only re-reads changed files. Run from src/:
+
+    python -m ingest
+"""
+import argparse
+import sys
+import time
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.parse_args(argv)
+
+    from agent import corpus
+    if corpus.snapshot_path is None:
+        sys.exit("knowledge_base.snapshot is not set, there is no snapshot file to build")
+
+    start = time.perf_counter()
+    snapshot = corpus.load()
+    size = corpus.snapshot_path.stat().st_size if corpus.snapshot_path.exists() else 0
+    print(
+        f"{len(snapshot.documents)} documents, {len(snapshot.index.chunks)} chunks, digest {snapshot.digest}, "
+        f"in {time.perf_counter() - start:.2f}s; {corpus.snapshot_path} is {size} bytes"
+    )
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,500 @@
+import asyncio
+import math
+import time
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Set, Tuple
+from uuid import UUID
+from langchain_core.callbacks import AsyncCallbackHandler
+from langchain_core.callbacks import AsyncCallbackManagerForLLMRun, CallbackManagerForLLMRun
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessageChunk, BaseMessage
+from langchain_core.outputs import ChatGenerationChunk, ChatResult, LLMResult
+from pydantic import ConfigDict, PrivateAttr
+from admission import ConcurrencyLimiter
+from utils import metrics
+from utils.logger import logger
+
+# Tag carried by every run inside the knowledge base tool's chain
+KNOWLEDGE_BASE_TAG = "knowledge_base"
+
+
+class LimitedChatModel(BaseChatModel):
+    """
+    Wraps a chat model so that every async call, streamed or not, holds a
+    slot of a shared ConcurrencyLimiter. The limiter is an asyncio semaphore,
+    which sync calls from other threads cannot take, so sync calls raise
+    NotImplementedError rather than run past the limit. Tool binding is
+    delegated to the wrapped model and the resulting call arguments are
+    passed through unchanged.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    inner: BaseChatModel
+    limiter: ConcurrencyLimiter
+
+    @property
+    def _llm_type(self) -> str:
+        return self.inner._llm_type
+
+    def bind_tools(self, tools, **kwargs):
+        bound = self.inner.bind_tools(tools, **kwargs)
+        return self.bind(**bound.kwargs)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        raise NotImplementedError("LimitedChatModel only takes async calls; use ainvoke or astream")
+
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        raise NotImplementedError("LimitedChatModel only takes async calls; use ainvoke or astream")
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        async with self.limiter:
+            return await self.inner._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        async with self.limiter:
+            async for chunk in astream_chunks(self.inner, messages, stop=stop, run_manager=run_manager, **kwargs):
+                yield chunk
+
+
+async def astream_chunks(
+    model: BaseChatModel,
+    messages: List[BaseMessage],
+    stop: Optional[List[str]] = None,
+    run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+    **kwargs: Any,
+) -> AsyncIterator[ChatGenerationChunk]:
+    """Stream `model`'s answer, or emit it as one chunk if the model cannot stream"""
+    if type(model)._astream is BaseChatModel._astream:
+        result = await model._agenerate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        message = result.generations[0].message
+        yield ChatGenerationChunk(message=AIMessageChunk(
+            content=message.content,
+            tool_calls=getattr(message, "tool_calls", []),
+            usage_metadata=getattr(message, "usage_metadata", None),
+        ))
+        return
+
+    async for chunk in model._astream(messages, stop=stop, run_manager=run_manager, **kwargs):
+        yield chunk
+
+
+class BackendUnavailable(RuntimeError):
+    """Raised when every backend of a ResilientChatModel is skipped by its circuit breaker"""
+
+
+class CircuitBreaker:
+    """
+    Takes a failing backend out of rotation. After `failures` consecutive
+    failures the breaker opens and the backend is skipped for `reset_timeout`
+    seconds. Then one trial call is let through: success closes the breaker,
+    failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(self, failures: int = 5, reset_timeout: float = 30.0):
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.opens = 0
+        self._trial_running = False
+
+    def allow(self) -> bool:
+        """Whether a call may go to the backend now. Claims the trial call when half open."""
+        if self.state == self.OPEN and time.monotonic() - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.HALF_OPEN and not self._trial_running:
+            self._trial_running = True
+            return True
+        return False
+
+    def success(self):
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self._trial_running = False
+
+    def failure(self):
+        self.consecutive_failures += 1
+        self._trial_running = False
+        if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failures:
+            if self.state != self.OPEN:
+                self.opens += 1
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def abandon(self):
+        """The call was cancelled before it finished, which says nothing about the backend"""
+        self._trial_running = False
+
+
+class LatencyTracker:
+    """Durations of the last `window` successful calls, in seconds"""
+
+    def __init__(self, window: int = 200, min_samples: int = 20):
+        self.min_samples = min_samples
+        self._samples = deque(maxlen=window)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+
+    def percentile(self, p: float) -> Optional[float]:
+        """The p-th percentile, or None until `min_samples` calls were seen"""
+        if len(self._samples) < self.min_samples:
+            return None
+        ordered = sorted(self._samples)
+        return ordered[min(len(ordered) - 1, int(p / 100 * len(ordered)))]
+
+
+class ResilientChatModel(BaseChatModel):
+    """
+    Spreads calls over interchangeable backends, e.g. the same model behind
+    two API keys, so that one stuck or failing backend does not hold up a turn.
+
+    - A call goes to the first backend whose circuit breaker lets it through.
+      If it fails, the next backend is tried right away.
+    - If it is still running after the `hedge_percentile` of recent call
+      durations (never sooner than `hedge_min_delay`, and after
+      `hedge_initial_delay` until enough calls were seen), the same call is
+      started on the next backend too. The first to succeed wins and the
+      other one is cancelled.
+    - The whole call, hedges and failovers included, fails with
+      asyncio.TimeoutError after `deadline` seconds. Backends still running
+      then count as failed.
+
+    Streaming races the backends for the first chunk and then sticks with the
+    winner, within the same deadline. Sync calls go to the first available
+    backend without hedging, and fail on LimitedChatModel backends. Tool binding is delegated to the first backend;
+    all backends must accept the same call arguments.
+    """
+
+    model_config = ConfigDict(arbitrary_types_allowed=True)
+
+    backends: List[BaseChatModel]
+    backend_names: Optional[List[str]] = None
+    # Shared between models that use the same backends, e.g. the same API key
+    breakers: Optional[List[CircuitBreaker]] = None
+    label: str = "llm"
+    deadline: float = 60.0
+    hedge_percentile: Optional[float] = 95.0
+    hedge_min_delay: float = 1.0
+    hedge_initial_delay: float = 10.0
+
+    _latency: Dict[str, LatencyTracker] = PrivateAttr(default_factory=dict)
+    _counts: Dict[str, int] = PrivateAttr(
+        default_factory=lambda: {"calls": 0, "hedges": 0, "hedge_wins": 0, "failovers": 0, "timeouts": 0, "unavailable": 0}
+    )
+
+    def model_post_init(self, __context: Any):
+        if self.backend_names is None:
+            self.backend_names = [str(i) for i in range(len(self.backends))]
+        if self.breakers is None:
+            self.breakers = [CircuitBreaker() for _ in self.backends]
+
+    @property
+    def _llm_type(self) -> str:
+        return self.backends[0]._llm_type
+
+    def bind_tools(self, tools, **kwargs):
+        bound = self.backends[0].bind_tools(tools, **kwargs)
+        return self.bind(**bound.kwargs)
+
+    def _next_backend(self, tried: Set[int]) -> Optional[int]:
+        for index in range(len(self.backends)):
+            if index not in tried and self.breakers[index].allow():
+                return index
+        return None
+
+    def _hedge_delay(self, mode: str) -> float:
+        if self.hedge_percentile is None:
+            return math.inf
+        tracked = self._latency.setdefault(mode, LatencyTracker()).percentile(self.hedge_percentile)
+        return max(self.hedge_min_delay, tracked if tracked is not None else self.hedge_initial_delay)
+
+    def _record(self, index: int, outcome: str):
+        metrics.llm_attempts_total.inc(model=self.label, backend=self.backend_names[index], outcome=outcome)
+
+    def _generate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        index = self._next_backend(set())
+        if index is None:
+            self._counts["unavailable"] += 1
+            raise BackendUnavailable(f"All {self.label} model backends are unavailable")
+        try:
+            result = self.backends[index]._generate(messages, stop=stop, run_manager=run_manager, **kwargs)
+        except Exception:
+            self.breakers[index].failure()
+            self._record(index, "error")
+            raise
+        self.breakers[index].success()
+        self._record(index, "ok")
+        return result
+
+    async def _attempt(self, index: int, mode: str, call: Callable[[BaseChatModel], Awaitable[Any]]):
+        start = time.monotonic()
+        try:
+            result = await call(self.backends[index])
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.breakers[index].failure()
+            self._record(index, "error")
+            logger.warning(f"{self.label} model call on backend {self.backend_names[index]} failed: {e!r}")
+            raise
+        elapsed = time.monotonic() - start
+        self.breakers[index].success()
+        self._latency.setdefault(mode, LatencyTracker()).observe(elapsed)
+        self._record(index, "ok")
+        metrics.llm_attempt_seconds.observe(elapsed, model=self.label, backend=self.backend_names[index])
+        return result
+
+    async def _race(
+        self,
+        mode: str,
+        call: Callable[[BaseChatModel], Awaitable[Any]],
+        deadline: float,
+        discard: Optional[Callable[[Any], Awaitable[Any]]] = None,
+    ) -> Tuple[int, Any]:
+        """
+        Run `call` on the backends as described above. Returns the winning
+        backend and its result. Calls that also succeed but lose, by finishing
+        in the same moment, count as successes and their results are passed
+        to `discard`, e.g. to close a stream.
+        """
+        loop = asyncio.get_running_loop()
+        tasks: Dict[asyncio.Task, int] = {}
+        tried: Set[int] = set()
+        hedged: Set[int] = set()
+        errors: List[Exception] = []
+        timed_out = False
+
+        def launch() -> Optional[int]:
+            index = self._next_backend(tried)
+            if index is not None:
+                tried.add(index)
+                tasks[asyncio.ensure_future(self._attempt(index, mode, call))] = index
+            return index
+
+        self._counts["calls"] += 1
+        if launch() is None:
+            self._counts["unavailable"] += 1
+            raise BackendUnavailable(f"All {self.label} model backends are unavailable")
+        hedge_at = loop.time() + self._hedge_delay(mode)
+
+        try:
+            while tasks:
+                now = loop.time()
+                if now >= deadline:
+                    timed_out = True
+                    self._counts["timeouts"] += 1
+                    raise asyncio.TimeoutError(f"{self.label} model call took longer than {self.deadline}s")
+
+                done, _ = await asyncio.wait(
+                    tasks, timeout=min(deadline, hedge_at) - now, return_when=asyncio.FIRST_COMPLETED
+                )
+                winner: Optional[Tuple[int, Any]] = None
+                losers = []
+                for task in done:
+                    index = tasks.pop(task)
+                    if task.exception() is not None:
+                        errors.append(task.exception())
+                    elif winner is None:
+                        winner = index, task.result()
+                    else:
+                        losers.append(task.result())
+                if winner is not None:
+                    if discard is not None:
+                        await asyncio.gather(*(discard(result) for result in losers), return_exceptions=True)
+                    if winner[0] in hedged:
+                        self._counts["hedge_wins"] += 1
+                    return winner
+
+                if not tasks:
+                    if launch() is not None:
+                        self._counts["failovers"] += 1
+                        metrics.llm_hedges_total.inc(model=self.label, reason="error")
+                        hedge_at = loop.time() + self._hedge_delay(mode)
+                elif loop.time() >= hedge_at:
+                    index = launch()
+                    if index is not None:
+                        hedged.add(index)
+                        self._counts["hedges"] += 1
+                        metrics.llm_hedges_total.inc(model=self.label, reason="slow")
+                        hedge_at = loop.time() + self._hedge_delay(mode)
+                    else:
+                        hedge_at = math.inf
+            raise errors[-1]
+        finally:
+            for task, index in tasks.items():
+                task.cancel()
+                if timed_out:
+                    self.breakers[index].failure()
+                    self._record(index, "timeout")
+                else:
+                    self.breakers[index].abandon()
+                    self._record(index, "cancelled")
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        # Backends get no run manager, so racing calls do not report tokens twice
+        async def generate(backend: BaseChatModel) -> ChatResult:
+            return await backend._agenerate(messages, stop=stop, **kwargs)
+
+        deadline = asyncio.get_running_loop().time() + self.deadline
+        _, result = await self._race("generate", generate, deadline)
+        return result
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[AsyncCallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.deadline
+
+        async def first_chunk(backend: BaseChatModel):
+            stream = astream_chunks(backend, messages, stop=stop, **kwargs)
+            try:
+                return stream, await stream.__anext__()
+            except BaseException:
+                await stream.aclose()
+                raise
+
+        async def close(result):
+            await result[0].aclose()
+
+        index, (stream, chunk) = await self._race("stream", first_chunk, deadline, discard=close)
+        try:
+            yield chunk
+            while True:
+                try:
+                    chunk = await asyncio.wait_for(stream.__anext__(), max(0.0, deadline - loop.time()))
+                except StopAsyncIteration:
+                    return
+                except asyncio.TimeoutError:
+                    self._counts["timeouts"] += 1
+                    self.breakers[index].failure()
+                    self._record(index, "timeout")
+                    raise
+                yield chunk
+        finally:
+            await stream.aclose()
+
+    def stats(self) -> Dict[str, float]:
+        stats: Dict[str, float] = dict(self._counts)
+        for name, breaker in zip(self.backend_names, self.breakers):
+            stats[f"{name}_breaker_open"] = float(breaker.state != CircuitBreaker.CLOSED)
+            stats[f"{name}_breaker_opens"] = breaker.opens
+        for mode in ("generate", "stream"):
+            stats[f"{mode}_hedge_delay_seconds"] = min(self._hedge_delay(mode), self.deadline)
+        return stats
+
+
+class TokenUsage(AsyncCallbackHandler):
+    """Adds up the prompt and completion tokens of the model calls it sees"""
+
+    def __init__(self):
+        self.tokens = 0
+
+    async def on_llm_end(self, response: LLMResult, **kwargs):
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                self.tokens += usage.get("input_tokens", 0) + usage.get("output_tokens", 0)
+
+
+class TurnMetrics(AsyncCallbackHandler):
+    """
+    Callback handler for one turn: counts model round-trips per caller (the
+    ReAct agent or the knowledge base tool), tool invocations, and prompt and
+    completion tokens, then records them with `record()`, also on the
+    current TurnTrace if there is one.
+    """
+
+    def __init__(self):
+        self.llm_calls: Dict[str, int] = {"agent": 0, KNOWLEDGE_BASE_TAG: 0}
+        self.tool_calls = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self._callers: Dict[UUID, str] = {}
+
+    async def on_chat_model_start(self, serialized, messages, *, run_id: UUID, tags: Optional[List[str]] = None, **kwargs):
+        caller = KNOWLEDGE_BASE_TAG if tags and KNOWLEDGE_BASE_TAG in tags else "agent"
+        self._callers[run_id] = caller
+        self.llm_calls[caller] += 1
+
+    async def on_llm_end(self, response: LLMResult, *, run_id: UUID, **kwargs):
+        caller = self._callers.pop(run_id, "agent")
+        for generations in response.generations:
+            for generation in generations:
+                usage = getattr(getattr(generation, "message", None), "usage_metadata", None) or {}
+                prompt, completion = usage.get("input_tokens", 0), usage.get("output_tokens", 0)
+                self.prompt_tokens += prompt
+                self.completion_tokens += completion
+                metrics.tokens_total.inc(prompt, caller=caller, kind="prompt")
+                metrics.tokens_total.inc(completion, caller=caller, kind="completion")
+
+    async def on_llm_error(self, error: BaseException, *, run_id: UUID, **kwargs):
+        self._callers.pop(run_id, None)
+
+    async def on_tool_start(self, serialized, input_str, **kwargs):
+        self.tool_calls += 1
+
+    def record(self):
+        for caller, calls in self.llm_calls.items():
+            metrics.llm_calls_per_turn.observe(calls, caller=caller)
+        metrics.tool_calls_per_turn.observe(self.tool_calls)
+        metrics.tokens_per_turn.observe(self.prompt_tokens, kind="prompt")
+        metrics.tokens_per_turn.observe(self.completion_tokens, kind="completion")
+
+        trace = metrics.current_trace()
+        if trace is not None:
+            for caller, calls in self.llm_calls.items():
+                trace.llm_calls[caller] = trace.llm_calls.get(caller, 0) + calls
+            trace.tool_calls += self.tool_calls
+            trace.prompt_tokens += self.prompt_tokens
+            trace.completion_tokens += self.completion_tokens
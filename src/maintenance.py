@@ -0,0 +1,153 @@
+import asyncio
+import time
+from typing import Dict, Optional
+from history_cache import HistoryCache
+from utils.logger import logger
+
+
+class HistoryMaintenance:
+    """
+    Background retention and compaction of the chat history database.
+
+    Every `interval` seconds it deletes the history and summary of
+    conversations with no message for `conversation_ttl` seconds, and
+    turns older than that, then returns freed pages to the file system
+    (incremental vacuum), runs PRAGMA optimize and checkpoints the WAL.
+
+    Deletes run in transactions of at most `batch_size` conversations or
+    turns, and the vacuum frees `batch_size` pages at a time, with
+    `batch_pause` seconds between steps, so the history flusher never
+    waits long for the writer connection. Idle conversations are found by
+    paging through the table on a reader connection. A sharded store is
+    maintained one shard at a time.
+    """
+
+    def __init__(
+        self,
+        history: HistoryCache,
+        conversation_ttl: float = 30 * 24 * 3600,
+        interval: float = 3600.0,
+        batch_size: int = 200,
+        batch_pause: float = 0.05,
+        vacuum_pages: int = 2000,
+        enabled: bool = True,
+    ):
+        self.history = history
+        self.store = history.store
+        self.conversation_ttl = conversation_ttl
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.vacuum_pages = vacuum_pages
+        self.enabled = enabled
+        self._task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+        self.failures = 0
+        self.evicted_conversations = 0
+        self.deleted_turns = 0
+        self.freed_pages = 0
+        self.last_run_seconds = 0.0
+        self.sizes: Dict[str, int] = {}
+
+    async def start(self, _app=None):
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self, _app=None):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                await self.run()
+            except Exception:
+                self.failures += 1
+                logger.exception("Chat history maintenance failed")
+
+    async def evict_idle_conversations(self, before: int) -> int:
+        evicted = 0
+        for shard in self.store.shards:
+            after = ""
+            while after is not None:
+                idle, after = await shard.idle_conversations(before, after, limit=self.batch_size * 5)
+                for i in range(0, len(idle), self.batch_size):
+                    evicted += len(await self.history.evict_idle(idle[i:i + self.batch_size], before))
+                    await asyncio.sleep(self.batch_pause)
+        return evicted
+
+    async def delete_old_turns(self, before: int) -> int:
+        deleted = 0
+        for shard in self.store.shards:
+            while True:
+                async with shard.transaction() as transaction:
+                    batch = await transaction.delete_turns_before(before, limit=self.batch_size)
+                deleted += batch
+                if batch < self.batch_size:
+                    break
+                await asyncio.sleep(self.batch_pause)
+        return deleted
+
+    async def vacuum(self) -> int:
+        freed = 0
+        for shard in self.store.shards:
+            shard_freed = 0
+            while shard_freed < self.vacuum_pages:
+                batch = await shard.incremental_vacuum(min(self.batch_size, self.vacuum_pages - shard_freed))
+                shard_freed += batch
+                if not batch:
+                    break
+                await asyncio.sleep(self.batch_pause)
+            freed += shard_freed
+        return freed
+
+    async def run(self) -> Dict[str, int]:
+        """One maintenance pass; returns what it did and the sizes after it"""
+        start = time.monotonic()
+        before = int(time.time() - self.conversation_ttl)
+
+        evicted = await self.evict_idle_conversations(before)
+        deleted = await self.delete_old_turns(before)
+        freed = await self.vacuum()
+        checkpointed = True
+        for shard in self.store.shards:
+            await shard.optimize()
+            checkpointed = await shard.checkpoint() and checkpointed
+        self.sizes = await self.store.size_stats()
+
+        self.runs += 1
+        self.evicted_conversations += evicted
+        self.deleted_turns += deleted
+        self.freed_pages += freed
+        self.last_run_seconds = time.monotonic() - start
+        logger.info(
+            f"Chat history maintenance: evicted {evicted} idle conversations and {deleted} turns, "
+            f"freed {freed} pages{'' if checkpointed else ', WAL checkpoint incomplete'} "
+            f"in {self.last_run_seconds:.2f}s; {self.sizes['conversations']} conversations, "
+            f"{self.sizes['db_bytes']} bytes, WAL {self.sizes['wal_bytes']} bytes"
+        )
+        return {
+            "evicted_conversations": evicted,
+            "deleted_turns": deleted,
+            "freed_pages": freed,
+            "checkpointed": int(checkpointed),
+            **self.sizes,
+        }
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "runs": self.runs,
+            "failures": self.failures,
+            "evicted_conversations": self.evicted_conversations,
+            "deleted_turns": self.deleted_turns,
+            "freed_pages": self.freed_pages,
+            "last_run_seconds": self.last_run_seconds,
+            **self.sizes,
+        }
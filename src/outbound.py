@@ -0,0 +1,332 @@
+import copy
+import random
+import re
+import time
+from collections import OrderedDict
+from email.utils import parsedate_to_datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from botbuilder.core import TurnContext
+from botbuilder.schema import Activity, ActivityTypes, ResourceResponse
+from teams import TeamsAdapter
+from admission import WaitStats
+from utils.config import config
+from utils.logger import logger
+from utils.metrics import outbound_activities_total, outbound_throttled_total, registry
+from utils.rate_limit import TokenBucket
+
+# Separators to split long text at, best first; a split never falls inside a link
+_SEPARATORS = ("\n\n", "\n", ". ", " ")
+_LINK_RE = re.compile(r"\[[^\]\n]*\]\([^)\n]*\)")
+_FENCE = "```"
+
+
+def _fence_after(text: str, fence: Optional[str]) -> Optional[str]:
+    """The code fence still open after `text`, given the one open before it"""
+    for line in text.split("\n"):
+        if line.lstrip().startswith(_FENCE):
+            fence = None if fence else line.strip()
+    return fence
+
+
+def _cut(window: str) -> int:
+    """Where to end a part that may use all of `window`"""
+    links = [m.span() for m in _LINK_RE.finditer(window)]
+    for separator in _SEPARATORS:
+        end = window.rfind(separator)
+        while end > len(window) // 2:
+            cut = end + len(separator)
+            if not any(start < cut < stop for start, stop in links):
+                return cut
+            end = window.rfind(separator, 0, end)
+    return len(window)
+
+
+def split_markdown(text: str, max_chars: int) -> List[str]:
+    """
+    Split markdown into parts of at most `max_chars`, at a paragraph break
+    if there is one in the second half of the part, else a line break,
+    sentence or space. A code block that spans two parts is closed at the
+    end of the first and reopened at the start of the next.
+    """
+    if len(text) <= max_chars:
+        return [text]
+
+    parts = []
+    fence = None
+    while text:
+        prefix = fence + "\n" if fence else ""
+        if len(prefix) + len(text) <= max_chars:
+            parts.append(prefix + text)
+            break
+
+        # Leave room to close a code block the part ends in
+        cut = _cut(text[:max_chars - len(prefix) - len(_FENCE) - 1])
+        part, text = text[:cut], text[cut:]
+        fence = _fence_after(part, fence)
+        part = prefix + part.rstrip()
+        if fence:
+            part += "\n" + _FENCE
+        parts.append(part)
+        # Whitespace inside a code block is content
+        text = text.lstrip("\n") if fence else text.lstrip()
+    return [part for part in parts if part.strip()]
+
+
+def retry_after(error: BaseException) -> Optional[float]:
+    """
+    Seconds to wait before retrying a connector call that failed with 429
+    Too Many Requests, 0 if the response said nothing, None for any other error.
+    """
+    response = getattr(error, "response", None)
+    status = getattr(response, "status_code", None) or getattr(response, "status", None)
+    if status != 429:
+        return None
+
+    value = (getattr(response, "headers", None) or {}).get("Retry-After")
+    if not value:
+        return 0.0
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return 0.0
+
+
+class RateLimiter:
+    """
+    A token bucket per conversation and one for the whole bot. Buckets of
+    the least recently used conversations are dropped beyond `max_conversations`.
+    """
+
+    def __init__(
+        self,
+        conversation_rate: float,
+        conversation_burst: int,
+        global_rate: float,
+        global_burst: int,
+        max_conversations: int = 10000,
+    ):
+        self.conversation_rate = conversation_rate
+        self.conversation_burst = conversation_burst
+        self.max_conversations = max_conversations
+        self.global_bucket = TokenBucket(global_rate, global_burst)
+        self._conversations: "OrderedDict[str, TokenBucket]" = OrderedDict()
+        self.wait = WaitStats()
+
+    def bucket(self, conversation_id: str) -> TokenBucket:
+        bucket = self._conversations.get(conversation_id)
+        if bucket is None:
+            bucket = self._conversations[conversation_id] = TokenBucket(
+                self.conversation_rate, self.conversation_burst
+            )
+            while len(self._conversations) > self.max_conversations:
+                self._conversations.popitem(last=False)
+        self._conversations.move_to_end(conversation_id)
+        return bucket
+
+    async def acquire(self, conversation_id: str):
+        # The conversation's bucket first, so a busy conversation does not hold up the global one
+        waited = await self.bucket(conversation_id).acquire()
+        waited += await self.global_bucket.acquire()
+        self.wait.record(waited)
+
+    def pause(self, conversation_id: str, seconds: float):
+        self.bucket(conversation_id).pause(seconds)
+
+
+SendActivities = Callable[[TurnContext, List[Activity]], Awaitable[List[ResourceResponse]]]
+UpdateActivity = Callable[[TurnContext, Activity], Awaitable[Optional[ResourceResponse]]]
+
+
+class Outbound:
+    """
+    Everything the bot sends goes through here: message text longer than
+    `max_message_chars` is split into several messages, every connector
+    call waits for the rate limiter, and a call the connector throttles
+    with 429 is retried after its Retry-After (or an exponential backoff
+    from `backoff` seconds), at most `max_retries` times.
+
+    Activities are posted one at a time, so a retry never posts again an
+    activity that already went out.
+
+    The continuation parts of a split message are remembered by the id of
+    its first part (for the last `max_tracked` messages), so updating that
+    message, as a streamed answer does every `streaming.interval`, edits the
+    parts already posted and only posts parts that did not exist yet.
+    """
+
+    def __init__(
+        self,
+        limiter: RateLimiter,
+        max_message_chars: int = 8000,
+        max_retries: int = 4,
+        max_retry_after: float = 30.0,
+        backoff: float = 1.0,
+        max_tracked: int = 1000,
+    ):
+        self.limiter = limiter
+        self.max_message_chars = max_message_chars
+        self.max_retries = max_retries
+        self.max_retry_after = max_retry_after
+        self.backoff = backoff
+        self.max_tracked = max_tracked
+        # First part's activity id -> (activity id, text) of each continuation part posted
+        self._continuations: "OrderedDict[str, List[Tuple[Optional[str], str]]]" = OrderedDict()
+
+        self.sent = 0
+        self.updated = 0
+        self.split = 0
+        self.throttled = 0
+        self.given_up = 0
+        self.retry_wait = WaitStats()
+
+    def _split(self, activity: Activity) -> List[Activity]:
+        if activity.type != ActivityTypes.message or not activity.text or len(activity.text) <= self.max_message_chars:
+            return [activity]
+
+        self.split += 1
+        parts = []
+        for i, text in enumerate(split_markdown(activity.text, self.max_message_chars)):
+            part = copy.copy(activity)
+            part.text = text
+            # Attachments and suggested actions go with the last part
+            if i:
+                parts[-1].attachments = parts[-1].suggested_actions = None
+            parts.append(part)
+        return parts
+
+    async def _call(self, conversation_id: str, kind: str, call: Callable[[], Awaitable]):
+        for attempt in range(self.max_retries + 1):
+            await self.limiter.acquire(conversation_id)
+            try:
+                result = await call()
+            except Exception as e:
+                delay = retry_after(e)
+                if delay is None:
+                    raise
+                self.throttled += 1
+                outbound_throttled_total.inc(kind=kind)
+                if attempt == self.max_retries:
+                    self.given_up += 1
+                    raise
+                if not delay:
+                    delay = self.backoff * 2 ** attempt * random.uniform(0.5, 1.0)
+                delay = min(delay, self.max_retry_after)
+                logger.warning(f"Connector throttled a {kind} in {conversation_id}, retrying in {delay:.2f}s")
+                # Other activities of the conversation wait as well
+                self.limiter.pause(conversation_id, delay)
+                self.retry_wait.record(delay)
+                continue
+            outbound_activities_total.inc(kind=kind)
+            return result
+
+    @staticmethod
+    def _conversation_id(context: TurnContext, activity: Activity) -> str:
+        conversation = activity.conversation or context.activity.conversation
+        return conversation.id if conversation else ""
+
+    def _track(self, activity_id: Optional[str], continuations: List[Tuple[Optional[str], str]]):
+        if not activity_id:
+            return
+        self._continuations[activity_id] = continuations
+        self._continuations.move_to_end(activity_id)
+        while len(self._continuations) > self.max_tracked:
+            self._continuations.popitem(last=False)
+
+    async def send_activities(
+        self, context: TurnContext, activities: List[Activity], send: SendActivities
+    ) -> List[ResourceResponse]:
+        responses = []
+        for activity in activities:
+            conversation_id = self._conversation_id(context, activity)
+            posted = []
+            for part in self._split(activity):
+                sent = await self._call(conversation_id, "send", lambda: send(context, [part]))
+                responses.extend(sent)
+                posted.append((sent[0].id if sent else None, part.text))
+                self.sent += 1
+            if len(posted) > 1:
+                self._track(posted[0][0], posted[1:])
+        return responses
+
+    async def update_activity(
+        self, context: TurnContext, activity: Activity, update: UpdateActivity, send: SendActivities
+    ) -> Optional[ResourceResponse]:
+        """
+        Update a message. Text beyond `max_message_chars` goes to the
+        continuation parts posted by earlier sends or updates of the same
+        message, which are edited if their text changed, and to new messages
+        for parts beyond those.
+        """
+        first, *rest = self._split(activity)
+        conversation_id = self._conversation_id(context, activity)
+        response = await self._call(conversation_id, "update", lambda: update(context, first))
+        self.updated += 1
+        if not rest:
+            return response
+
+        continuations = list(self._continuations.get(activity.id, []))
+        for i, part in enumerate(rest):
+            if i < len(continuations):
+                part_id, text = continuations[i]
+                if part_id is None or text == part.text:
+                    continue
+                part.id = part_id
+                await self._call(conversation_id, "update", lambda: update(context, part))
+                self.updated += 1
+                continuations[i] = (part_id, part.text)
+            else:
+                part.id = None
+                sent = await self._call(conversation_id, "send", lambda: send(context, [part]))
+                self.sent += 1
+                continuations.append((sent[0].id if sent else None, part.text))
+        self._track(activity.id, continuations)
+        return response
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "sent": self.sent,
+            "updated": self.updated,
+            "split": self.split,
+            "throttled": self.throttled,
+            "given_up": self.given_up,
+            "conversations": len(self.limiter._conversations),
+            "rate_wait_seconds_total": self.limiter.wait.total,
+            "rate_wait_seconds_max": self.limiter.wait.max,
+            "retry_wait_seconds_total": self.retry_wait.total,
+            "retry_wait_seconds_max": self.retry_wait.max,
+        }
+
+
+class OutboundTeamsAdapter(TeamsAdapter):
+    """TeamsAdapter that sends and updates activities through an Outbound"""
+
+    def __init__(self, configuration, outbound: "Outbound", **kwargs):
+        super().__init__(configuration, **kwargs)
+        self.outbound = outbound
+
+    async def send_activities(self, context: TurnContext, activities: List[Activity]) -> List[ResourceResponse]:
+        return await self.outbound.send_activities(context, activities, super().send_activities)
+
+    async def update_activity(self, context: TurnContext, activity: Activity):
+        return await self.outbound.update_activity(
+            context, activity, super().update_activity, super().send_activities
+        )
+
+
+outbound = Outbound(
+    RateLimiter(
+        conversation_rate=config.outbound.conversation_rate,
+        conversation_burst=config.outbound.conversation_burst,
+        global_rate=config.outbound.global_rate,
+        global_burst=config.outbound.global_burst,
+    ),
+    max_message_chars=config.outbound.max_message_chars,
+    max_retries=config.outbound.max_retries,
+    max_retry_after=config.outbound.max_retry_after,
+)
+
+registry.register_collector("outbound", outbound.stats)
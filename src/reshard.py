@@ -0,0 +1,117 @@
+"""
+Re-shard the chat database: copies every conversation's history, summary
+and turns from the files of one shard count into the files of another,
+placing each conversation by the hash ShardedChatStore uses. Set db.shards
+to the new count afterwards.
+
+Stop the bot first. The source files are left as they are, so setting
+db.shards back undoes the change; delete them once the new layout is in
+use. Run from src/:
+
+    python -m reshard --to 4                  # from the configured db.shards
+    python -m reshard --from 4 --to 8 --db db/chat_db.sqlite
+"""
+import argparse
+import sqlite3
+import sys
+import time
+from contextlib import closing
+from pathlib import Path
+from typing import Dict
+
+from db import SCHEMA, shard_index, shard_paths
+
+TABLES = ("chat_history", "chat_summaries", "chat_turns")
+
+
+def create(path: str):
+    with closing(sqlite3.connect(path)) as db:
+        db.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        db.execute("PRAGMA journal_mode=WAL")
+        for statement in SCHEMA:
+            db.execute(statement)
+        db.commit()
+
+
+def count_rows(paths) -> Dict[str, int]:
+    counts = dict.fromkeys(TABLES, 0)
+    for path in paths:
+        with closing(sqlite3.connect(path)) as db:
+            for table in TABLES:
+                counts[table] += db.execute(f"SELECT COUNT(*) FROM {table}").fetchone()[0]
+    return counts
+
+
+def reshard(db_path: str, source_shards: int, target_shards: int) -> Dict[str, int]:
+    """Copy the conversations of `source_shards` files into `target_shards` new ones. Returns the row counts."""
+    sources = shard_paths(db_path, source_shards)
+    targets = shard_paths(db_path, target_shards)
+    missing = [path for path in sources if not Path(path).exists()]
+    if missing:
+        raise ValueError(f"Missing source shards: {', '.join(missing)}")
+    existing = [path for path in targets if Path(path).exists()]
+    if existing:
+        raise ValueError(f"Target shards already exist, remove them first: {', '.join(existing)}")
+
+    try:
+        copy(sources, targets)
+        copied = count_rows(targets)
+        expected = count_rows(sources)
+        if copied != expected:
+            raise RuntimeError(f"Copied {copied} rows, expected {expected}")
+    except BaseException:
+        # Leave nothing half-copied behind, so the next run can start over
+        for target in targets:
+            for suffix in ("", "-wal", "-shm"):
+                Path(target + suffix).unlink(missing_ok=True)
+        raise
+    return copied
+
+
+def copy(sources, targets):
+    for target in targets:
+        create(target)
+    for i, target in enumerate(targets):
+        with closing(sqlite3.connect(target)) as db:
+            db.create_function("shard_index", 2, shard_index, deterministic=True)
+            for source in sources:
+                db.execute("ATTACH DATABASE ? AS source", (source,))
+                with db:
+                    for table in TABLES:
+                        columns = ", ".join(row[1] for row in db.execute(f"PRAGMA main.table_info({table})"))
+                        db.execute(f"""
+                            INSERT INTO main.{table} ({columns})
+                            SELECT {columns} FROM source.{table}
+                            WHERE shard_index(user_id, ?) = ?
+                        """, (len(targets), i))
+                db.execute("DETACH DATABASE source")
+            db.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+
+
+def main(argv=None):
+    from store import CONNECTION_STRING
+    from utils.config import config
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--db", default=CONNECTION_STRING, help="database path, as configured with db.file")
+    parser.add_argument("--from", dest="source", type=int, default=config.db.shards, help="current shard count")
+    parser.add_argument("--to", dest="target", type=int, required=True, help="new shard count")
+    args = parser.parse_args(argv)
+
+    if args.source == args.target:
+        sys.exit(f"The database already has {args.target} shards")
+    start = time.perf_counter()
+    try:
+        counts = reshard(args.db, args.source, args.target)
+    except (ValueError, RuntimeError) as e:
+        sys.exit(str(e))
+    print(
+        f"Copied {counts['chat_history']} messages, {counts['chat_summaries']} summaries and "
+        f"{counts['chat_turns']} turns from {args.source} to {args.target} shards "
+        f"in {time.perf_counter() - start:.2f}s: {', '.join(shard_paths(args.db, args.target))}"
+    )
+    print(f"Set db.shards to {args.target} and restart the bot")
+
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
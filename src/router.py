@@ -0,0 +1,142 @@
+import importlib
+import re
+from dataclasses import dataclass
+from typing import Callable, Dict, Optional
+from utils.corpus import CorpusManager, CorpusSnapshot
+from utils.metrics import route_decisions_total, route_saved_seconds_total, route_seconds
+from utils.retrieval import tokenize
+
+SMALL_TALK = "small_talk"
+KNOWLEDGE_BASE = "knowledge_base"
+AGENT = "agent"
+
+# Words that make up small talk, by intent; a message is small talk when every word is in one intent or filler
+_INTENTS = {
+    "greeting": {"hi", "hello", "hey", "hiya", "morning", "afternoon", "evening", "good", "there", "yo"},
+    "thanks": {"thanks", "thank", "thx", "ty", "cheers", "appreciate", "appreciated", "helpful", "great", "perfect"},
+    "goodbye": {"bye", "goodbye", "later", "see", "cya", "night", "goodnight"},
+    "acknowledgement": {"ok", "okay", "k", "cool", "nice", "got", "it", "understood", "sure", "alright", "fine"},
+}
+_FILLER = {"you", "so", "much", "very", "a", "lot", "all", "for", "the", "that", "bot", "agent", "again", "and", "that's", "thats"}
+
+TEMPLATES = {
+    "greeting": "Hi! Ask me anything about our internal procedures, for example how to request time off or report a security incident.",
+    "thanks": "You're welcome! Let me know if there's anything else I can help with.",
+    "goodbye": "Goodbye! Come back any time you have a question about our procedures.",
+    "acknowledgement": "Great. Let me know if you have any other questions.",
+}
+
+# Words that refer back to earlier messages; the knowledge base tool does not see the history
+_FOLLOW_UP = {
+    "it", "its", "that", "this", "those", "these", "they", "them", "their", "he", "she", "him", "her",
+    "above", "previous", "earlier", "again", "also", "else", "same", "one", "ones", "more", "instead",
+}
+_WORD_RE = re.compile(r"[\w']+")
+
+# (question, corpus snapshot) -> confidence in [0, 1] that the knowledge base alone can answer it
+Scorer = Callable[[str, CorpusSnapshot], float]
+
+
+def knowledge_base_score(question: str, snapshot: CorpusSnapshot) -> float:
+    """
+    Share of the question's content words the corpus knows, scaled down
+    when even the best matching chunk scores low under BM25.
+    """
+    terms = tokenize(question)
+    if len(terms) < 2:
+        return 0.0
+    bm25 = snapshot.index.bm25
+    coverage = sum(term in bm25.idf for term in terms) / len(terms)
+    best = max(bm25.scores(terms).values(), default=0.0)
+    return coverage * min(1.0, best / 4.0)
+
+
+def load_scorer(name: Optional[str]) -> Scorer:
+    """Resolve the configured scorer: None for knowledge_base_score, or "package.module:function" """
+    if not name:
+        return knowledge_base_score
+
+    module_name, _, function_name = name.partition(":")
+    module = importlib.import_module(module_name)
+    return getattr(module, function_name)
+
+
+@dataclass(frozen=True)
+class Route:
+    name: str
+    intent: Optional[str] = None
+    score: float = 0.0
+
+    @property
+    def reply(self) -> Optional[str]:
+        """Template answer for small talk"""
+        return TEMPLATES.get(self.intent) if self.name == SMALL_TALK else None
+
+
+class Router:
+    """
+    Cheap local classifier that decides how a message is answered:
+
+    - small talk ("hi", "thanks!") gets a template reply without any model call,
+    - a standalone question the corpus clearly covers goes straight to the
+      knowledge base chain, one model call,
+    - everything else, including follow-ups that need the history, goes
+      to the full ReAct agent.
+
+    Decisions and answer times are counted per route. Time saved is
+    estimated against a moving average of the agent route's answer time.
+    """
+
+    def __init__(
+        self,
+        corpus: CorpusManager,
+        scorer: Scorer = knowledge_base_score,
+        threshold: float = 0.5,
+        max_small_talk_words: int = 6,
+        enabled: bool = True,
+    ):
+        self.corpus = corpus
+        self.scorer = scorer
+        self.threshold = threshold
+        self.max_small_talk_words = max_small_talk_words
+        self.enabled = enabled
+        self.agent_seconds: Optional[float] = None
+
+    def route(self, question: str) -> Route:
+        if not self.enabled:
+            return Route(AGENT)
+
+        words = _WORD_RE.findall(question.lower())
+        intent = self._small_talk_intent(words)
+        if intent is not None:
+            return Route(SMALL_TALK, intent=intent)
+
+        if _FOLLOW_UP.isdisjoint(words):
+            score = self.scorer(question, self.corpus.snapshot)
+            if score >= self.threshold:
+                return Route(KNOWLEDGE_BASE, score=score)
+            return Route(AGENT, score=score)
+        return Route(AGENT)
+
+    def _small_talk_intent(self, words) -> Optional[str]:
+        if not words or len(words) > self.max_small_talk_words:
+            return None
+        content = [w for w in words if w not in _FILLER]
+        if not content:
+            return None
+        for intent, lexicon in _INTENTS.items():
+            if all(w in lexicon for w in content):
+                return intent
+        return None
+
+    def observe(self, route: Route, seconds: float):
+        """Record how long a routed message took to answer"""
+        route_decisions_total.inc(route=route.name)
+        route_seconds.observe(seconds, route=route.name)
+        if route.name == AGENT:
+            self.agent_seconds = seconds if self.agent_seconds is None else 0.9 * self.agent_seconds + 0.1 * seconds
+        elif self.agent_seconds is not None:
+            route_saved_seconds_total.inc(max(0.0, self.agent_seconds - seconds), route=route.name)
+
+    def stats(self) -> Dict[str, float]:
+        return {"agent_seconds_average": self.agent_seconds or 0.0}
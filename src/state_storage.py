@@ -0,0 +1,264 @@
+import asyncio
+import importlib
+import json
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+import aiosqlite
+from botbuilder.core import Storage, StoreItem
+
+# (key, JSON value, expected etag or None for an unconditional write)
+Change = Tuple[str, str, Optional[str]]
+
+
+class ETagConflict(KeyError):
+    """Raised when a write carries an etag that no longer matches the stored item"""
+
+
+class StateBackend(ABC):
+    """
+    Where BatchingStorage keeps turn state. Values are JSON strings and every
+    stored item has an etag that changes on each write.
+
+    Implement this, e.g. over Redis or a SQL server, to share turn state
+    between nodes; SqliteStateBackend covers any number of processes on one node.
+    """
+
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    @abstractmethod
+    async def read(self, keys: List[str]) -> Dict[str, Tuple[str, str]]:
+        """Return (value, etag) for each of `keys` that exists"""
+
+    @abstractmethod
+    async def write(self, changes: List[Change]) -> List[Any]:
+        """
+        Apply the changes in order, atomically where the backend allows.
+        Returns, per change, the new etag or an ETagConflict for writes whose
+        expected etag did not match.
+        """
+
+    @abstractmethod
+    async def delete(self, keys: List[str]):
+        """Delete the items, ignoring keys that do not exist"""
+
+
+class SqliteStateBackend(StateBackend):
+    """
+    State backend on a SQLite file in WAL mode. Safe to share between worker
+    processes on one machine: each batch of writes is one BEGIN IMMEDIATE
+    transaction and etags are compared inside it.
+    """
+
+    def __init__(self, db_path: str = "bot_state.sqlite", timeout: float = 5.0):
+        self.db_path = db_path
+        self.timeout = timeout
+        self._db = None
+        self._write_lock = asyncio.Lock()
+
+    async def open(self):
+        if self._db is not None:
+            return
+
+        Path(self.db_path).parent.mkdir(parents=True, exist_ok=True)
+
+        self._db = await aiosqlite.connect(self.db_path, timeout=self.timeout)
+        await self._db.execute("PRAGMA journal_mode=WAL")
+        await self._db.execute("PRAGMA synchronous=NORMAL")
+        await self._db.execute("""
+            CREATE TABLE IF NOT EXISTS bot_state (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                etag INTEGER NOT NULL
+            ) WITHOUT ROWID
+        """)
+        await self._db.commit()
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+    async def read(self, keys: List[str]) -> Dict[str, Tuple[str, str]]:
+        placeholders = ", ".join("?" * len(keys))
+        async with self._db.execute(
+            f"SELECT key, value, etag FROM bot_state WHERE key IN ({placeholders})", keys
+        ) as cursor:
+            return {key: (value, str(etag)) for key, value, etag in await cursor.fetchall()}
+
+    async def write(self, changes: List[Change]) -> List[Any]:
+        results = []
+        async with self._write_lock:
+            await self._db.execute("BEGIN IMMEDIATE TRANSACTION")
+            try:
+                for key, value, etag in changes:
+                    if etag is None or etag == "*":
+                        cursor = await self._db.execute("""
+                            INSERT INTO bot_state (key, value, etag) VALUES (?, ?, 1)
+                            ON CONFLICT (key) DO UPDATE SET value = excluded.value, etag = etag + 1
+                            RETURNING etag
+                        """, (key, value))
+                    else:
+                        cursor = await self._db.execute("""
+                            UPDATE bot_state SET value = ?, etag = etag + 1
+                            WHERE key = ? AND etag = ?
+                            RETURNING etag
+                        """, (value, key, int(etag)))
+                    row = await cursor.fetchone()
+                    await cursor.close()
+                    results.append(
+                        str(row[0]) if row else ETagConflict(f"Etag conflict on {key}: expected {etag}")
+                    )
+                await self._db.commit()
+            except Exception:
+                await self._db.rollback()
+                raise
+        return results
+
+    async def delete(self, keys: List[str]):
+        async with self._write_lock:
+            await self._db.executemany("DELETE FROM bot_state WHERE key = ?", [(key,) for key in keys])
+            await self._db.commit()
+
+
+class _Batcher:
+    """
+    Collects items submitted within `window` seconds of each other and hands
+    them to `run` as one list; every submitter gets its own item's result.
+    """
+
+    def __init__(self, run: Callable[[list], Awaitable[list]], window: float):
+        self.run = run
+        self.window = window
+        self._items: list = []
+        self._futures: List[asyncio.Future] = []
+        self._task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.items = 0
+
+    def submit(self, item) -> asyncio.Future:
+        future = asyncio.get_running_loop().create_future()
+        self._items.append(item)
+        self._futures.append(future)
+        if self._task is None:
+            self._task = asyncio.create_task(self._flush())
+        return future
+
+    async def _flush(self):
+        await asyncio.sleep(self.window)
+        items, futures = self._items, self._futures
+        self._items, self._futures, self._task = [], [], None
+        self.batches += 1
+        self.items += len(items)
+        try:
+            results = await self.run(items)
+        except Exception as e:
+            results = [e] * len(items)
+        for future, result in zip(futures, results):
+            if future.done():
+                continue
+            if isinstance(result, Exception):
+                future.set_exception(result)
+            else:
+                future.set_result(result)
+
+
+class BatchingStorage(Storage):
+    """
+    botbuilder Storage over a StateBackend with optimistic concurrency.
+
+    Reads and writes from concurrent turns that arrive within `window`
+    seconds are coalesced into one backend call. Items read from storage
+    carry an `e_tag`; writing them back fails with ETagConflict if another
+    turn, in this process or another one, wrote the item in between. Items
+    without an `e_tag`, or with "*", are written unconditionally.
+    """
+
+    def __init__(self, backend: StateBackend, window: float = 0.002):
+        self.backend = backend
+        self._reads = _Batcher(self._read_batch, window)
+        self._writes = _Batcher(self.backend.write, window)
+        self.conflicts = 0
+
+    async def open(self):
+        await self.backend.open()
+
+    async def close(self):
+        await self.backend.close()
+
+    async def read(self, keys: List[str]) -> Dict[str, Any]:
+        if not keys:
+            return {}
+        values = await asyncio.gather(*(self._reads.submit(key) for key in keys))
+        return {key: value for key, value in zip(keys, values) if value is not None}
+
+    async def _read_batch(self, keys: List[str]) -> list:
+        stored = await self.backend.read(sorted(set(keys)))
+        results = []
+        for key in keys:
+            if key not in stored:
+                results.append(None)
+                continue
+            value, etag = stored[key]
+            item = json.loads(value)
+            item["e_tag"] = etag
+            results.append(item)
+        return results
+
+    async def write(self, changes: Dict[str, Any]):
+        if changes is None:
+            raise Exception("Changes are required when writing")
+        if not changes:
+            return
+
+        submitted = []
+        for key, change in changes.items():
+            item = dict(vars(change)) if isinstance(change, StoreItem) else dict(change)
+            etag = item.pop("e_tag", None)
+            submitted.append(self._writes.submit((key, json.dumps(item, default=_encode), etag)))
+
+        results = await asyncio.gather(*submitted, return_exceptions=True)
+        for change, result in zip(changes.values(), results):
+            if isinstance(result, ETagConflict):
+                self.conflicts += 1
+            if isinstance(result, Exception):
+                raise result
+            # Let callers that keep the item write it again without a reload
+            if isinstance(change, dict):
+                change["e_tag"] = result
+            elif isinstance(change, StoreItem):
+                change.e_tag = result
+
+    async def delete(self, keys: List[str]):
+        if keys:
+            await self.backend.delete(keys)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "read_batches": self._reads.batches,
+            "reads": self._reads.items,
+            "write_batches": self._writes.batches,
+            "writes": self._writes.items,
+            "conflicts": self.conflicts,
+        }
+
+
+def _encode(value):
+    return vars(value) if hasattr(value, "__dict__") else str(value)
+
+
+def load_state_backend(name: str, db_path: str) -> StateBackend:
+    """
+    Resolve the configured state backend: "sqlite" for a SQLite file at
+    `db_path`, or "package.module:ClassName" for any StateBackend class.
+    """
+    if name == "sqlite":
+        return SqliteStateBackend(db_path)
+
+    module_name, _, class_name = name.partition(":")
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)()
@@ -1,4 +1,81 @@
-from db import AsyncChatStore
+from pathlib import Path
+from answer_cache import AnswerCache
+from db import ShardedChatStore
+from feedback import FeedbackStore
+from history_cache import HistoryCache
+from maintenance import HistoryMaintenance
+from state_storage import BatchingStorage, load_state_backend
 from utils.config import config
+from utils.metrics import registry
 
-shared_store = AsyncChatStore(f"db/{config.db.file}.sqlite")
\ No newline at end of file
+DB_DIR = Path(config.app.dir) / "db"
+CONNECTION_STRING = str(DB_DIR / f"{config.db.file}.sqlite")
+
+# Split over config.db.shards files by conversation; change the count with reshard.py
+shared_store = ShardedChatStore(
+    CONNECTION_STRING,
+    shards=config.db.shards,
+    readers=config.db.readers,
+    history_size=config.db.history_size
+)
+
+history = HistoryCache(
+    shared_store,
+    # Any worker may get a conversation's next message and workers cannot see each
+    # other's caches, so with several workers every turn is read from and written
+    # to the store before it is answered
+    max_entries=config.history_cache.max_entries if config.app.workers == 1 else 0,
+    max_bytes=config.history_cache.max_bytes,
+    flush_interval=config.history_cache.flush_interval,
+    write_through=config.app.workers > 1
+)
+registry.register_collector("history_cache", history.stats)
+
+# Started with the app: deletes idle conversations and compacts the chat database
+maintenance = HistoryMaintenance(
+    history,
+    conversation_ttl=config.maintenance.conversation_ttl,
+    interval=config.maintenance.interval,
+    batch_size=config.maintenance.batch_size,
+    batch_pause=config.maintenance.batch_pause,
+    vacuum_pages=config.maintenance.vacuum_pages,
+    enabled=config.maintenance.enabled
+)
+registry.register_collector("history_maintenance", maintenance.stats)
+
+feedback = FeedbackStore(
+    str(DB_DIR / f"{config.feedback.file}.sqlite"),
+    batch_size=config.feedback.batch_size,
+    flush_interval=config.feedback.flush_interval
+)
+registry.register_collector("feedback", feedback.stats)
+
+# Teams turn state, shared by all worker processes
+state_storage = BatchingStorage(
+    load_state_backend(config.state.backend, str(DB_DIR / f"{config.state.file}.sqlite")),
+    window=config.state.batch_window
+)
+registry.register_collector("state_storage", state_storage.stats)
+
+# Knowledge base answers per corpus version; persisted, it is shared by all worker processes
+answer_cache = AnswerCache(
+    max_entries=config.answer_cache.max_entries,
+    ttl=config.answer_cache.ttl,
+    db_path=str(DB_DIR / f"{config.answer_cache.file}.sqlite") if config.answer_cache.persist else None,
+    enabled=config.answer_cache.enabled
+)
+registry.register_collector("answer_cache", answer_cache.stats)
+
+async def open_store(_app=None):
+    await shared_store.open()
+    await history.start()
+    await feedback.open()
+    await state_storage.open()
+    await answer_cache.open()
+
+async def close_store(_app=None):
+    await answer_cache.close()
+    await state_storage.close()
+    await feedback.close()
+    await history.stop()
+    await shared_store.close()
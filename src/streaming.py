@@ -0,0 +1,90 @@
+import time
+from typing import AsyncIterator, Callable, Optional
+from botbuilder.core import TurnContext
+from botbuilder.schema import Activity, ActivityTypes
+from utils.config import config
+
+
+class StreamingReply:
+    """
+    Progressively renders an answer as a single Teams message.
+
+    A typing indicator is sent as soon as the turn starts, the first text
+    creates the message, and later text edits that message in place at most
+    once every `interval` seconds. `render` (e.g. add_links) is applied to
+    interim text only when an update is actually sent.
+    """
+
+    def __init__(
+        self,
+        context: TurnContext,
+        interval: float = 1.0,
+        render: Optional[Callable[[str], str]] = None,
+    ):
+        self.context = context
+        self.interval = interval
+        self.render = render or (lambda text: text)
+
+        self.activity_id: Optional[str] = None
+        self.sent_text: Optional[str] = None
+        self.updates = 0
+        self.started_at = time.monotonic()
+        self.first_text_at: Optional[float] = None
+        self._last_sent_at = 0.0
+
+    @property
+    def time_to_first_text(self) -> Optional[float]:
+        if self.first_text_at is None:
+            return None
+        return self.first_text_at - self.started_at
+
+    async def begin(self):
+        self.started_at = time.monotonic()
+        await self.context.send_activity(Activity(type=ActivityTypes.typing))
+
+    async def update(self, text: str):
+        """Offer new interim text; it is sent only if the throttle interval has passed"""
+        if time.monotonic() - self._last_sent_at < self.interval:
+            return
+        await self._send(self.render(text))
+
+    async def end(self, text: str):
+        """Send the final text, which is used as is"""
+        if text != self.sent_text:
+            await self._send(text)
+
+    async def _send(self, text: str):
+        if not text.strip() or text == self.sent_text:
+            return
+
+        if self.activity_id is None:
+            response = await self.context.send_activity(text)
+            self.activity_id = response.id if response else None
+            self.first_text_at = time.monotonic()
+        else:
+            await self.context.update_activity(
+                Activity(id=self.activity_id, type=ActivityTypes.message, text=text)
+            )
+            self.updates += 1
+
+        self.sent_text = text
+        self._last_sent_at = time.monotonic()
+
+
+async def stream_reply(
+    context: TurnContext,
+    chunks: AsyncIterator[str],
+    render: Optional[Callable[[str], str]] = None,
+) -> str:
+    """
+    Send a streamed answer to the user. `chunks` yields the full text so far
+    each time, the last item being the final answer. Returns the final answer.
+    """
+    reply = StreamingReply(context, interval=config.streaming.interval, render=render)
+    await reply.begin()
+
+    text = ""
+    async for text in chunks:
+        await reply.update(text)
+    await reply.end(text)
+    return text
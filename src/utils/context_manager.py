@@ -1,4 +1,5 @@
 from utils.io_manager import read_files
+from utils.retrieval import RetrievalIndex
 import json
 from pathlib import Path
 
@@ -10,11 +11,22 @@ def get_procedures_metadata():
     with METADATA_DIR.open("r") as f:
         return json.load(f)
 
-def yield_procedures(dir_path, allowed_files=[]):
+def iter_procedures(dir_path, allowed_files=[]):
     for name, file_contents in read_files(dir_path, allowed_files=allowed_files):
         if name == METADATA_NAME: continue
+        yield name, file_contents
+
+def yield_procedures(dir_path, allowed_files=[]):
+    for name, file_contents in iter_procedures(dir_path, allowed_files=allowed_files):
         yield f"<document name={name}>{file_contents}</document>\n"
 
+def build_index(dir_path, chunk_tokens=300, embedding=None, allowed_files=[]):
+    return RetrievalIndex.from_documents(
+        iter_procedures(Path(dir_path), allowed_files=allowed_files),
+        chunk_tokens=chunk_tokens,
+        embedding=embedding
+    )
+
 def load_procedures(dir, allowed_files=[]):
     dir = Path(dir)
     return "".join(yield_procedures(dir, allowed_files=allowed_files))
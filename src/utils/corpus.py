@@ -0,0 +1,429 @@
+import asyncio
+import hashlib
+import json
+import mmap
+import os
+import struct
+from array import array
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import cached_property
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+from langchain_core.embeddings import Embeddings
+from utils.context_manager import METADATA_NAME
+from utils.io_manager import list_files, read_file
+from utils.links import LinkMatcher
+from utils.logger import logger
+from utils.retrieval import Chunk, RetrievalIndex, build_shards, chunk_document, format_chunks
+
+
+@dataclass(frozen=True)
+class SourceFile:
+    path: str
+    name: str
+    size: int
+    mtime_ns: int
+    sha256: str
+
+
+@dataclass(frozen=True)
+class Document:
+    source: SourceFile
+    content: str
+    # None when read from a snapshot file chunked with other settings
+    chunks: Optional[Tuple[Chunk, ...]]
+    vectors: Optional[Tuple[Tuple[float, ...], ...]] = None
+
+
+@dataclass
+class CorpusSnapshot:
+    """
+    Immutable view of the procedures corpus at one point in time.
+    A turn should read `CorpusManager.snapshot` once and use that object
+    throughout, so a reload in the middle of the turn does not affect it.
+    """
+    version: int
+    documents: Dict[str, Document] = field(default_factory=dict)
+    metadata: Dict[str, str] = field(default_factory=dict)
+    index: RetrievalIndex = None
+    _shards: Dict[int, List[str]] = field(default_factory=dict, repr=False, compare=False)
+
+    @cached_property
+    def digest(self) -> str:
+        """Content hash of the whole corpus, stable across restarts"""
+        h = hashlib.sha256()
+        for name in sorted(self.documents):
+            h.update(name.encode())
+            h.update(self.documents[name].source.sha256.encode())
+        h.update(json.dumps(self.metadata, sort_keys=True).encode())
+        return h.hexdigest()[:16]
+
+    def shards(self, shard_tokens: int) -> List[str]:
+        """The corpus as document-aligned contexts of at most shard_tokens, computed once per size"""
+        if shard_tokens not in self._shards:
+            self._shards[shard_tokens] = [
+                format_chunks(shard) for shard in build_shards(self.index.chunks, shard_tokens)
+            ]
+        return self._shards[shard_tokens]
+
+    @cached_property
+    def link_matcher(self) -> LinkMatcher:
+        return LinkMatcher(self.metadata)
+
+    @cached_property
+    def context(self) -> str:
+        """The whole corpus as <document> blocks, as produced by load_procedures"""
+        return "".join(
+            f"<document name={name}>{document.content}</document>\n"
+            for name, document in self.documents.items()
+        )
+
+
+# Snapshot file layout: a fixed prefix (magic, format version, header
+# length), a JSON header, then the body. The body starts with the corpus
+# rendered as <document> blocks, followed by the chunk texts and the packed
+# chunk vectors; the header holds their byte offsets relative to the body.
+_MAGIC = b"TBCORPUS"
+_FORMAT_VERSION = 1
+_PREFIX = struct.Struct("<8sIQ")
+
+
+@dataclass
+class SnapshotFile:
+    documents: Dict[str, Document]
+    metadata: Dict[str, str]
+    metadata_source: Optional[SourceFile]
+    # False if the file was chunked or embedded with other settings
+    compatible: bool
+
+
+def embedding_name(embedding: Optional[Embeddings]) -> Optional[str]:
+    if embedding is None:
+        return None
+    model = getattr(embedding, "model", None) or getattr(embedding, "model_name", None) or ""
+    return f"{type(embedding).__module__}.{type(embedding).__name__}:{model}"
+
+
+def write_snapshot_file(
+    path: Path,
+    snapshot: CorpusSnapshot,
+    metadata_source: Optional[SourceFile],
+    chunk_tokens: int,
+    embedding: Optional[str],
+):
+    """Write the snapshot to `path`, replacing any previous file atomically"""
+    body = bytearray()
+    entries = []
+    for name, document in snapshot.documents.items():
+        body += f"<document name={name}>".encode("utf-8")
+        content = document.content.encode("utf-8")
+        entries.append({"source": asdict(document.source), "offset": len(body), "length": len(content)})
+        body += content
+        body += b"</document>\n"
+    context_length = len(body)
+
+    for entry, document in zip(entries, snapshot.documents.values()):
+        chunks = []
+        for chunk in document.chunks:
+            text = chunk.text.encode("utf-8")
+            chunks.append((len(body), len(text), chunk.tokens))
+            body += text
+        entry["chunks"] = chunks
+
+    dimensions = 0
+    for entry, document in zip(entries, snapshot.documents.values()):
+        if document.vectors:
+            dimensions = len(document.vectors[0])
+            entry["vectors"] = len(body)
+            body += array("d", (v for vector in document.vectors for v in vector)).tobytes()
+
+    header = json.dumps({
+        "digest": snapshot.digest,
+        "chunk_tokens": chunk_tokens,
+        "embedding": embedding,
+        "dimensions": dimensions,
+        "context_length": context_length,
+        "metadata": snapshot.metadata,
+        "metadata_source": asdict(metadata_source) if metadata_source else None,
+        "documents": entries,
+    }).encode("utf-8")
+
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Every worker process may write it; each writes its own file and renames it over the old one
+    temporary = path.with_name(f"{path.name}.{os.getpid()}.tmp")
+    with open(temporary, "wb") as f:
+        f.write(_PREFIX.pack(_MAGIC, _FORMAT_VERSION, len(header)))
+        f.write(header)
+        f.write(body)
+    os.replace(temporary, path)
+
+
+def read_snapshot_file(path: Path, chunk_tokens: int, embedding: Optional[str]) -> Optional[SnapshotFile]:
+    """
+    Memory-map a snapshot file and rebuild its documents. Chunks and vectors
+    are only used if the file was built with the same `chunk_tokens` and
+    `embedding`. Returns None if there is no usable file.
+    """
+    try:
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as view:
+            magic, version, header_length = _PREFIX.unpack_from(view)
+            if magic != _MAGIC or version != _FORMAT_VERSION:
+                logger.warning(f"Ignoring corpus snapshot {path}: unknown format")
+                return None
+            header = json.loads(view[_PREFIX.size:_PREFIX.size + header_length])
+            base = _PREFIX.size + header_length
+
+            def text(offset: int, length: int) -> str:
+                return view[base + offset:base + offset + length].decode("utf-8")
+
+            compatible = header["chunk_tokens"] == chunk_tokens and header["embedding"] == embedding
+            dimensions = header["dimensions"]
+            documents = {}
+            for entry in header["documents"]:
+                source = SourceFile(**entry["source"])
+                chunks, vectors = None, None
+                if compatible:
+                    chunks = tuple(
+                        Chunk(source.name, position, text(offset, length), tokens)
+                        for position, (offset, length, tokens) in enumerate(entry["chunks"])
+                    )
+                    if "vectors" in entry:
+                        packed = array("d")
+                        start = base + entry["vectors"]
+                        packed.frombytes(view[start:start + len(chunks) * dimensions * packed.itemsize])
+                        vectors = tuple(
+                            tuple(packed[i:i + dimensions]) for i in range(0, len(packed), dimensions)
+                        )
+                documents[source.name] = Document(source, text(entry["offset"], entry["length"]), chunks, vectors)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError, struct.error):
+        logger.exception(f"Ignoring unreadable corpus snapshot {path}")
+        return None
+
+    metadata_source = header["metadata_source"]
+    return SnapshotFile(
+        documents=documents,
+        metadata=header["metadata"],
+        metadata_source=SourceFile(**metadata_source) if metadata_source else None,
+        compatible=compatible,
+    )
+
+
+class CorpusManager:
+    """
+    Keeps a versioned in-memory snapshot of the procedures directory and its
+    metadata file.
+
+    `refresh()` scans the directory in a worker thread, re-reads only files
+    whose size or mtime changed (and re-chunks only those whose content hash
+    changed), then swaps the new snapshot in with a single assignment.
+    Changed files are read and hashed by a pool of `workers` threads.
+
+    With a `snapshot_path`, every new snapshot is also written to that file,
+    and the first scan starts from it: unchanged files are neither read nor
+    chunked nor embedded again, so a restart only reads what changed.
+    """
+
+    def __init__(
+        self,
+        dir_path,
+        chunk_tokens: int = 300,
+        embedding: Optional[Embeddings] = None,
+        reload_interval: float = 30.0,
+        snapshot_path: Optional[Path] = None,
+        workers: int = 8,
+    ):
+        self.dir_path = Path(dir_path)
+        self.chunk_tokens = chunk_tokens
+        self.embedding = embedding
+        self.reload_interval = reload_interval
+        self.snapshot_path = Path(snapshot_path) if snapshot_path else None
+        self.workers = workers
+
+        self._snapshot = CorpusSnapshot(version=0, index=RetrievalIndex([]))
+        self._loaded = False
+        self._metadata_source: Optional[SourceFile] = None
+        # The sources the snapshot file was written from, to skip rewriting it unchanged
+        self._file_sources: Optional[tuple] = None
+        self._refresh_lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def snapshot(self) -> CorpusSnapshot:
+        return self._snapshot
+
+    @property
+    def is_loaded(self) -> bool:
+        """Whether the directory has been scanned at least once"""
+        return self._loaded
+
+    def load(self) -> CorpusSnapshot:
+        """Blocking scan, for scripts; the app loads the corpus in the background with start()"""
+        snapshot = self._scan()
+        if snapshot is not None:
+            self._snapshot = snapshot
+        self._loaded = True
+        return self._snapshot
+
+    async def wait_loaded(self) -> CorpusSnapshot:
+        """The current snapshot, scanning the directory first if that has not happened yet"""
+        if not self._loaded:
+            await self.refresh()
+        return self._snapshot
+
+    async def refresh(self) -> bool:
+        """Rescan the corpus off the event loop. Returns True if a new snapshot was published."""
+        async with self._refresh_lock:
+            snapshot = await asyncio.to_thread(self._scan)
+            self._loaded = True
+            if snapshot is None:
+                return False
+            self._snapshot = snapshot
+            logger.info(
+                f"Loaded procedures corpus v{snapshot.version} ({snapshot.digest}): "
+                f"{len(snapshot.documents)} documents, {len(snapshot.index.chunks)} chunks"
+            )
+            return True
+
+    async def start(self, _app=None):
+        if self._task is None:
+            self._task = asyncio.create_task(self._reload_loop())
+
+    async def stop(self, _app=None):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _reload_loop(self):
+        while True:
+            try:
+                await self.refresh()
+            except Exception:
+                logger.exception("Failed to reload procedures corpus")
+            await asyncio.sleep(self.reload_interval)
+
+    def _stat(self, path: str) -> Tuple[int, int]:
+        stat = os.stat(path)
+        return stat.st_size, stat.st_mtime_ns
+
+    def _read(self, path: str, previous: Optional[SourceFile]) -> Tuple[SourceFile, Optional[str]]:
+        """Stat a file and read it only if it looks changed. Returns (source, content or None if unchanged)."""
+        size, mtime_ns = self._stat(path)
+        if previous and (previous.size, previous.mtime_ns) == (size, mtime_ns):
+            return previous, None
+
+        content = read_file(path)
+        sha256 = hashlib.sha256(content.encode("utf-8")).hexdigest()
+        name = os.path.basename(path).rsplit(".", 1)[0]
+        source = SourceFile(path, name, size, mtime_ns, sha256)
+        if previous and previous.sha256 == sha256:
+            return source, None
+        return source, content
+
+    def _from_file(self) -> Optional[SnapshotFile]:
+        if self.snapshot_path is None:
+            return None
+        snapshot_file = read_snapshot_file(self.snapshot_path, self.chunk_tokens, embedding_name(self.embedding))
+        if snapshot_file is not None:
+            logger.info(
+                f"Read corpus snapshot {self.snapshot_path}: {len(snapshot_file.documents)} documents"
+                f"{'' if snapshot_file.compatible else ', to be re-chunked'}"
+            )
+            if snapshot_file.compatible:
+                self._file_sources = self._sources(snapshot_file.documents, snapshot_file.metadata_source)
+        return snapshot_file
+
+    @staticmethod
+    def _sources(documents: Dict[str, Document], metadata_source: Optional[SourceFile]) -> tuple:
+        return tuple(d.source for d in documents.values()), metadata_source
+
+    def _scan(self) -> Optional[CorpusSnapshot]:
+        current = self._snapshot
+        previous_by_path = {d.source.path: d for d in current.documents.values()}
+        previous_metadata_source = self._metadata_source
+        metadata = current.metadata
+        if not self._loaded:
+            snapshot_file = self._from_file()
+            if snapshot_file is not None:
+                previous_by_path = {d.source.path: d for d in snapshot_file.documents.values()}
+                previous_metadata_source = snapshot_file.metadata_source
+                metadata = snapshot_file.metadata
+        changed = False
+
+        documents: Dict[str, Document] = {}
+        metadata_source = None
+
+        def read(path: str) -> Tuple[SourceFile, Optional[str]]:
+            if os.path.basename(path).rsplit(".", 1)[0] == METADATA_NAME:
+                return self._read(path, previous_metadata_source)
+            previous = previous_by_path.get(path)
+            return self._read(path, previous.source if previous else None)
+
+        paths = sorted(list_files(self.dir_path)) if self.dir_path.is_dir() else []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            reads = list(pool.map(read, paths))
+
+        for path, (source, content) in zip(paths, reads):
+            if os.path.basename(path).rsplit(".", 1)[0] == METADATA_NAME:
+                metadata_source = source
+                if content is not None:
+                    metadata = json.loads(content)
+                    changed = True
+                continue
+
+            previous = previous_by_path.get(path)
+            if content is None:
+                if previous.chunks is not None:
+                    documents[source.name] = Document(source, previous.content, previous.chunks, previous.vectors)
+                    continue
+                content = previous.content
+
+            changed = True
+            chunks = tuple(chunk_document(source.name, content, self.chunk_tokens))
+            vectors = None
+            if self.embedding and chunks:
+                vectors = tuple(tuple(v) for v in self.embedding.embed_documents([c.text for c in chunks]))
+            documents[source.name] = Document(source, content, chunks, vectors)
+
+        if metadata_source is None and previous_metadata_source is not None:
+            metadata = {}
+            changed = True
+        self._metadata_source = metadata_source
+
+        if set(documents) != set(current.documents) or metadata != current.metadata:
+            changed = True
+        if not changed:
+            return None
+
+        chunks: List[Chunk] = [c for d in documents.values() for c in d.chunks]
+        vectors = None
+        if self.embedding:
+            vectors = [list(v) for d in documents.values() for v in (d.vectors or ())]
+        index = RetrievalIndex(chunks, embedding=self.embedding, vectors=vectors)
+
+        snapshot = CorpusSnapshot(
+            version=current.version + 1,
+            documents=documents,
+            metadata=metadata,
+            index=index,
+        )
+        # Compile the link matcher here, in the scan thread, rather than on first use
+        snapshot.link_matcher
+
+        sources = self._sources(documents, metadata_source)
+        if self.snapshot_path is not None and sources != self._file_sources:
+            try:
+                write_snapshot_file(
+                    self.snapshot_path, snapshot, metadata_source, self.chunk_tokens, embedding_name(self.embedding)
+                )
+                self._file_sources = sources
+            except OSError:
+                logger.exception(f"Failed to write corpus snapshot {self.snapshot_path}")
+        return snapshot
+
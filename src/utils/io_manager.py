@@ -1,9 +1,16 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from dotenv import load_dotenv
 
-def get_env(env_name, default=None):
+@lru_cache(maxsize=None)
+def _environment():
+    """The process environment with .env applied, read once on first use"""
     load_dotenv()
-    return os.environ.get(env_name, default)
+    return dict(os.environ)
+
+def get_env(env_name, default=None):
+    return _environment().get(env_name, default)
 
 def list_files(dir_path):
     for root, dirs, files in os.walk(dir_path):
@@ -13,16 +20,16 @@ def list_files(dir_path):
 def read_file(file_path):
     with open(file_path, "r", encoding="utf-8") as f:
         return f.read()
-    
-def list_files(dir_path):
-    for root, dirs, files in os.walk(dir_path):
-        for file in files:
-            yield os.path.join(root, file)
 
-def read_files(dir_path, allowed_files=[], ignored_files=[]):
+def read_files(dir_path, allowed_files=[], ignored_files=[], workers=8):
+    """(name, content) of the files under dir_path in walk order, read by a pool of `workers` threads"""
+    file_paths = []
     for file_path in list_files(dir_path):
         file_name = os.path.basename(file_path).rsplit(".", 1)[0]
         if allowed_files and file_name not in allowed_files: continue
         if file_name in ignored_files: continue
-        
-        yield file_name, read_file(file_path)
\ No newline at end of file
+        file_paths.append(file_path)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for file_path, content in zip(file_paths, pool.map(read_file, file_paths)):
+            yield os.path.basename(file_path).rsplit(".", 1)[0], content
\ No newline at end of file
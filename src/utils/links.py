@@ -0,0 +1,83 @@
+import re
+from typing import Dict, List
+
+# Text that already is a link and must be copied through untouched
+_EXISTING_LINK = r"\[[^\]]*\]\([^)]*\)|<https?://[^>\s]*>|https?://[^\s)\]]+"
+_MARKDOWN_LINK = re.compile(r"\[([^\]]*)\]\(([^)]*)\)")
+
+
+def _trie_pattern(names: List[str]) -> str:
+    """
+    Build a regex equivalent to the alternation of names, factored as a trie.
+    Longer continuations are tried before a shorter name ends, so the
+    longest name wins at every position.
+    """
+    trie: Dict = {}
+    for name in names:
+        node = trie
+        for char in name:
+            node = node.setdefault(char, {})
+        node[""] = True
+
+    def emit(node: Dict) -> str:
+        ends = "" in node
+        branches = [re.escape(char) + emit(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ""
+        body = branches[0] if len(branches) == 1 else "(?:" + "|".join(branches) + ")"
+        if ends:
+            return f"(?:{body})?"
+        return body
+
+    return emit(trie)
+
+
+class LinkMatcher:
+    """
+    Links procedure names to their URLs in a single left-to-right pass.
+    Existing markdown links and bare URLs are skipped, and a name is never
+    matched inside another name or inside a link that was just inserted.
+    """
+
+    def __init__(self, metadata: Dict[str, str]):
+        self._urls: Dict[str, str] = {}
+        for name, url in metadata.items():
+            if name.strip():
+                self._urls[name.strip()] = url
+
+        if self._urls:
+            names = _trie_pattern(list(self._urls))
+            self._pattern = re.compile(f"(?P<link>{_EXISTING_LINK})|(?P<name>{names})")
+        else:
+            self._pattern = None
+
+    def _replace(self, match: re.Match) -> str:
+        name = match.group("name")
+        if name is None:
+            return match.group(0)
+        return f"[{name}]({self._urls[name]})"
+
+    def apply(self, text: str) -> str:
+        if self._pattern is None:
+            return text
+        return self._pattern.sub(self._replace, text)
+
+    def linked(self, text: str) -> List[str]:
+        """Names that text links to their URLs, e.g. after apply(), in order of first appearance"""
+        found = {}
+        for match in _MARKDOWN_LINK.finditer(text):
+            name, url = match.group(1), match.group(2)
+            if self._urls.get(name) == url:
+                found.setdefault(name, None)
+        return list(found)
+
+    def find(self, text: str) -> List[str]:
+        """Names mentioned in text outside of existing links, in order of first appearance"""
+        if self._pattern is None:
+            return []
+        found = {}
+        for match in self._pattern.finditer(text):
+            name = match.group("name")
+            if name is not None:
+                found.setdefault(name, None)
+        return list(found)
@@ -1,29 +1,126 @@
+import json
 import os
+import random
+import sys
+import traceback
+import zlib
+from typing import Dict, Optional
 from loguru import logger
 from utils.config import config
 
-os.makedirs("logs", exist_ok=True)
-
-logger.remove()
-
-logger.add(
-    f"logs/{config.log.file}.log",
-    format="{time:YYYY-MM-DD HH:mm:ss} - {level} - {file.path}:{line} - {message}",
-    rotation="10 MB",
-    compression="zip",
-    enqueue=True,  # Make logging thread-safe
-    backtrace=True,  # Include full traceback on errors
-    diagnose=True  # Include variable values in tracebacks
-)
-
-# Add console handler
-logger.add(
-    sink=lambda msg: print(msg, end=""),
-    format="<green>{time:YYYY-MM-DD HH:mm:ss}</green> - <level>{level}</level> - {file.path}:{line} - <level>{message}</level>",
-    enqueue=True,  # Make logging thread-safe
-    backtrace=True,  # Include full traceback on errors
-    diagnose=True  # Include variable values in tracebacks
-)
+_TEXT_FORMAT = "{time:YYYY-MM-DD HH:mm:ss} - {level} - {file.path}:{line} - {message}"
+_CONSOLE_FORMAT = "<green>{time:YYYY-MM-DD HH:mm:ss}</green> - <level>{level}</level> - {file.path}:{line} - <level>{message}</level>"
+# Set on a turn with logger.contextualize(); None outside of turns
+_CONTEXT = {"conversation_id": None, "turn_id": None}
+
+
+def _text_format(template: str):
+    def format(record) -> str:
+        ids = [record["extra"].get(name) for name in _CONTEXT]
+        context = " [" + ":".join(str(i) for i in ids if i) + "]" if any(ids) else ""
+        return template + context.replace("{", "{{").replace("}", "}}") + "\n{exception}"
+    return format
+
+
+def _json_format(record) -> str:
+    """One JSON object per line, with the turn's context and any bound extra"""
+    entry = {
+        "time": record["time"].isoformat(),
+        "level": record["level"].name,
+        "message": record["message"],
+        "source": f"{record['name']}:{record['function']}:{record['line']}",
+    }
+    entry.update((k, v) for k, v in record["extra"].items() if v is not None and not k.startswith("_"))
+    if record["exception"] is not None:
+        entry["exception"] = "".join(traceback.format_exception(*record["exception"]))
+    # The sink formats what we return, so the JSON goes through extra rather than into the template
+    record["extra"]["_json"] = json.dumps(entry, default=str)
+    return "{extra[_json]}\n"
+
+
+def _sampler(rates: Dict[str, float]):
+    """
+    Filter that keeps the given share of lines at each level. Lines of a
+    turn are kept or dropped together, so a sampled turn can be followed
+    from start to end; levels without a rate are always kept.
+    """
+    thresholds = {level: rate * 10000 for level, rate in rates.items() if rate < 1}
+
+    def keep(record) -> bool:
+        threshold = thresholds.get(record["level"].name)
+        if threshold is None:
+            return True
+        turn_id = record["extra"].get("turn_id")
+        if turn_id:
+            return zlib.crc32(turn_id.encode()) % 10000 < threshold
+        return random.random() * 10000 < threshold
+
+    return keep
+
+
+def setup_logging(
+    file: Optional[str],
+    format: str = "text",
+    level: str = "INFO",
+    sample: Optional[Dict[str, float]] = None,
+    diagnose: bool = False,
+    console: bool = True,
+    enqueue: bool = False,
+):
+    """
+    (Re)configure the sinks: a rotated file under logs/ and the console.
+    "json" writes one object per line for log collectors. `diagnose` adds
+    variable values to tracebacks, which can include user messages and
+    keys, so it is for dev profiles only. `enqueue` hands lines to a writer
+    thread, which forked workers need to share the file safely, at several
+    times the cost per line.
+    """
+    logger.remove()
+    logger.configure(extra=_CONTEXT)
+    options = dict(
+        level=level.upper(),
+        filter=_sampler({name.upper(): float(rate) for name, rate in (sample or {}).items()}),
+        enqueue=enqueue,
+        backtrace=True,  # Include full traceback on errors
+        diagnose=diagnose,  # Include variable values in tracebacks
+    )
+    json_format = format == "json"
+
+    if file:
+        os.makedirs("logs", exist_ok=True)
+        logger.add(
+            f"logs/{file}.log",
+            format=_json_format if json_format else _text_format(_TEXT_FORMAT),
+            rotation="10 MB",
+            compression="zip",
+            **options
+        )
+    if console:
+        logger.add(
+            sys.stdout,
+            format=_json_format if json_format else _text_format(_CONSOLE_FORMAT),
+            colorize=not json_format and sys.stdout.isatty(),
+            **options
+        )
+
+
+def setup_from_config(workers: int = 1):
+    """
+    Configure logging from the log settings, for a server of `workers`
+    processes. Importing this module configures it for one process;
+    app.serve calls it again with the worker count before forking.
+    """
+    setup_logging(
+        config.log.file,
+        format=config.log.format,
+        level=config.log.level,
+        sample=config.log.sample,
+        diagnose=config.log.diagnose,
+        enqueue=workers > 1,
+    )
+
+
+setup_from_config()
 
 # Example usage
 if __name__ == "__main__":
@@ -0,0 +1,236 @@
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+COUNT_BUCKETS = (0, 1, 2, 3, 4, 5, 8, 13, 21)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2500, 5000, 10000, 25000, 50000, 100000)
+
+
+def _key(labels: Optional[Dict[str, str]]) -> LabelKey:
+    return tuple(sorted(labels.items())) if labels else ()
+
+
+def _format_labels(key: LabelKey, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(key) + ([extra] if extra else [])
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self._values: Dict[LabelKey, float] = {}
+
+    def inc(self, value: float = 1, **labels):
+        key = _key(labels)
+        self._values[key] = self._values.get(key, 0) + value
+
+    def value(self, **labels) -> float:
+        return self._values.get(_key(labels), 0)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for key, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram; observing is a bisect and three increments"""
+
+    def __init__(self, name: str, help: str, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self._series: Dict[LabelKey, List] = {}
+
+    def observe(self, value: float, **labels):
+        key = _key(labels)
+        series = self._series.get(key)
+        if series is None:
+            series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+        series[2] += 1
+
+    def count(self, **labels) -> int:
+        series = self._series.get(_key(labels))
+        return series[2] if series else 0
+
+    def sum(self, **labels) -> float:
+        series = self._series.get(_key(labels))
+        return series[1] if series else 0.0
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for key, (counts, total, count) in self._series.items():
+            cumulative = 0
+            for bound, n in zip(self.buckets, counts):
+                cumulative += n
+                lines.append(f"{self.name}_bucket{_format_labels(key, ('le', str(bound)))} {cumulative}")
+            lines.append(f"{self.name}_bucket{_format_labels(key, ('le', '+Inf'))} {count}")
+            lines.append(f"{self.name}_sum{_format_labels(key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(key)} {count}")
+        return lines
+
+
+class Registry:
+    def __init__(self, prefix: str = "chatbot"):
+        self.prefix = prefix
+        self._metrics: Dict[str, object] = {}
+        self._collectors: List[Tuple[str, Callable[[], Dict[str, float]]]] = []
+
+    def counter(self, name: str, help: str) -> Counter:
+        name = f"{self.prefix}_{name}"
+        return self._metrics.setdefault(name, Counter(name, help))
+
+    def histogram(self, name: str, help: str, buckets=DEFAULT_BUCKETS) -> Histogram:
+        name = f"{self.prefix}_{name}"
+        return self._metrics.setdefault(name, Histogram(name, help, buckets))
+
+    def register_collector(self, name: str, collect: Callable[[], Dict[str, float]]):
+        """Export every key of collect()'s dict as a gauge named <prefix>_<name>_<key>"""
+        self._collectors.append((name, collect))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        for name, collect in self._collectors:
+            for key, value in collect().items():
+                gauge = f"{self.prefix}_{name}_{key}"
+                lines.append(f"# TYPE {gauge} gauge")
+                lines.append(f"{gauge} {float(value)}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+stage_seconds = registry.histogram("stage_seconds", "Time spent in each stage of a turn")
+turns_total = registry.counter("turns_total", "Turns handled, by outcome")
+llm_calls_per_turn = registry.histogram(
+    "llm_calls_per_turn", "Model round-trips per turn, by caller", buckets=COUNT_BUCKETS
+)
+tool_calls_per_turn = registry.histogram(
+    "tool_calls_per_turn", "Tool invocations per turn", buckets=COUNT_BUCKETS
+)
+tokens_per_turn = registry.histogram(
+    "tokens_per_turn", "Prompt and completion tokens per turn", buckets=TOKEN_BUCKETS
+)
+tokens_total = registry.counter("tokens_total", "Prompt and completion tokens, by caller")
+route_decisions_total = registry.counter("route_decisions_total", "Messages routed, by route")
+route_seconds = registry.histogram("route_seconds", "Time to answer a message, by route")
+route_saved_seconds_total = registry.counter(
+    "route_saved_seconds_total", "Estimated time saved by not running the agent, by route"
+)
+llm_attempts_total = registry.counter(
+    "llm_attempts_total", "Calls to a model backend, by model, backend and outcome"
+)
+llm_attempt_seconds = registry.histogram(
+    "llm_attempt_seconds", "Duration of successful calls to a model backend, by model and backend"
+)
+llm_hedges_total = registry.counter(
+    "llm_hedges_total", "Duplicate calls started on a second backend, by model and reason"
+)
+
+outbound_activities_total = registry.counter(
+    "outbound_activities_total", "Activities sent or updated through the connector, by kind"
+)
+outbound_throttled_total = registry.counter(
+    "outbound_throttled_total", "Connector calls rejected with 429 Too Many Requests, by kind"
+)
+
+
+@dataclass
+class TurnTrace:
+    """What one turn spent, collected while trace_turn() is active"""
+    stages: Dict[str, float] = field(default_factory=dict)
+    llm_calls: Dict[str, int] = field(default_factory=dict)
+    tool_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+
+
+_trace: ContextVar[Optional[TurnTrace]] = ContextVar("turn_trace", default=None)
+
+
+@contextmanager
+def trace_turn() -> Iterator[TurnTrace]:
+    """
+    Collect the stage times and model usage of the work done inside the
+    block, including tasks it starts, on top of the process-wide metrics.
+    """
+    trace = TurnTrace()
+    token = _trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _trace.reset(token)
+
+
+def current_trace() -> Optional[TurnTrace]:
+    return _trace.get()
+
+
+class Stopwatch:
+    """
+    Time since it was started, leaving out the time spent in paused()
+    blocks, e.g. while a generator is suspended at a yield and its consumer
+    runs.
+    """
+
+    __slots__ = ("start", "paused_seconds")
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.paused_seconds = 0.0
+
+    @contextmanager
+    def paused(self) -> Iterator[None]:
+        paused_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.paused_seconds += time.perf_counter() - paused_at
+
+    @property
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.start - self.paused_seconds
+
+
+class span(Stopwatch):
+    """
+    Times a block and records it under stage_seconds{stage=name}.
+    Works as a sync or async context manager. Time spent in its paused()
+    blocks is not counted.
+    """
+
+    __slots__ = ("stage",)
+
+    def __init__(self, stage: str):
+        self.stage = stage
+
+    def __enter__(self):
+        Stopwatch.__init__(self)
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        elapsed = self.elapsed
+        stage_seconds.observe(elapsed, stage=self.stage)
+        trace = _trace.get()
+        if trace is not None:
+            trace.stages[self.stage] = trace.stages.get(self.stage, 0.0) + elapsed
+
+    async def __aenter__(self):
+        return self.__enter__()
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.__exit__(exc_type, exc_val, exc_tb)
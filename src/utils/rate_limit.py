@@ -0,0 +1,38 @@
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Allows `rate` acquisitions per second on average and `burst` at once.
+    Waiters are served in order. `pause()` holds every acquisition back,
+    e.g. for as long as the server asked us to.
+    """
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._not_before = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self) -> float:
+        """Take a token, waiting for one if needed; returns the seconds waited"""
+        start = time.monotonic()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                delay = max(self._not_before - now, (1 - self._tokens) / self.rate)
+                if delay <= 0:
+                    self._tokens -= 1
+                    return time.monotonic() - start
+                await asyncio.sleep(delay)
+
+    def pause(self, seconds: float):
+        self._not_before = max(self._not_before, time.monotonic() + seconds)
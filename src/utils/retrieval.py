@@ -0,0 +1,267 @@
+import importlib
+import math
+import re
+import zlib
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Tuple
+from langchain_core.embeddings import Embeddings
+from utils.tokens import count_tokens
+
+_WORD_RE = re.compile(r"\w+")
+_SENTENCE_RE = re.compile(r"(?<=[.!?])\s+")
+STOPWORDS = frozenset(
+    "a an and are as at be by can do does for from how i if in is it me my "
+    "of on or our should that the this to us was we what when where which who "
+    "why will with you your".split()
+)
+
+def tokenize(text: str) -> List[str]:
+    return [w for w in _WORD_RE.findall(text.lower()) if w not in STOPWORDS]
+
+
+@dataclass(frozen=True)
+class Chunk:
+    document: str
+    position: int
+    text: str
+    tokens: int
+
+
+def chunk_document(name: str, text: str, chunk_tokens: int = 300) -> List[Chunk]:
+    """Split a document into chunks of about chunk_tokens, breaking on paragraphs, then sentences"""
+    pieces = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= chunk_tokens:
+            pieces.append(paragraph)
+        else:
+            pieces.extend(s for s in _SENTENCE_RE.split(paragraph) if s)
+
+    chunks, current, current_tokens = [], [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current and current_tokens + tokens > chunk_tokens:
+            chunks.append("\n\n".join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append("\n\n".join(current))
+
+    return [Chunk(name, i, chunk, count_tokens(chunk)) for i, chunk in enumerate(chunks)]
+
+
+class BM25Index:
+    """Okapi BM25 over pre-tokenized documents"""
+
+    def __init__(self, documents: List[List[str]], k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.lengths = [len(doc) for doc in documents]
+        self.avg_length = sum(self.lengths) / len(documents) if documents else 0.0
+        self.postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for i, doc in enumerate(documents):
+            for term, tf in Counter(doc).items():
+                self.postings[term].append((i, tf))
+
+        n = len(documents)
+        self.idf = {
+            term: math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for term, postings in self.postings.items()
+        }
+
+    def scores(self, query: List[str]) -> Dict[int, float]:
+        scores: Dict[int, float] = defaultdict(float)
+        for term in set(query):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                norm = 1 - self.b + self.b * self.lengths[i] / self.avg_length
+                scores[i] += idf * tf * (self.k1 + 1) / (tf + self.k1 * norm)
+        return scores
+
+
+class HashingEmbedding(Embeddings):
+    """
+    Deterministic local embedding based on feature hashing of word tokens.
+    Needs no model or network, which makes it a stand-in for a real
+    embedding backend in benchmarks and offline runs.
+    """
+
+    def __init__(self, size: int = 256):
+        self.size = size
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.size
+        for token in tokenize(text):
+            h = zlib.crc32(token.encode())
+            vector[h % self.size] += 1.0 if h & 0x80000000 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [self._embed(text) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed(text)
+
+
+def _cosine(a: List[float], b: List[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    norm = math.sqrt(sum(x * x for x in a)) * math.sqrt(sum(y * y for y in b))
+    return dot / norm if norm else 0.0
+
+
+# Letters a query term and a corpus term must share to count as related in fallback()
+PREFIX_LETTERS = 4
+
+
+class RetrievalIndex:
+    """
+    Lexical (BM25) index over document chunks, optionally blended with a
+    LangChain Embeddings backend for semantic similarity.
+    """
+
+    def __init__(
+        self,
+        chunks: List[Chunk],
+        embedding: Optional[Embeddings] = None,
+        embedding_weight: float = 0.5,
+        vectors: Optional[List[List[float]]] = None,
+    ):
+        self.chunks = chunks
+        self.embedding = embedding
+        self.embedding_weight = embedding_weight
+        # The document name is indexed with its chunks so titles match queries
+        self.bm25 = BM25Index([tokenize(f"{c.document} {c.text}") for c in chunks])
+        if vectors is None and embedding and chunks:
+            vectors = embedding.embed_documents([c.text for c in chunks])
+        self.vectors = vectors if embedding and chunks else None
+        self.prefixes: Dict[str, List[str]] = defaultdict(list)
+        for term in self.bm25.idf:
+            if len(term) >= PREFIX_LETTERS:
+                self.prefixes[term[:PREFIX_LETTERS]].append(term)
+
+    @classmethod
+    def from_documents(
+        cls,
+        documents: Iterable[Tuple[str, str]],
+        chunk_tokens: int = 300,
+        embedding: Optional[Embeddings] = None,
+    ) -> "RetrievalIndex":
+        chunks = [chunk for name, text in documents for chunk in chunk_document(name, text, chunk_tokens)]
+        return cls(chunks, embedding=embedding)
+
+    @property
+    def total_tokens(self) -> int:
+        return sum(c.tokens for c in self.chunks)
+
+    def search(self, query: str, top_k: int = 8, token_budget: Optional[int] = None) -> List[Chunk]:
+        """Return up to top_k best chunks whose combined size fits in token_budget"""
+        scores = self.bm25.scores(tokenize(query))
+        if scores:
+            best = max(scores.values())
+            scores = {i: s / best for i, s in scores.items()}
+
+        if self.vectors is not None:
+            query_vector = self.embedding.embed_query(query)
+            w = self.embedding_weight
+            scores = {
+                i: (1 - w) * scores.get(i, 0.0) + w * max(0.0, _cosine(query_vector, vector))
+                for i, vector in enumerate(self.vectors)
+            }
+
+        return self._select(scores, top_k, token_budget)
+
+    def fallback(self, query: str, top_k: int = 8, token_budget: Optional[int] = None) -> Tuple[List[Chunk], Optional[str]]:
+        """
+        Chunks for a query that search() found nothing for, and the signal
+        used: "prefix" ranks chunks by the corpus terms that share their first
+        letters with a query term (vacations and vacation, onboard and
+        onboarding), and "corpus" is the whole corpus, in order, when it fits
+        in token_budget. ([], None) when neither applies.
+        """
+        related = [
+            term
+            for word in tokenize(query) if len(word) >= PREFIX_LETTERS
+            for term in self.prefixes.get(word[:PREFIX_LETTERS], ())
+        ]
+        chunks = self._select(self.bm25.scores(related), top_k, token_budget)
+        if chunks:
+            return chunks, "prefix"
+        if self.chunks and (token_budget is None or self.total_tokens <= token_budget):
+            return list(self.chunks), "corpus"
+        return [], None
+
+    def _select(self, scores: Dict[int, float], top_k: int, token_budget: Optional[int]) -> List[Chunk]:
+        ranked = sorted((i for i, s in scores.items() if s > 0), key=lambda i: -scores[i])
+
+        selected, used = [], 0
+        for i in ranked:
+            if len(selected) == top_k:
+                break
+            chunk = self.chunks[i]
+            if token_budget is not None and used + chunk.tokens > token_budget:
+                continue
+            selected.append(chunk)
+            used += chunk.tokens
+        return selected
+
+
+def format_chunks(chunks: List[Chunk]) -> str:
+    """Render chunks as <document> blocks, one per document, in original order"""
+    by_document: Dict[str, List[Chunk]] = {}
+    for chunk in chunks:
+        by_document.setdefault(chunk.document, []).append(chunk)
+
+    blocks = []
+    for name, parts in by_document.items():
+        text = "\n\n".join(c.text for c in sorted(parts, key=lambda c: c.position))
+        blocks.append(f"<document name={name}>{text}</document>\n")
+    return "".join(blocks)
+
+
+def build_shards(chunks: List[Chunk], shard_tokens: int) -> List[List[Chunk]]:
+    """
+    Pack chunks, in corpus order, into shards of at most shard_tokens. Whole
+    documents go into one shard; a document is only split, at chunk
+    boundaries, when it does not fit in a shard on its own.
+    """
+    by_document: Dict[str, List[Chunk]] = {}
+    for chunk in chunks:
+        by_document.setdefault(chunk.document, []).append(chunk)
+
+    shards, current, used = [], [], 0
+    for parts in by_document.values():
+        tokens = sum(c.tokens for c in parts)
+        if current and used + tokens > shard_tokens:
+            shards.append(current)
+            current, used = [], 0
+        for chunk in parts:
+            if current and used + chunk.tokens > shard_tokens:
+                shards.append(current)
+                current, used = [], 0
+            current.append(chunk)
+            used += chunk.tokens
+    if current:
+        shards.append(current)
+    return shards
+
+
+def load_embedding(name: Optional[str]) -> Optional[Embeddings]:
+    """
+    Resolve the configured embedding backend: None, "hashing" for the local
+    stub, or "package.module:ClassName" for any LangChain Embeddings class.
+    """
+    if not name:
+        return None
+    if name == "hashing":
+        return HashingEmbedding()
+
+    module_name, _, class_name = name.partition(":")
+    module = importlib.import_module(module_name)
+    return getattr(module, class_name)()
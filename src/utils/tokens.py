@@ -0,0 +1,20 @@
+import re
+
+# Rough subword approximation: words are split into pieces of at most four
+# characters and every punctuation mark counts as its own token. Close enough
+# to Gemini's tokenizer for budgeting, and it needs no model files.
+_TOKEN_RE = re.compile(r"\w{1,4}|[^\w\s]")
+
+def count_tokens(text: str) -> int:
+    return len(_TOKEN_RE.findall(text))
+
+def truncate_tokens(text: str, max_tokens: int) -> str:
+    """Cut text after roughly max_tokens tokens"""
+    for i, match in enumerate(_TOKEN_RE.finditer(text)):
+        if i == max_tokens:
+            return text[:match.start()].rstrip()
+    return text
+
+if __name__ == "__main__":
+    sample = "How do I request paid time off (PTO) in WorkDay?"
+    print(count_tokens(sample), truncate_tokens(sample, 5))